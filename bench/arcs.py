@@ -0,0 +1,107 @@
+"""
+Benchmark of arc sampling (ArcGroups.arc_sequences) against the previous per-step loop.
+
+    python -m bench.arcs [chart files...]
+
+Without arguments, the most arc-heavy charts in assets/songs and dl are used,
+together with a synthetic arc-heavy chart.
+"""
+import sys
+import math
+import random
+import argparse
+from lib import chart as _chart
+from lib.render import load
+from .parse import best, heaviest_charts
+
+def _legacy_arc_sequence(arc, speed):
+    # ArcGroups.arc_sequence before vectorization
+    delta_dis = _chart.ArcGroups.DRAW_DIFFERENTIAL_LENGTH
+    points = []
+    if arc.easing.x == _chart.Easing.BOTH:
+        time_start, time_end, time_half = arc.start, arc.end, (arc.start + arc.end) / 2
+        y_current, y_half = _chart._time_to_height(time_start, speed), _chart._time_to_height(time_half, speed)
+        while y_current < y_half:
+            time_current = _chart._height_to_time(y_current, speed)
+            points.append(time_current)
+            current_slope = arc.x_real_slope(speed, arc.x_slope(time_current))
+            y_current += delta_dis / math.sqrt(1 + current_slope * current_slope)
+        rev_points = [time_end - (time_current - time_start) for time_current in points]
+        points.append(time_half)
+        points.extend(reversed(rev_points))
+    else:
+        time_start, time_end = arc.start, arc.end
+        y_current, y_end = _chart._time_to_height(time_start, speed), _chart._time_to_height(time_end, speed)
+        while y_current < y_end:
+            time_current = _chart._height_to_time(y_current, speed)
+            points.append(time_current)
+            current_slope = arc.x_real_slope(speed, arc.x_slope(time_current))
+            y_current += delta_dis / math.sqrt(1 + current_slope * current_slope)
+        points.append(time_end)
+    return points
+
+def synthetic_arc_chart(arcs=3000, seed=0):
+    rng = random.Random(seed)
+    chart = _chart.Chart()
+    timing_group = _chart.TimingGroup()
+    timing_group.timings.append(_chart.Timing(0, 120.0, 4.0))
+    time_current = 0
+    easings = ('s', 'b', 'si', 'so', 'sisi', 'soso', 'siso', 'sosi')
+    for _ in range(arcs):
+        duration = rng.choice((250, 500, 1000, 2000, 4000))
+        x_start, x_end = rng.uniform(-0.5, 1.5), rng.uniform(-0.5, 1.5)
+        timing_group.arcs.append(_chart.Arc(
+            time_current, time_current + duration, x_start, x_end, rng.choice(easings),
+            rng.uniform(0, 1), rng.uniform(0, 1), rng.randint(0, 1), 'none', rng.random() < 0.3,
+        ))
+        time_current += rng.choice((0, duration // 2, duration))
+    chart.timing_groups.append(timing_group)
+    return chart
+
+def bench_chart(name, chart, speed=2000, repeat=3):
+    chart.refine()
+    timing_group = _chart.TimingGroup()
+    for tg in chart.timing_groups:
+        timing_group.merge(tg)
+    timing_group.refine()
+    groups = [[arc for arc in group.arcs if arc.start < arc.end] for group in timing_group.arc_groups]
+    arcs = [arc for group in groups for arc in group]
+
+    def legacy():
+        return [_legacy_arc_sequence(arc, speed) for arc in arcs]
+
+    def vectorized():
+        return [_chart.ArcGroups.arc_sequences(group, speed) for group in groups]
+
+    def vectorized_all():
+        return _chart.ArcGroups.arc_sequences(arcs, speed)
+
+    legacy_samples = sum(map(len, legacy()))
+    vectorized_samples = sum(sum(map(len, sequences)) for sequences in vectorized())
+    legacy_time = best(legacy, repeat)
+    vectorized_time = best(vectorized, repeat)
+    vectorized_all_time = best(vectorized_all, repeat)
+    print(f'{name}: {len(arcs)} arcs in {len(groups)} groups, samples {legacy_samples} -> {vectorized_samples}')
+    print(f'    legacy: {legacy_time * 1000:.1f} ms')
+    print(f'    vectorized per group: {vectorized_time * 1000:.1f} ms ({legacy_time / vectorized_time:.1f}x)')
+    print(f'    vectorized all arcs: {vectorized_all_time * 1000:.1f} ms ({legacy_time / vectorized_all_time:.1f}x)')
+    return legacy_time, vectorized_time, vectorized_all_time
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark arc sampling.')
+    parser.add_argument('files', nargs='*', help='Chart files. The default is the most arc-heavy official charts.')
+    parser.add_argument('--limit', type=int, default=5, help='Number of official charts to use.')
+    parser.add_argument('--speed', '-s', type=float, default=2000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    if args.files:
+        charts = [(file, load(file)) for file in args.files]
+    else:
+        charts = heaviest_charts(lambda chart: sum(len(tg.arcs) for tg in chart.timing_groups), args.limit)
+        charts.append(('synthetic', synthetic_arc_chart()))
+    for name, chart in charts:
+        bench_chart(name, chart, args.speed, args.repeat)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,60 @@
+"""
+Compare two JSON results of bench.pipeline.
+
+    python -m bench.compare base.json result.json [--threshold 0.1]
+
+Exits with 1 if any stage is slower than the base by more than the threshold.
+"""
+import sys
+import json
+import argparse
+
+def compare(base, result, threshold=0.1):
+    """
+    Returns a list of (case, stage, base seconds, seconds, ratio, regressed).
+    Cases and stages missing from either side are skipped.
+    """
+    base_cases = {case['name']: case for case in base['cases']}
+    res = []
+    for case in result['cases']:
+        base_case = base_cases.get(case['name'], None)
+        if base_case is None:
+            continue
+        for stage, stage_res in case['stages'].items():
+            base_stage = base_case['stages'].get(stage, None)
+            if base_stage is None:
+                continue
+            base_time, stage_time = base_stage['time'], stage_res['time']
+            ratio = stage_time / base_time if base_time > 0 else float('inf')
+            res.append((case['name'], stage, base_time, stage_time, ratio, ratio > 1 + threshold))
+    return res
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare two results of bench.pipeline.')
+    parser.add_argument('base', type=str)
+    parser.add_argument('result', type=str)
+    parser.add_argument('--threshold', type=float, default=0.1, help='Relative slowdown reported as a regression. The default value is 0.1.')
+    args = parser.parse_args(argv)
+
+    with open(args.base, 'r', encoding='utf8') as f:
+        base = json.load(f)
+    with open(args.result, 'r', encoding='utf8') as f:
+        result = json.load(f)
+    for key in ('python', 'numpy', 'pillow'):
+        if base['environment'].get(key) != result['environment'].get(key):
+            print(f'{key}: {base["environment"].get(key)} -> {result["environment"].get(key)}')
+
+    rows = compare(base, result, args.threshold)
+    regressed = False
+    case_name = None
+    for name, stage, base_time, stage_time, ratio, is_regressed in rows:
+        if name != case_name:
+            print(name)
+            case_name = name
+        mark = '  REGRESSION' if is_regressed else ''
+        print(f'    {stage}: {base_time * 1000:.1f} ms -> {stage_time * 1000:.1f} ms ({ratio:.2f}x){mark}')
+        regressed = regressed or is_regressed
+    return 1 if regressed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,147 @@
+"""
+Benchmark of memory held by parsed charts: bytes per note object before and after slotted classes.
+
+    python -m bench.memory [chart files...]
+
+Without arguments, every chart in assets/songs and dl is used.
+If there is none, synthetic charts are generated instead.
+Only the objects are measured, the numbers and strings they refer to are shared by both layouts.
+"""
+import gc
+import sys
+import argparse
+import tracemalloc
+from lib import chart as _chart
+from lib import reader
+from .parse import chart_files
+from .synthetic import generate
+
+# The note classes before __slots__, each carrying a __dict__
+class _LegacyEasing:
+    def __init__(self, easing):
+        easing = _chart.Easing.get(easing)
+        self.__x = easing.x
+        self.__y = easing.y
+
+class _LegacyGroundNote:
+    def __init__(self, start, lane):
+        self.start = start
+        self.lane = lane
+
+class _LegacyHold:
+    def __init__(self, start, end, lane):
+        self.start = start
+        self.end = end
+        self.lane = lane
+
+class _LegacyArc:
+    def __init__(self, start, end, x_start, x_end, easing, y_start, y_end, color, hitsound, skyline, taps=None):
+        self.start = start
+        self.end = end
+        self.x_start = x_start
+        self.x_end = x_end
+        self.y_start = y_start
+        self.y_end = y_end
+        self.easing = _LegacyEasing(easing)
+        self.color = color
+        self.hitsound = hitsound
+        self.skyline = skyline
+        self.taps = []
+        if taps is not None:
+            for time in taps:
+                self.taps.append(time)
+
+class _LegacyTiming:
+    def __init__(self, time, bpm, beats=4.00):
+        self.time = time
+        self.bpm = bpm
+        self.beats = beats
+
+class _LegacyEnwidenLanes:
+    def __init__(self, time, duration, on=True):
+        self.time = time
+        self.duration = duration
+        self.on = on
+
+LEGACY = {
+    'GroundNote': _LegacyGroundNote,
+    'Hold': _LegacyHold,
+    'Arc': _LegacyArc,
+    'Timing': _LegacyTiming,
+    'EnwidenLanes': _LegacyEnwidenLanes,
+}
+CURRENT = {
+    'GroundNote': _chart.GroundNote,
+    'Hold': _chart.Hold,
+    'Arc': _chart.Arc,
+    'Timing': _chart.Timing,
+    'EnwidenLanes': _chart.EnwidenLanes,
+}
+
+def _arguments(charts):
+    """
+    Constructor arguments of every object in the charts by class name.
+    """
+    res = {name: [] for name in CURRENT}
+    for chart in charts:
+        res['EnwidenLanes'].extend((enwiden.time, enwiden.duration, enwiden.on) for enwiden in chart.enwidenlaneses)
+        for tg in chart.timing_groups:
+            res['GroundNote'].extend((note.start, note.lane) for note in tg.notes)
+            res['Hold'].extend((hold.start, hold.end, hold.lane) for hold in tg.holds)
+            res['Timing'].extend((timing.time, timing.bpm, timing.beats) for timing in tg.timings)
+            res['Arc'].extend((
+                arc.start, arc.end, arc.x_start, arc.x_end, _chart.Easing.name_from_code(arc.easing.code),
+                arc.y_start, arc.y_end, arc.color, arc.hitsound, arc.skyline, list(arc.taps),
+            ) for arc in tg.arcs)
+    return res
+
+def _measure(build):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        res = build()
+        gc.collect()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del res
+    return size
+
+def bench(charts):
+    """
+    Returns {class name: (count, bytes before, bytes after)} and bytes of the columnar timing groups.
+    """
+    arguments = _arguments(charts)
+    res = {}
+    for name, args in arguments.items():
+        legacy, current = LEGACY[name], CURRENT[name]
+        before = _measure(lambda: [legacy(*arg) for arg in args])
+        after = _measure(lambda: [current(*arg) for arg in args])
+        res[name] = (len(args), before, after)
+    columnar = _measure(lambda: [_chart.ColumnarTimingGroup.from_timing_group(tg) for chart in charts for tg in chart.timing_groups])
+    return res, columnar
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark memory of parsed charts.')
+    parser.add_argument('files', nargs='*', help='Chart files. The default is every chart in assets/songs and dl.')
+    parser.add_argument('--synthetic', type=int, default=20, help='Number of synthetic charts when no chart is found.')
+    args = parser.parse_args(argv)
+
+    files = args.files or chart_files()
+    charts = [reader.read_file(file, cache_dir=None) for file in files]
+    if not charts:
+        charts = [reader.read(generate(seed=seed)) for seed in range(args.synthetic)]
+
+    res, columnar = bench(charts)
+    total_before = total_after = 0
+    print(f'{len(charts)} charts')
+    for name, (count, before, after) in res.items():
+        total_before += before
+        total_after += after
+        if count:
+            print(f'    {name}: {count} objects, {before / count:.1f} -> {after / count:.1f} bytes per object')
+    print(f'    total: {total_before / 1e6:.2f} MB -> {total_after / 1e6:.2f} MB ({total_after / total_before:.0%})')
+    print(f'    columnar timing groups: {columnar / 1e6:.2f} MB')
+
+if __name__ == '__main__':
+    sys.exit(main())
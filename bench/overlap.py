@@ -0,0 +1,126 @@
+"""
+Benchmark of labelling arc notes under colored arcs (ArcColumns.covers) against the previous search loop.
+
+    python -m bench.overlap [chart files...]
+
+Without arguments, the charts in assets/songs and dl with the most arc notes are used,
+together with a synthetic chart of long arcs over many arctaps.
+Labels of both implementations are checked to be the same.
+"""
+import sys
+import random
+import argparse
+import numpy as np
+from lib import chart as _chart
+from lib.render import load
+from .parse import best, heaviest_charts
+
+def _bsearch_arcnotes(arc_notes, time, left_bound=False):
+    # TimingGroup._bsearch_arcnotes before ArcColumns.covers
+    left, right = 0, len(arc_notes)
+    if left_bound:
+        while left < right:
+            mid = (left + right) >> 1
+            if arc_notes[mid][1] < time:
+                left = mid + 1
+            else:
+                right = mid
+        return left
+    else:
+        while left < right:
+            mid = (left + right) >> 1
+            if arc_notes[mid][1] <= time:
+                left = mid + 1
+            else:
+                right = mid
+        return left - 1
+
+def legacy_labels(arcs, arc_notes):
+    # The labelling loop of TimingGroup.draw before ArcColumns.covers
+    arc_note_label = [False for i in range(len(arc_notes))]
+    arc_notes_by_time = sorted(((y, time, x, index) for index, (y, time, x) in enumerate(arc_notes)), key=lambda item: item[1])
+    for arc in arcs:
+        if arc.skyline:
+            continue
+        start, end = arc.start, arc.end
+        left_index = _bsearch_arcnotes(arc_notes_by_time, start, left_bound=True)
+        right_index = _bsearch_arcnotes(arc_notes_by_time, end, left_bound=False)
+        if left_index >= len(arc_notes_by_time) or right_index < 0:
+            continue
+        for y, time, x, index in arc_notes_by_time[left_index:right_index + 1]:
+            if arc.end <= arc.start:
+                if arc.x_end != arc.x_start:
+                    y_arc = arc.y_start + (arc.y_end - arc.y_start) * (x - arc.x_start) / (arc.x_end - arc.x_start)
+                else:
+                    continue
+            else:
+                x_arc, y_arc = arc.position(time)
+            if y_arc > y:
+                arc_note_label[index] = True
+    return arc_note_label
+
+def labels(timing_group : _chart.TimingGroup, arc_notes):
+    # The labelling of TimingGroup.draw
+    y, times, x = np.array(arc_notes, dtype=np.float64).reshape(-1, 3).T
+    return timing_group._colored_arc_columns().covers(y, times, x).tolist()
+
+def synthetic_overlap_chart(length=600000, arcs=400, arctaps=20000, seed=0):
+    """
+    A chart of long colored arcs over skylines carrying many arctaps.
+    """
+    rng = random.Random(seed)
+    chart = _chart.Chart()
+    timing_group = _chart.TimingGroup()
+    timing_group.timings.append(_chart.Timing(0, 120.0, 4.0))
+    easings = ('s', 'b', 'si', 'so', 'sisi', 'soso', 'siso', 'sosi')
+    for _ in range(arcs):
+        start = rng.randrange(0, length - 60000)
+        timing_group.arcs.append(_chart.Arc(
+            start, start + rng.choice((10000, 30000, 60000)), rng.uniform(-0.5, 1.5), rng.uniform(-0.5, 1.5),
+            rng.choice(easings), rng.uniform(0, 1), rng.uniform(0, 1), rng.randint(0, 1), 'none', False,
+        ))
+    skylines = 50
+    for index in range(skylines):
+        start = index * length // skylines
+        end = start + length // skylines
+        taps = sorted(rng.randint(start, end) for _ in range(arctaps // skylines))
+        timing_group.arcs.append(_chart.Arc(
+            start, end, rng.uniform(-0.5, 1.5), rng.uniform(-0.5, 1.5), 's', rng.uniform(0, 1), rng.uniform(0, 1), 0, 'none', True, taps=taps,
+        ))
+    chart.timing_groups.append(timing_group)
+    return chart
+
+def bench_chart(name, chart : _chart.Chart, repeat=3):
+    timing_group = chart._merged_timing_group(_chart.TrackMetaInfo())
+    arc_notes = timing_group._arc_notes()
+    arc_notes.sort(reverse=True)
+
+    legacy_res = legacy_labels(timing_group.arcs, arc_notes)
+    res = labels(timing_group, arc_notes)
+    if res != legacy_res:
+        raise AssertionError(f'{name}: {sum(a != b for a, b in zip(res, legacy_res))} labels differ')
+    legacy_time = best(lambda: legacy_labels(timing_group.arcs, arc_notes), repeat)
+    new_time = best(lambda: labels(timing_group, arc_notes), repeat)
+    colored = sum(not arc.skyline for arc in timing_group.arcs)
+    print(f'{name}: {colored} colored arcs, {len(arc_notes)} arc notes, {sum(res)} covered')
+    print(f'    legacy: {legacy_time * 1000:.1f} ms')
+    print(f'    intervals: {new_time * 1000:.1f} ms ({legacy_time / new_time:.1f}x)')
+    return legacy_time, new_time
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark labelling arc notes under colored arcs.')
+    parser.add_argument('files', nargs='*', help='Chart files. The default is the official charts with the most arc notes.')
+    parser.add_argument('--limit', type=int, default=5, help='Number of official charts to use.')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    if args.files:
+        charts = [(file, load(file)) for file in args.files]
+    else:
+        charts = heaviest_charts(lambda chart: sum(len(arc.taps) for tg in chart.timing_groups for arc in tg.arcs), args.limit)
+        charts.append(('synthetic', synthetic_overlap_chart()))
+    for name, chart in charts:
+        bench_chart(name, chart, args.repeat)
+
+if __name__ == '__main__':
+    sys.exit(main())
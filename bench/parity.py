@@ -0,0 +1,121 @@
+"""
+Parity checks of the rendering paths which must draw the same pixels, on synthetic charts.
+
+    python -m bench.parity [--length 120000] [--seeds 0 1 2]
+
+- columnar: timing groups stored as NumPy columns (`reader.read(columnar=True)`) against note objects
+- compiled: charts loaded from the compiled chart cache, written then memory-mapped, against parsed charts
+- incremental: `IncrementalRenderer` after a series of edits against rendering every edited chart in full
+
+Exits with status 1 if any image differs.
+"""
+import os
+import re
+import sys
+import shutil
+import argparse
+import tempfile
+import numpy as np
+from lib import reader
+from lib import render
+from lib.incremental import IncrementalRenderer
+from . import synthetic
+
+def _configure(**render_options):
+    track_meta = render.configure(render.get_preset('parity', 'default'), **render_options)
+    track_meta.preload()
+    return track_meta
+
+def _same(image, expected):
+    return image.size == expected.size and np.array_equal(np.asarray(image), np.asarray(expected))
+
+def _render(chart, **render_options):
+    return render.render(chart, _configure(**render_options))
+
+def check_columnar(text, **render_options):
+    return _same(_render(reader.read(text, columnar=True), **render_options), _render(reader.read(text), **render_options))
+
+def check_compiled(text, **render_options):
+    expected = _render(reader.read(text), **render_options)
+    directory = tempfile.mkdtemp()
+    try:
+        file = os.path.join(directory, 'chart.aff')
+        with open(file, 'w', encoding='utf8') as f:
+            f.write(text)
+        cache_dir = os.path.join(directory, 'cache')
+        hits = reader.cache_stats['hits']
+        res = True
+        # Compiled on the first read and memory-mapped on the next ones
+        for columnar in (False, False, True):
+            chart = reader.read_file(file, read_noinput=True, cache_dir=cache_dir, columnar=columnar)
+            res = _same(_render(chart, **render_options), expected) and res
+            del chart
+        return res and reader.cache_stats['hits'] - hits == 2
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def _replace_line(pattern, replace):
+    def _edit(text):
+        lines = text.split('\n')
+        for index, line in enumerate(lines):
+            if re.match(pattern, line):
+                lines[index] = replace(line)
+                break
+        return '\n'.join(lines)
+    return _edit
+
+def _shift_time(line, delta=100):
+    return re.sub(r'\((\d+),', lambda match: f'({int(match.group(1)) + delta},', line, count=1)
+
+EDITS = (
+    ('none', lambda text: text),
+    ('move note', _replace_line(r'\(\d+,\d\);$', _shift_time)),
+    ('remove arc', _replace_line(r'arc\(.*false\);$', lambda line: '')),
+    ('add hold', lambda text: text.replace('\n-\n', '\n-\nhold(5000,6500,2);\n', 1)),
+    ('move timing', _replace_line(r'timing\(30000,', lambda line: _shift_time(line, 1000))),
+    ('move enwiden', _replace_line(r'scenecontrol\(\d+,enwidenlanes', lambda line: _shift_time(line, 500))),
+    ('hitsound', _replace_line(r'arc\(.*,none,false\);$', lambda line: line.replace(',none,', ',hit.wav,'))),
+)
+
+def check_incremental(text, columnar=False, **render_options):
+    """
+    Returns the names of the edits after which the incremental image differs.
+    """
+    renderer = IncrementalRenderer(_configure(**render_options))
+    renderer.update(reader.read(text, columnar=columnar))
+    res = []
+    for name, edit in EDITS:
+        text = edit(text)
+        image = renderer.update(reader.read(text, columnar=columnar))
+        if not _same(image, _render(reader.read(text, columnar=columnar), **render_options)):
+            res.append(name)
+    return res
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check that the rendering paths draw the same pixels.')
+    parser.add_argument('--length', type=int, default=120000, help='Length of the synthetic charts in ms.')
+    parser.add_argument('--seeds', type=int, nargs='*', default=[0, 1, 2], help='Seeds of the synthetic charts.')
+    parser.add_argument('--zoom', '-z', type=float, default=0.1)
+    parser.add_argument('--height', '-H', type=float, default=12000, help='Page height, small enough for charts of several pages.')
+    args = parser.parse_args(argv)
+
+    render_options = dict(zoom=args.zoom, height=args.height)
+    failed = 0
+    for seed in args.seeds:
+        text = synthetic.generate(length=args.length, seed=seed)
+        results = {
+            'columnar': check_columnar(text, **render_options),
+            'compiled': check_compiled(text, **render_options),
+        }
+        for columnar in (False, True):
+            edits = check_incremental(text, columnar, **render_options)
+            results['incremental columnar' if columnar else 'incremental'] = not edits
+            if edits:
+                print(f'seed {seed}: incremental{" columnar" if columnar else ""} differs after {", ".join(edits)}')
+        for name, same in results.items():
+            print(f'seed {seed}: {name}: {"ok" if same else "DIFFERS"}')
+            failed += not same
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,193 @@
+"""
+Benchmark of chart parsing (reader.read) against the previous recursive regex reader.
+
+    python -m bench.parse [chart files...]
+
+Without arguments, every chart in assets/songs and dl is used.
+If there is none, synthetic charts are generated instead.
+Loading from the compiled chart cache is measured as well.
+Every chart is checked to be parsed into exactly the same `Chart` by both readers.
+"""
+import os
+import re
+import sys
+import glob
+import time
+import tempfile
+import argparse
+from lib import chart as _chart
+from lib import reader
+from lib.render import load
+from .synthetic import generate
+
+_Re_timing_group = re.compile(r'^\s*timinggroup\(([^)]*)\){')
+_Re_timing_group_end = re.compile(r'^\s*}')
+_Re_action = re.compile(r'^\s*([A-Za-z0-9#]*)\(([^)]*)\)((?:\[[^\]]*\])?);\s*$')
+
+def _legacy_read_action(line, chart, timing_group, filtered=False):
+    m = re.search(_Re_action, line)
+    if m is None:
+        return
+    action_name, args, extra_args = m.groups()
+    if action_name == '':
+        if not filtered:
+            timing_group.notes.append(_chart.GroundNote(*reader._analyze_args(args, reader._Arg_note)))
+    elif action_name == 'hold':
+        if not filtered:
+            timing_group.holds.append(_chart.Hold(*reader._analyze_args(args, reader._Arg_hold)))
+    elif action_name == 'arc':
+        if not filtered:
+            taps = reader._read_extra_args(extra_args)
+            timing_group.arcs.append(_chart.Arc(*reader._analyze_args(args, reader._Arg_arc), taps=taps))
+    elif action_name == 'timing':
+        if not filtered:
+            timing_group.timings.append(_chart.Timing(*reader._analyze_args(args, reader._Arg_timing)))
+    elif action_name == 'scenecontrol':
+        reader._read_scene_control(args, chart, timing_group)
+
+def _legacy_read_timing_group(chart, lines, args=None, read_noinput=True):
+    timing_group = _chart.TimingGroup()
+    res = reader._read_timing_group_args(timing_group, args)
+    filtered = not read_noinput and res.get('noinput', False)
+    chart.timing_groups.append(timing_group)
+    while lines:
+        line = lines.pop()
+        if (m := re.search(_Re_timing_group, line)):
+            _legacy_read_timing_group(chart, lines, m.group(1), read_noinput=read_noinput)
+        elif re.search(_Re_timing_group_end, line):
+            break
+        else:
+            _legacy_read_action(line, chart, timing_group, filtered=filtered)
+    return timing_group
+
+def legacy_read(chart, read_noinput=True):
+    # reader.read before the single-pass tokenizer
+    lines = list(reversed(chart.splitlines(False)))
+    meta = {}
+    while lines:
+        line = lines.pop()
+        if line.startswith('-'):
+            break
+        pos = line.find(':')
+        if pos >= 0:
+            meta[line[:pos]] = line[pos + 1:]
+    chart = _chart.Chart(meta=meta)
+    _legacy_read_timing_group(chart, lines, read_noinput=read_noinput)
+    return chart
+
+def signature(obj):
+    """
+    A comparable structure of everything stored in a parsed object.
+    """
+    if isinstance(obj, (list, tuple)):
+        return tuple(map(signature, obj))
+    if isinstance(obj, dict):
+        return tuple(sorted((key, signature(value)) for key, value in obj.items()))
+    names = []
+    for cls in type(obj).__mro__:
+        slots = cls.__dict__.get('__slots__', ())
+        for name in (slots, ) if isinstance(slots, str) else slots:
+            # Private slots are name-mangled
+            names.append(f'_{cls.__name__.lstrip("_")}{name}' if name.startswith('__') and not name.endswith('__') else name)
+    if hasattr(obj, '__dict__'):
+        names.extend(vars(obj))
+    if not names:
+        return obj
+    return (type(obj).__name__, tuple((name, signature(getattr(obj, name))) for name in names if hasattr(obj, name)))
+
+def chart_files():
+    files = glob.glob('assets/songs/*/*.aff') + glob.glob('dl/*')
+    return sorted(file for file in files if os.path.isfile(file) and os.path.basename(file) != 'README.md')
+
+def heaviest_charts(weight, limit):
+    """
+    (file, chart) of the `limit` charts of `chart_files` with the largest `weight(chart)`.
+    Charts which cannot be loaded are skipped.
+    """
+    charts = []
+    for file in chart_files():
+        try:
+            chart = load(file)
+        except Exception:
+            continue
+        charts.append((weight(chart), file, chart))
+    charts.sort(key=lambda item: item[0], reverse=True)
+    return [(file, chart) for _, file, chart in charts[:limit]]
+
+def best(func, repeat):
+    """
+    The shortest time of `repeat` calls of `func`, in seconds.
+    """
+    res = None
+    for _ in range(repeat):
+        time_start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - time_start
+        res = elapsed if res is None else min(res, elapsed)
+    return res
+
+def bench(texts, repeat=3, read_noinput=False):
+    """
+    `texts` is a list of (name, chart text).
+    Returns (legacy seconds, single-pass seconds, compiled cache seconds) over all charts.
+    """
+    for name, text in texts:
+        for noinput in {read_noinput, True}:
+            assert signature(legacy_read(text, noinput)) == signature(reader.read(text, noinput)), \
+                f'{name} is parsed differently with read_noinput={noinput}.'
+
+    def legacy():
+        for _, text in texts:
+            legacy_read(text, read_noinput)
+
+    def single_pass():
+        for _, text in texts:
+            reader.read(text, read_noinput)
+
+    temp_dir = tempfile.TemporaryDirectory()
+    cache_dir = os.path.join(temp_dir.name, 'cache')
+    files = []
+    for index, (_, text) in enumerate(texts):
+        files.append(os.path.join(temp_dir.name, f'{index}.aff'))
+        with open(files[-1], 'w', encoding='utf8') as f:
+            f.write(text)
+        reader.read_file(files[-1], read_noinput, cache_dir)
+        assert signature(reader.read_file(files[-1], read_noinput, cache_dir)) == signature(reader.read(text, read_noinput)), \
+            f'{texts[index][0]} is loaded differently from the compiled chart cache.'
+
+    def compiled():
+        for file in files:
+            reader.read_file(file, read_noinput, cache_dir)
+
+    size = sum(len(text.encode('utf8')) for _, text in texts)
+    lines = sum(text.count('\n') for _, text in texts)
+    legacy_time = best(legacy, repeat)
+    single_pass_time = best(single_pass, repeat)
+    compiled_time = best(compiled, repeat)
+    temp_dir.cleanup()
+    print(f'{len(texts)} charts, {lines} lines, {size / 1e6:.2f} MB, identical charts')
+    print(f'    legacy: {legacy_time * 1000:.1f} ms, {size / 1e6 / legacy_time:.2f} MB/s, {lines / legacy_time:.0f} lines/s')
+    print(f'    single pass: {single_pass_time * 1000:.1f} ms, {size / 1e6 / single_pass_time:.2f} MB/s, '
+          f'{lines / single_pass_time:.0f} lines/s ({legacy_time / single_pass_time:.1f}x)')
+    print(f'    compiled cache: {compiled_time * 1000:.1f} ms ({legacy_time / compiled_time:.1f}x)')
+    return legacy_time, single_pass_time, compiled_time
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark chart parsing.')
+    parser.add_argument('files', nargs='*', help='Chart files. The default is every chart in assets/songs and dl.')
+    parser.add_argument('--synthetic', type=int, default=20, help='Number of synthetic charts when no chart is found.')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--read-noinput', '-n', action='store_true')
+    args = parser.parse_args(argv)
+
+    files = args.files or chart_files()
+    texts = []
+    for file in files:
+        with open(file, 'r', encoding='utf8') as f:
+            texts.append((file, f.read()))
+    if not texts:
+        texts = [(f'synthetic-{seed}', generate(seed=seed)) for seed in range(args.synthetic)]
+    bench(texts, args.repeat, args.read_noinput)
+
+if __name__ == '__main__':
+    sys.exit(main())
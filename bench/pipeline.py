@@ -0,0 +1,219 @@
+"""
+Benchmark of every stage of rendering a chart, written as JSON for comparison between runs.
+
+    python -m bench.pipeline [chart files...] [--scales small medium] [--json result.json]
+    python -m bench.compare base.json result.json
+
+The stages are the same as in `Chart.image`:
+    read: parsing the chart text
+    refine: refining and merging timing groups, and sampling arc outlines
+    background: `Chart.background` of every page
+    draw: `TimingGroup.window` and `TimingGroup.draw` of every page
+    layout: padding, flipping and labelling pages, and pasting them into the final image
+
+Each stage is timed over `repeat` runs without tracing.
+Memory is measured in one more run: the peak of tracemalloc (Python and NumPy allocations),
+and the growth of the peak RSS of the process (which includes Pillow images).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import tracemalloc
+import numpy as np
+import PIL
+from PIL import Image, ImageDraw
+from lib import chart as _chart
+from lib import reader
+from lib import render
+from . import synthetic
+
+STAGES = ('read', 'refine', 'background', 'draw', 'layout')
+
+# Options of bench.synthetic.generate
+SCALES = {
+    'small': dict(length=60000, note_density=6.0, arcs=200, arctaps=100, timing_groups=1, enwiden_toggles=1),
+    'medium': dict(length=150000, note_density=10.0, arcs=800, arctaps=500, timing_groups=3, enwiden_toggles=2),
+    'large': dict(length=300000, note_density=16.0, arcs=3000, arctaps=2000, timing_groups=6, enwiden_toggles=4),
+}
+
+def _peak_rss():
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+class _Stages:
+    """
+    Accumulates time and memory of named stages, which may be entered several times.
+    """
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.times = dict.fromkeys(STAGES, 0.0)
+        self.peak_traced = dict.fromkeys(STAGES, 0)
+        self.rss_growth = dict.fromkeys(STAGES, 0)
+        self.__name = None
+
+    def start(self, name):
+        self.__name = name
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            self.__traced = tracemalloc.get_traced_memory()[0]
+            self.__rss = _peak_rss()
+        self.__time = time.perf_counter()
+
+    def stop(self):
+        elapsed = time.perf_counter() - self.__time
+        name = self.__name
+        self.times[name] += elapsed
+        if self.trace_memory:
+            self.peak_traced[name] = max(self.peak_traced[name], tracemalloc.get_traced_memory()[1] - self.__traced)
+            self.rss_growth[name] += _peak_rss() - self.__rss
+        self.__name = None
+
+def run_stages(text, track_meta : _chart.TrackMetaInfo, stages : _Stages, columnar=False, extra_width=None):
+    """
+    Render a chart text like `render.render`, recording every stage.
+    """
+    stages.start('read')
+    chart = reader.read(text, columnar=columnar)
+    stages.stop()
+
+    stages.start('refine')
+    render.apply_extra_width(chart, track_meta, extra_width)
+    index = chart.time_index(track_meta)
+    speed = track_meta.speed
+    zoom = track_meta.zoom
+    total_height = round(chart.total_height(speed, track_meta) * zoom)
+    height_limit = round(track_meta.height_limit * zoom)
+    page_count = chart.page_count(track_meta)
+    stages.stop()
+
+    res = None
+    for page in range(page_count):
+        top = page * height_limit
+        bottom = min(total_height, top + height_limit)
+        stages.start('background')
+        image, _ = chart.background(speed, track_meta, window=(top, bottom), index=index)
+        stages.stop()
+
+        stages.start('draw')
+        timing_group = index.window(top, bottom, track_meta)
+        timing_group.draw(image, ImageDraw.Draw(image), track_meta, speed, offset=top)
+        stages.stop()
+
+        stages.start('layout')
+        image = chart._layout_rows(image, index, track_meta, height_limit, (page * track_meta.height_limit, track_meta.height_limit))
+        if res is None:
+            res = Image.new('RGBA', (image.size[0] * page_count, image.size[1]), (0, 0, 0, 0))
+        res.paste(image, (page * image.size[0], 0))
+        stages.stop()
+    return chart, res
+
+def _chart_info(chart : _chart.Chart, image : Image.Image):
+    timing_groups = chart.timing_groups
+    return {
+        'timing_groups': len(timing_groups),
+        'notes': sum(len(tg.notes) for tg in timing_groups),
+        'holds': sum(len(tg.holds) for tg in timing_groups),
+        'arcs': sum(len(tg.arcs) for tg in timing_groups),
+        'arctaps': sum(len(arc.taps) for tg in timing_groups for arc in tg.arcs),
+        'enwidenlanes': len(chart.enwidenlaneses),
+        'total_time': chart.total_time,
+        'image_size': list(image.size),
+    }
+
+def bench_case(name, text, preset_name='default', repeat=3, memory=True, columnar=False, **render_options):
+    track_meta = render.configure(render.get_preset(name, preset_name), **render_options)
+    track_meta.preload()
+    times = {stage: [] for stage in STAGES}
+    for _ in range(repeat):
+        stages = _Stages()
+        chart, image = run_stages(text, track_meta, stages, columnar=columnar)
+        for stage in STAGES:
+            times[stage].append(stages.times[stage])
+    res = {
+        'name': name,
+        'size': len(text.encode('utf8')),
+        'chart': _chart_info(chart, image),
+        'stages': {stage: {'time': min(times[stage]), 'times': times[stage]} for stage in STAGES},
+    }
+    del chart, image
+    if memory:
+        stages = _Stages(trace_memory=True)
+        tracemalloc.start()
+        try:
+            run_stages(text, track_meta, stages, columnar=columnar)
+        finally:
+            tracemalloc.stop()
+        for stage in STAGES:
+            res['stages'][stage]['peak_traced'] = stages.peak_traced[stage]
+            res['stages'][stage]['rss_growth'] = stages.rss_growth[stage]
+    res['total_time'] = sum(stage['time'] for stage in res['stages'].values())
+    return res
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pillow': PIL.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the stages of rendering a chart.')
+    parser.add_argument('files', nargs='*', help='Chart files to benchmark besides the synthetic charts.')
+    parser.add_argument('--scales', nargs='*', default=['small', 'medium'], choices=sorted(SCALES),
+                        help='Synthetic charts to benchmark. The default is small and medium.')
+    parser.add_argument('--custom', action='store_true', help='Also benchmark a synthetic chart from the options below.')
+    synthetic.add_arguments(parser.add_argument_group('custom synthetic chart'))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-memory', action='store_true', help='To skip the memory measurement.')
+    parser.add_argument('--columnar', action='store_true', help='To use columnar timing groups.')
+    parser.add_argument('--preset', '-p', type=str, default='default')
+    parser.add_argument('--speed', '-s', type=float, default=2000)
+    parser.add_argument('--height', '-H', type=float, default=24000)
+    parser.add_argument('--zoom', '-z', type=float, default=0.2)
+    parser.add_argument('--json', type=str, default=None, help='Write the results to this JSON file.')
+    args = parser.parse_args(argv)
+
+    cases = [(f'synthetic-{scale}', synthetic.generate(**SCALES[scale])) for scale in args.scales]
+    if args.custom:
+        cases.append(('synthetic-custom', synthetic.generate(**synthetic.options(args))))
+    for file in args.files:
+        with open(file, 'r', encoding='utf8') as f:
+            cases.append((file, f.read()))
+    render_options = dict(speed=args.speed, height=args.height, zoom=args.zoom)
+
+    results = []
+    for name, text in cases:
+        res = bench_case(
+            name, text, args.preset, repeat=args.repeat, memory=not args.no_memory, columnar=args.columnar, **render_options,
+        )
+        results.append(res)
+        info = res['chart']
+        print(f'{name}: {info["notes"]} notes, {info["holds"]} holds, {info["arcs"]} arcs, {info["arctaps"]} arctaps, '
+              f'{info["image_size"][0]}x{info["image_size"][1]}')
+        for stage, stage_res in res['stages'].items():
+            line = f'    {stage}: {stage_res["time"] * 1000:.1f} ms'
+            if 'peak_traced' in stage_res:
+                line += f', traced peak {stage_res["peak_traced"] / 1e6:.1f} MB, RSS growth {stage_res["rss_growth"] / 1e6:.1f} MB'
+            print(line)
+        print(f'    total: {res["total_time"] * 1000:.1f} ms')
+
+    if args.json is not None:
+        with open(args.json, 'w', encoding='utf8') as f:
+            json.dump({
+                'version': 1,
+                'environment': environment(),
+                'options': dict(render_options, preset=args.preset, repeat=args.repeat, columnar=args.columnar),
+                'cases': results,
+            }, f, indent=2)
+
+if __name__ == '__main__':
+    sys.exit(main())
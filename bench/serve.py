@@ -0,0 +1,60 @@
+"""
+Request-level checks of the render service (lib.server), on a synthetic chart.
+
+    python -m bench.serve
+
+Every format of `server.FORMATS` is requested from a `Service` with one worker,
+and the response has to be 200 with the content type of the format and an image Pillow decodes as that format.
+Exits with status 1 if any request fails.
+"""
+import io
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+from PIL import Image
+from lib import server
+from . import synthetic
+
+def check_formats(service, file, zoom=0.05):
+    """
+    Returns the formats whose responses are wrong, with the reason.
+    """
+    res = {}
+    for format_, content_type in server.FORMATS.items():
+        status, headers, body = service.render({'id': [file], 'zoom': [str(zoom)], 'format': [format_]})
+        if status != 200:
+            res[format_] = f'status {status}: {body.decode("utf8", "replace")}'
+            continue
+        if headers['Content-Type'] != content_type:
+            res[format_] = f'content type {headers["Content-Type"]}'
+            continue
+        decoded = Image.open(io.BytesIO(body)).format
+        if decoded.lower() != content_type.split('/')[1]:
+            res[format_] = f'decoded as {decoded}'
+    return res
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Request every format from the render service.')
+    parser.add_argument('--length', type=int, default=60000, help='Length of the synthetic chart in ms.')
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp()
+    service = None
+    try:
+        file = os.path.join(directory, 'chart.aff')
+        with open(file, 'w', encoding='utf8') as f:
+            f.write(synthetic.generate(length=args.length))
+        service = server.Service(workers=1, allow_paths=True, render_cache=None, log=lambda message: None)
+        failures = check_formats(service, file)
+    finally:
+        if service is not None:
+            service.close()
+        shutil.rmtree(directory, ignore_errors=True)
+    for format_ in server.FORMATS:
+        print(f'{format_}: {failures.get(format_, "ok")}')
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,119 @@
+"""
+Generator of synthetic .aff charts for benchmarks.
+
+    python -m bench.synthetic [--length 120000 ...] > chart.aff
+"""
+import sys
+import random
+import argparse
+
+EASINGS = ('s', 'b', 'si', 'so', 'sisi', 'soso', 'siso', 'sosi')
+
+def generate(length=120000, note_density=10.0, hold_ratio=0.25, arcs=600, arctaps=400,
+             timing_groups=3, enwiden_toggles=2, seed=0):
+    """
+    An .aff chart text of `length` ms.
+
+    `note_density` is the number of ground notes per second, and `hold_ratio` of them are holds.
+    `arcs` arcs are laid out in chains of joined arcs, about a third of them skylines,
+    which carry `arctaps` arctaps in total.
+    Every extra timing group holds a tenth of the objects of the main one;
+    odd ones are noinput and the first one contains a nested timing group.
+    `enwiden_toggles` pairs of enwidenlanes scene controls turn extra lanes on and off.
+    """
+    rng = random.Random(seed)
+    length = max(int(length), 4000)
+
+    def body(scale, indent):
+        lines = []
+        note_count = round(note_density * length / 1000 * scale)
+        hold_count = round(note_count * hold_ratio)
+        for _ in range(note_count - hold_count):
+            lines.append(f'{indent}({rng.randrange(0, length)},{rng.randint(1, 4)});')
+        for _ in range(hold_count):
+            start = rng.randrange(0, length - 2000)
+            lines.append(f'{indent}hold({start},{start + rng.choice((125, 250, 500, 1000, 1500))},{rng.randint(1, 4)});')
+
+        arc_count = round(arcs * scale)
+        skylines = []
+        while arc_count > 0:
+            # A chain of joined arcs
+            chain = min(arc_count, rng.randint(1, 6))
+            arc_count -= chain
+            skyline = rng.random() < 0.33
+            color = rng.randint(0, 2)
+            time = rng.randrange(0, length - 3000)
+            x, y = rng.uniform(-0.5, 1.5), rng.uniform(0, 1)
+            for _ in range(chain):
+                duration = rng.choice((0, 125, 250, 500, 1000, 2000)) if skyline else rng.choice((250, 500, 1000, 2000))
+                end = min(time + duration, length)
+                x_end, y_end = rng.uniform(-0.5, 1.5), rng.uniform(0, 1)
+                lines.append(None)
+                index = len(lines) - 1
+                if skyline:
+                    skylines.append((index, indent, time, end, x, x_end, y, y_end))
+                else:
+                    lines[index] = (
+                        f'{indent}arc({time},{end},{x:.2f},{x_end:.2f},{rng.choice(EASINGS)},{y:.2f},{y_end:.2f},'
+                        f'{color},none,false);'
+                    )
+                time, x, y = end, x_end, y_end
+
+        taps = {index: [] for index, *_ in skylines}
+        candidates = [skyline for skyline in skylines if skyline[3] > skyline[2]]
+        for _ in range(round(arctaps * scale) if candidates else 0):
+            index, _, start, end, *_ = rng.choice(candidates)
+            taps[index].append(rng.randint(start, end))
+        for index, indent, start, end, x, x_end, y, y_end in skylines:
+            extra = ''
+            if taps[index]:
+                extra = '[' + ','.join(f'arctap({time})' for time in sorted(taps[index])) + ']'
+            lines[index] = (
+                f'{indent}arc({start},{end},{x:.2f},{x_end:.2f},{rng.choice(EASINGS)},{y:.2f},{y_end:.2f},'
+                f'0,none,true){extra};'
+            )
+        return lines
+
+    lines = ['AudioOffset:0', 'TimingPointDensityFactor:1', '-', 'timing(0,120.00,4.00);']
+    for time in range(30000, length, 30000):
+        lines.append(f'timing({time},{rng.choice((90, 120, 150, 180, 200))}.00,{rng.choice((3, 4))}.00);')
+    lines.extend(body(1, ''))
+    for index in range(enwiden_toggles):
+        time = (2 * index + 1) * length // (2 * enwiden_toggles + 1)
+        lines.append(f'scenecontrol({time},enwidenlanes,500.00,1);')
+        lines.append(f'scenecontrol({time + length // (2 * enwiden_toggles + 1)},enwidenlanes,500.00,0);')
+    for index in range(timing_groups):
+        lines.append(f'timinggroup({"noinput" if index % 2 else ""}){{')
+        lines.append(f'  timing(0,{rng.choice((60, 120, 240))}.00,4.00);')
+        lines.extend(body(0.1, '  '))
+        if index == 0:
+            lines.append('  timinggroup(fadingholds){')
+            lines.extend(body(0.01, '    '))
+            lines.append('  };')
+        lines.append('};')
+    return '\n'.join(lines) + '\n'
+
+def add_arguments(parser : argparse.ArgumentParser):
+    parser.add_argument('--length', type=int, default=120000, help='Length of the chart in ms.')
+    parser.add_argument('--note-density', type=float, default=10.0, help='Ground notes per second.')
+    parser.add_argument('--hold-ratio', type=float, default=0.25, help='Ratio of holds in ground notes.')
+    parser.add_argument('--arcs', type=int, default=600, help='Number of arcs in the main timing group.')
+    parser.add_argument('--arctaps', type=int, default=400, help='Number of arctaps in the main timing group.')
+    parser.add_argument('--timing-groups', type=int, default=3, help='Number of extra timing groups.')
+    parser.add_argument('--enwiden-toggles', type=int, default=2, help='Number of times extra lanes are turned on.')
+    parser.add_argument('--seed', type=int, default=0)
+
+def options(args):
+    return dict(
+        length=args.length, note_density=args.note_density, hold_ratio=args.hold_ratio, arcs=args.arcs,
+        arctaps=args.arctaps, timing_groups=args.timing_groups, enwiden_toggles=args.enwiden_toggles, seed=args.seed,
+    )
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a synthetic chart.')
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    sys.stdout.write(generate(**options(args)))
+
+if __name__ == '__main__':
+    sys.exit(main())
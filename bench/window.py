@@ -0,0 +1,58 @@
+"""
+Benchmark of rendering a window of a chart (Chart.render_window) as the chart grows.
+
+    python -m bench.window [--lengths 60000 300000 1200000] [--window 4000]
+
+For synthetic charts of increasing length, a window of the same duration in the middle of the chart is rendered.
+The time of looking up the objects of the window through the time index is compared with
+`TimingGroup.window` over the whole merged timing group, which visits every object.
+The time index is built once per chart and reported separately.
+"""
+import sys
+import time
+import argparse
+from lib import chart as _chart
+from lib import reader
+from lib import render
+from . import synthetic
+from .parse import best
+
+def bench_length(length, window=4000, repeat=3, columnar=False, preset_name='default', **render_options):
+    chart = reader.read(synthetic.generate(length=length, seed=length), columnar=columnar)
+    track_meta = render.configure(render.get_preset('window', preset_name), **render_options)
+    track_meta.preload()
+    render.apply_extra_width(chart, track_meta)
+
+    time_start = time.perf_counter()
+    index = chart.time_index(track_meta)
+    index_time = time.perf_counter() - time_start
+
+    start_ms = length // 2
+    end_ms = start_ms + window
+    speed, zoom = track_meta.speed, track_meta.zoom
+    top = round(_chart._time_to_height(start_ms, speed) * zoom)
+    bottom = round(_chart._time_to_height(end_ms, speed) * zoom)
+    scan_time = best(lambda: index.timing_group.window(top, bottom, track_meta, speed), repeat)
+    lookup_time = best(lambda: index.window(top, bottom, track_meta), repeat)
+    render_time = best(lambda: chart.render_window(start_ms, end_ms, track_meta), repeat)
+    objects = len(index.notes) + len(index.holds) + len(index.arcs)
+    print(f'{length} ms: {objects} objects, index built in {index_time * 1000:.1f} ms')
+    print(f'    scan: {scan_time * 1000:.2f} ms, index: {lookup_time * 1000:.2f} ms ({scan_time / lookup_time:.1f}x)')
+    print(f'    render_window: {render_time * 1000:.1f} ms')
+    return index_time, scan_time, lookup_time, render_time
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark rendering a window of growing charts.')
+    parser.add_argument('--lengths', type=int, nargs='*', default=[60000, 300000, 1200000], help='Lengths of the synthetic charts in ms.')
+    parser.add_argument('--window', type=int, default=4000, help='Duration of the window in ms.')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--columnar', action='store_true', help='To use columnar timing groups.')
+    parser.add_argument('--speed', '-s', type=float, default=2000)
+    parser.add_argument('--zoom', '-z', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    for length in args.lengths:
+        bench_length(length, args.window, args.repeat, args.columnar, speed=args.speed, zoom=args.zoom)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,3 +1,3 @@
-from .chart import TrackMetaInfo
+from .chart import TrackMetaInfo, sprite_cache
 from .reader import read
 from . import presets
@@ -0,0 +1,170 @@
+import os
+import glob
+import json
+import time
+import traceback
+import multiprocessing
+from . import presets
+from . import render
+from . import reader
+from . import cache
+
+VARIANTS = ('normal', 'inverse')
+
+def songlist_ids(songlist_file='assets/songs/songlist'):
+    with open(songlist_file, 'r', encoding='utf8') as f:
+        songlist = json.load(f)['songs']
+    return [song['id'] for song in songlist]
+
+def songlist_jobs(ids, difficulties=(0, 1, 2, 3), variants=('normal', )):
+    jobs = []
+    for file_id in ids:
+        for diff in difficulties:
+            file, final_diff, official = render.locate(file_id, diff)
+            if file is None:
+                continue
+            for variant in variants:
+                jobs.append({'id': file_id, 'difficulty': final_diff, 'variant': variant, 'file': file, 'official': official})
+    return jobs
+
+def glob_jobs(pattern, difficulties=(0, 1, 2, 3), variants=('normal', )):
+    """
+    Jobs from files named like `dl/<id>_<difficulty>`.
+    Only files in the official directories use the presets of their IDs, see `render.is_official`.
+    """
+    jobs = []
+    for file in sorted(glob.glob(pattern)):
+        if not os.path.isfile(file):
+            continue
+        file_id, _, diff = os.path.basename(file).rpartition('_')
+        if not file_id or not diff.isdigit() or int(diff) not in difficulties:
+            continue
+        official = render.is_official(file)
+        for variant in variants:
+            jobs.append({'id': file_id, 'difficulty': int(diff), 'variant': variant, 'file': file, 'official': official})
+    return jobs
+
+def _preset_name(variant):
+    if variant == 'normal':
+        return None
+    return variant
+
+def _warm_name(job):
+    variant = job['variant']
+    if variant in VARIANTS and job['official']:
+        return presets.name_from_id(job['id'], inverse=variant == 'inverse')
+    if variant in VARIANTS or variant not in presets.names():
+        return 'default'
+    return variant
+
+_worker_options = None
+_render_cache = None
+
+def _init_worker(options):
+    global _worker_options, _render_cache
+    _worker_options = options
+    if options['render_cache'] is not None:
+        _render_cache = cache.RenderCache(options['render_cache'], options['render_cache_size'])
+    for name in options['warm']:
+        preset = presets.get(name)
+        if preset is not None:
+            render.configure(preset, **options['render']).preload()
+
+def _run_job(job):
+    options = _worker_options
+    suffix = '' if job['variant'] == 'normal' else f'_{job["variant"]}'
+    output_file = os.path.join(options['output_dir'], render.output_name(job['id'], job['difficulty'], options['format'], suffix))
+    result = dict(job, output=output_file, pid=os.getpid(), timings={})
+    timings = result['timings']
+    time_start = time.perf_counter()
+    try:
+        preset = render.get_preset(job['id'], _preset_name(job['variant']), job['official'])
+        render.configure(preset, **options['render'])
+        cache_key = None
+        if _render_cache is not None:
+            cache_key = cache.render_key(job['file'], preset, options['extra_width'], options['read_noinput'], options['format'])
+            result['cached'] = not options['refresh_render_cache'] and _render_cache.copy(cache_key, options['format'], output_file)
+        time_cache = time.perf_counter()
+        timings['cache'] = time_cache - time_start
+        if result.get('cached'):
+            result['status'] = 'ok'
+            timings['total'] = time_cache - time_start
+            return result
+
+        chart = render.load(job['file'], read_noinput=options['read_noinput'], cache_dir=options['chart_cache'], columnar=options['columnar'])
+        time_read = time.perf_counter()
+        timings['read'] = time_read - time_cache
+
+        image = render.render(chart, preset, options['extra_width'])
+        time_render = time.perf_counter()
+        timings['render'] = time_render - time_read
+
+        image.save(output_file, format=options['format'])
+        if cache_key is not None:
+            _render_cache.put_file(cache_key, options['format'], output_file)
+        timings['save'] = time.perf_counter() - time_render
+        result['status'] = 'ok'
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = f'{e.__class__.__name__}: {e}'
+        result['traceback'] = traceback.format_exc()
+    timings['total'] = time.perf_counter() - time_start
+    return result
+
+def run(jobs, output_dir='.', workers=None, format_='png', summary_file=None,
+        read_noinput=False, extra_width=None, chart_cache=reader.CACHE_DIR, columnar=False,
+        render_cache=cache.CACHE_DIR, render_cache_size=1024 * 1024 * 1024, refresh_render_cache=False, verbose=True, **render_options):
+    """
+    Render every job on a pool of worker processes.
+
+    `chart_cache` is the directory of compiled charts, None to disable it.
+    `columnar` is passed to `render.load`.
+    `render_cache` is the directory of `cache.RenderCache`, None to disable it, and `refresh_render_cache` is to render cached jobs again.
+    `render_options` is passed to `render.configure` for every job.
+    Each worker preloads the presets needed by the jobs once at start.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(jobs)))
+    options = {
+        'output_dir': output_dir,
+        'format': format_,
+        'read_noinput': read_noinput,
+        'chart_cache': chart_cache,
+        'columnar': columnar,
+        'render_cache': render_cache,
+        'render_cache_size': render_cache_size,
+        'refresh_render_cache': refresh_render_cache,
+        'extra_width': extra_width,
+        'render': render_options,
+        'warm': sorted(set(map(_warm_name, jobs))),
+    }
+
+    results = []
+    time_start = time.perf_counter()
+    if jobs:
+        with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(options, )) as pool:
+            for index, result in enumerate(pool.imap_unordered(_run_job, jobs)):
+                results.append(result)
+                if verbose:
+                    status = 'ok' if result['status'] == 'ok' else f'failed ({result["error"]})'
+                    if result.get('cached'):
+                        status = 'cached'
+                    print(f'[{index + 1}/{len(jobs)}] {result["output"]}: {status} in {result["timings"]["total"]:.2f}s')
+    wall_time = time.perf_counter() - time_start
+
+    failures = [result for result in results if result['status'] != 'ok']
+    summary = {
+        'workers': workers,
+        'jobs': len(jobs),
+        'succeeded': len(results) - len(failures),
+        'failed': len(failures),
+        'wall_time': wall_time,
+        'cpu_time': sum(result['timings']['total'] for result in results),
+        'results': results,
+    }
+    if summary_file is not None:
+        with open(summary_file, 'w', encoding='utf8') as f:
+            json.dump(summary, f, indent=2)
+    return summary
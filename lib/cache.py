@@ -0,0 +1,196 @@
+"""
+Content-addressed cache of rendered images on disk.
+
+    render_cache = RenderCache()
+    key = render_key(file, preset, extra_width, read_noinput, 'png')
+    if not render_cache.copy(key, 'png', 'out.png'):
+        ...  # render and save out.png
+        render_cache.put_file(key, 'png', 'out.png')
+
+A key is a hash of everything the encoded image depends on: the bytes of the chart,
+every field of the configured preset with the bytes of its asset files, the extra width, the noinput flag,
+the format with its encoding options, and the renderer version.
+Entries are files named by their key. Their modification times are updated on every hit,
+and the least recently used entries are removed when the directory grows over its size.
+The size is estimated from the writes of the process, so the directory is only scanned to evict.
+"""
+import os
+import json
+import shutil
+import hashlib
+import PIL
+from . import chart as _chart
+from .output import save_options
+
+CACHE_DIR = os.path.join('.cache', 'renders')
+# Bump when the same chart and options render differently
+RENDERER_VERSION = 1
+
+_PRESET_FIELDS = (
+    'side', 'bar_line_width', 'bar_line_color', 'track_line_width', 'track_line_color', 'zoom', 'height_limit', 'speed',
+    'group_tolerance', 'draw_black_line', 'blue_color', 'red_color', 'green_color', 'yellow_color', 'black_color',
+    'extra_color', 'font_color', 'font_size', 'enable_shadow', 'shadow_color', 'arc_note_precision',
+)
+_PRESET_FILES = ('track_file', 'enwiden_file', 'note_file', 'hold_file', 'arc_file', 'font_file')
+# Sources of the output besides the preset and the chart
+_RENDERER_MODULES = ('chart.py', 'reader.py', 'render.py', 'output.py')
+
+_digests = {}
+
+def _file_digest(file):
+    # Hashes are kept while the file keeps its mtime and size
+    stat = os.stat(file)
+    key = (os.path.abspath(file), stat.st_mtime_ns, stat.st_size)
+    res = _digests.get(key, None)
+    if res is None:
+        with open(file, 'rb') as f:
+            res = hashlib.sha256(f.read()).hexdigest()
+        _digests[key] = res
+    return res
+
+def renderer_version():
+    """
+    `RENDERER_VERSION` with the hashes of the rendering modules, so that editing them invalidates the cache.
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    sources = [_file_digest(os.path.join(directory, module)) for module in _RENDERER_MODULES]
+    return [RENDERER_VERSION, PIL.__version__, sources]
+
+def render_key(file, preset : _chart.TrackMetaInfo, extra_width=None, read_noinput=False, format_='png', **options):
+    """
+    The key of rendering the chart `file` with the configured `preset`, as by `render.render(chart, preset, extra_width)`
+    saved by `output.save(image, file, format_, **options)`.
+    """
+    fields = {name: getattr(preset, name) for name in _PRESET_FIELDS}
+    fields.update({name: _file_digest(getattr(preset, name)) for name in _PRESET_FILES})
+    content = {
+        'version': renderer_version(),
+        'chart': _file_digest(file),
+        'preset': fields,
+        'extra_width': extra_width,
+        'read_noinput': bool(read_noinput),
+        'format': format_.lower(),
+        'options': save_options(format_, **options),
+    }
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode('utf8')).hexdigest()
+
+class RenderCache:
+    """
+    Encoded images in `directory`, at most `max_bytes` in total.
+    Several processes may share the directory: entries are written to temporary files and renamed.
+    Each process only counts its own writes between scans, so the directory may exceed `max_bytes`
+    by what the other processes wrote since they last evicted.
+    """
+    # Eviction goes down to this ratio of `max_bytes`, so that a full cache is not scanned on every write
+    EVICT_RATIO = 0.9
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=1024 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # Estimated total size, None until the directory is scanned
+        self.__bytes = None
+
+    def path(self, key, format_):
+        return os.path.join(self.directory, key[:2], f'{key}.{format_.lower()}')
+
+    def get(self, key, format_):
+        """
+        The path of the entry, or None if it is not cached. A hit makes the entry the most recently used.
+        """
+        path = self.path(key, format_)
+        try:
+            os.utime(path)
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def read(self, key, format_):
+        """
+        The bytes of the entry, or None if it is not cached.
+        """
+        path = self.get(key, format_)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            # Evicted by another process
+            return None
+
+    def copy(self, key, format_, output_file):
+        """
+        Copy the entry to `output_file`. Returns False if it is not cached.
+        """
+        path = self.get(key, format_)
+        if path is None:
+            return False
+        try:
+            shutil.copyfile(path, output_file)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def put(self, key, format_, data):
+        path = self.path(key, format_)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_file = f'{path}.{os.getpid()}.tmp'
+        with open(temp_file, 'wb') as f:
+            f.write(data)
+        os.replace(temp_file, path)
+        if self.__bytes is None:
+            self.__bytes = sum(size for _, size, _ in self.entries())
+        else:
+            self.__bytes += len(data)
+        if self.__bytes > self.max_bytes:
+            self.evict()
+
+    def put_file(self, key, format_, file):
+        with open(file, 'rb') as f:
+            self.put(key, format_, f.read())
+
+    def entries(self):
+        """
+        (mtime, size, path) of every entry, from the least recently used.
+        """
+        res = []
+        if not os.path.isdir(self.directory):
+            return res
+        for prefix in os.scandir(self.directory):
+            if not prefix.is_dir():
+                continue
+            for entry in os.scandir(prefix.path):
+                if entry.name.endswith('.tmp'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                res.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        res.sort()
+        return res
+
+    def evict(self):
+        """
+        Remove the least recently used entries if the total size is over `max_bytes`,
+        until it is at most `EVICT_RATIO` of it. Returns the number of removed entries.
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        limit = self.max_bytes * self.EVICT_RATIO if total > self.max_bytes else self.max_bytes
+        for _, size, path in entries:
+            if total <= limit:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        self.__bytes = total
+        return removed
@@ -2,6 +2,9 @@ import math
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 import os
+import threading
+from collections import OrderedDict
+from . import instrument as _instrument
 
 VISION_HEIGHT = 2.4
 VISION_CAP = 1.61
@@ -21,6 +24,106 @@ def _file_default(value, default):
         return value
     return default
 
+def _load_image(file):
+    return Image.open(file).convert('RGBA').transpose(Image.FLIP_TOP_BOTTOM)
+
+def _image_bytes(image : Image.Image):
+    w, h = image.size
+    return w * h * len(image.getbands())
+
+class SpriteCache:
+    """
+    Process-wide LRU cache of decoded sprites.
+
+    Entries are keyed by (file, target size, resample filter).
+    A size of None stands for the decoded (flipped RGBA) image itself,
+    which is also the source of every resized entry of the same file.
+    Derived sprites use `cached` with keys of the same shape,
+    where the last item describes how they are derived.
+    """
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.__items = OrderedDict()
+        self.__bytes = 0
+        self.__max_bytes = max_bytes
+        self.__lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def max_bytes(self):
+        return self.__max_bytes
+
+    @max_bytes.setter
+    def max_bytes(self, value):
+        with self.__lock:
+            self.__max_bytes = value
+            self.__evict()
+
+    @property
+    def bytes(self):
+        return self.__bytes
+
+    def __len__(self):
+        return len(self.__items)
+
+    def __evict(self):
+        while self.__items and self.__bytes > self.__max_bytes:
+            _, image = self.__items.popitem(last=False)
+            self.__bytes -= _image_bytes(image)
+
+    def __get(self, key, factory, count=True):
+        image = self.__items.get(key, None)
+        if image is not None:
+            self.__items.move_to_end(key)
+            if count:
+                self.hits += 1
+            return image
+        if count:
+            self.misses += 1
+        image = factory()
+        self.__items[key] = image
+        self.__bytes += _image_bytes(image)
+        self.__evict()
+        return image
+
+    def cached(self, key, factory):
+        """
+        Get the image of `key`, creating it by `factory()` if it is not cached.
+        """
+        with self.__lock:
+            return self.__get(key, factory)
+
+    def get(self, file, size=None, resample=Image.LANCZOS):
+        if size is None:
+            return self.cached((file, None, None), lambda: _load_image(file))
+        size = (max(size[0], 1), max(size[1], 1))
+        def _factory():
+            # The source is looked up without counting, so that a resize counts as one miss
+            image = self.__get((file, None, None), lambda: _load_image(file), count=False)
+            if image.size != size:
+                image = image.resize(size, resample)
+            return image
+        return self.cached((file, size, resample), _factory)
+
+    def clear(self):
+        with self.__lock:
+            self.__items.clear()
+            self.__bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self.__lock:
+            return {
+                'entries': len(self.__items),
+                'bytes': self.__bytes,
+                'max_bytes': self.__max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+sprite_cache = SpriteCache()
+
 _DEFAULT_TRACK_LIGHT = 'default/default_track.png'
 _DEFAULT_ENWIDEN_LIGHT = 'default/default_extralane.png'
 _DEFAULT_NOTE_LIGHT = 'default/default_note.png'
@@ -33,6 +136,9 @@ _DEFAULT_HOLD_DARK = 'default/default_hold_dark.png'
 _DEFAULT_ARC_DARK = 'default/default_arc_dark.png'
 
 class TrackMetaInfo:
+    # The maximum number of track images stacked into a tile
+    TRACK_TILE_MAX_COUNT = 64
+
     def __init__(self, track_file=_DEFAULT_TRACK_LIGHT, enwiden_file=_DEFAULT_ENWIDEN_LIGHT, note_file=_DEFAULT_NOTE_LIGHT, hold_file=_DEFAULT_HOLD_LIGHT, arc_file=_DEFAULT_ARC_LIGHT, side=0):
         self.side = side
         self.track_file = track_file
@@ -61,6 +167,10 @@ class TrackMetaInfo:
         self.font_file = "default/Exo-Regular.ttf"
         self.enable_shadow = False
         self.shadow_color = (0, 0, 0, 63)
+        # Arc note sprites are cached by their height ratio rounded to this precision
+        self.arc_note_precision = 0.001
+        self.arc_note_hits = 0
+        self.arc_note_misses = 0
 
     def clone(self):
         res = self.__class__()
@@ -91,6 +201,7 @@ class TrackMetaInfo:
         res.font_file = self.font_file
         res.enable_shadow = self.enable_shadow
         res.shadow_color = self.shadow_color
+        res.arc_note_precision = self.arc_note_precision
         return res
 
     @property
@@ -112,10 +223,12 @@ class TrackMetaInfo:
         self.__refresh_font()
 
     def __refresh_font(self):
-        self.__font = ImageFont.truetype(self.__font_file, size=round(self.__font_size * self.__zoom))
+        self.__font = None
 
     @property
     def font(self):
+        if self.__font is None:
+            self.__font = ImageFont.truetype(self.__font_file, size=round(self.__font_size * self.__zoom))
         return self.__font
 
     @property
@@ -125,6 +238,7 @@ class TrackMetaInfo:
     @zoom.setter
     def zoom(self, value):
         self.__zoom = value
+        self.__track_tile_image = None
         self.__refresh_note()
         self.__refresh_hold()
         self.__refresh_arc()
@@ -148,7 +262,7 @@ class TrackMetaInfo:
     @track_file.setter
     def track_file(self, value):
         self.__track_file = _file_default(value, _DEFAULT_TRACK_DARK if self.side == 1 else _DEFAULT_TRACK_LIGHT)
-        self.__track_image: Image.Image = Image.open(self.__track_file).convert('RGBA').transpose(Image.FLIP_TOP_BOTTOM)
+        self.__track_tile_image = None
 
     @property
     def enwiden_file(self):
@@ -157,7 +271,6 @@ class TrackMetaInfo:
     @enwiden_file.setter
     def enwiden_file(self, value):
         self.__enwiden_file = _file_default(value, _DEFAULT_ENWIDEN_DARK if self.side == 1 else _DEFAULT_ENWIDEN_LIGHT)
-        self.__enwiden_image: Image.Image = Image.open(self.__enwiden_file).convert('RGBA').transpose(Image.FLIP_TOP_BOTTOM)
 
     @property
     def note_file(self):
@@ -166,16 +279,20 @@ class TrackMetaInfo:
     @note_file.setter
     def note_file(self, value):
         self.__note_file = _file_default(value, _DEFAULT_NOTE_DARK if self.side == 1 else _DEFAULT_NOTE_LIGHT)
-        self.__note_image: Image.Image = Image.open(self.__note_file).convert('RGBA').transpose(Image.FLIP_TOP_BOTTOM)
         self.__refresh_note()
 
     def __refresh_note(self):
-        w, h = self.__note_image.size
-        target_w = 238 - self.__track_line_width
-        ratio = target_w / w
-        target_w = round(target_w * self.zoom)
-        target_h = round(h * ratio * self.zoom)
-        self.__stretched_note_image = self.__stretch(target_w, target_h, self.__note_image)
+        self.__stretched_note_image = None
+
+    def __stretched_note(self):
+        if self.__stretched_note_image is None:
+            w, h = self.note_image.size
+            target_w = 238 - self.__track_line_width
+            ratio = target_w / w
+            target_w = round(target_w * self.zoom)
+            target_h = round(h * ratio * self.zoom)
+            self.__stretched_note_image = sprite_cache.get(self.__note_file, (target_w, target_h))
+        return self.__stretched_note_image
 
     @property
     def hold_file(self):
@@ -184,14 +301,18 @@ class TrackMetaInfo:
     @hold_file.setter
     def hold_file(self, value):
         self.__hold_file = _file_default(value, _DEFAULT_HOLD_DARK if self.side == 1 else _DEFAULT_HOLD_LIGHT)
-        self.__hold_image: Image.Image = Image.open(self.__hold_file).convert('RGBA').transpose(Image.FLIP_TOP_BOTTOM)
         self.__refresh_hold()
 
     def __refresh_hold(self):
-        w, h = self.__hold_image.size
-        target_w = round((238 - self.__track_line_width) * self.zoom)
-        h = round(h * self.zoom)
-        self.__stretched_hold_image = self.__stretch(target_w, h, self.__hold_image)
+        self.__stretched_hold_image = None
+
+    def __stretched_hold(self):
+        if self.__stretched_hold_image is None:
+            w, h = self.hold_image.size
+            target_w = round((238 - self.__track_line_width) * self.zoom)
+            h = round(h * self.zoom)
+            self.__stretched_hold_image = sprite_cache.get(self.__hold_file, (target_w, h))
+        return self.__stretched_hold_image
 
     @property
     def arc_file(self):
@@ -200,32 +321,41 @@ class TrackMetaInfo:
     @arc_file.setter
     def arc_file(self, value):
         self.__arc_file = _file_default(value, _DEFAULT_ARC_DARK if self.side == 1 else _DEFAULT_ARC_LIGHT)
-        self.__arc_image: Image.Image = Image.open(self.__arc_file).convert('RGBA').transpose(Image.FLIP_TOP_BOTTOM)
         self.__refresh_arc()
 
     def __refresh_arc(self):
-        w, h = self.__arc_image.size
-        target_w = 238 - self.__track_line_width
-        ratio = target_w / w
-        target_w = round(target_w * self.zoom)
-        target_h = round(32 * ratio * self.zoom)
-        self.__stretched_arc_image = self.__stretch(target_w, target_h, self.__arc_image)
+        self.__stretched_arc_image = None
+        self.__arc_note_cache = {}
+
+    def __stretched_arc(self):
+        if self.__stretched_arc_image is None:
+            w, h = self.arc_image.size
+            target_w = 238 - self.__track_line_width
+            ratio = target_w / w
+            target_w = round(target_w * self.zoom)
+            target_h = round(32 * ratio * self.zoom)
+            self.__stretched_arc_image = sprite_cache.get(self.__arc_file, (target_w, target_h))
+        return self.__stretched_arc_image
 
     @property
     def track_image(self):
-        return self.__track_image
+        return sprite_cache.get(self.__track_file)
 
     @property
     def enwiden_image(self):
-        return self.__enwiden_image
+        return sprite_cache.get(self.__enwiden_file)
 
     @property
     def note_image(self):
-        return self.__note_image
+        return sprite_cache.get(self.__note_file)
 
     @property
     def hold_image(self):
-        return self.__hold_image
+        return sprite_cache.get(self.__hold_file)
+
+    @property
+    def arc_image(self):
+        return sprite_cache.get(self.__arc_file)
 
     def __duplicate_height(self, height, image):
         height = max(height, 1)
@@ -259,32 +389,137 @@ class TrackMetaInfo:
             return image
         return image.resize((width, height), Image.LANCZOS)
 
-    def track_to_image(self, height):
-        res = self.__duplicate_height(height, self.__track_image)
-        return self.__stretch(round(1024 * self.zoom), round(height * self.zoom), res)
+    def __track_tile(self):
+        """
+        The track image resized once to the current zoom.
+
+        Several track images are stacked so that the zoomed tile height is
+        (as close as possible to) an integer, and neighbouring copies are
+        used as the context of the filter, so tiling the result is the same
+        as resizing a duplicated full-height track.
+        """
+        if self.__track_tile_image is None:
+            image = self.track_image
+            w, h = image.size
+            zoom = self.zoom
+            best = None
+            for count in range(1, self.TRACK_TILE_MAX_COUNT + 1):
+                error = abs(count * h * zoom - round(count * h * zoom))
+                if best is None or error < best[0] - 1e-9:
+                    best = (error, count)
+                if error < 1e-6:
+                    break
+            count = best[1]
+            padding = math.ceil(3 / zoom / h) + 1 if zoom < 1 else 1
+            res = self.__duplicate_height(h * (count + padding * 2), image)
+            box = (0, h * padding, w, h * (count + padding))
+            tile_size = (max(round(w * zoom), 1), max(round(count * h * zoom), 1))
+            self.__track_tile_image = res.resize(tile_size, Image.LANCZOS, box=box)
+        return self.__track_tile_image
+
+    def track_to_image(self, height, window=None):
+        """
+        height: the full height before zooming
+        window: rows (start, end) of the zoomed image to generate, None for all rows
+        """
+        if window is None:
+            window = (0, max(round(height * self.zoom), 1))
+        start, end = window
+        tile = self.__track_tile()
+        tile_w, tile_h = tile.size
+        res = Image.new('RGBA', (tile_w, max(end - start, 1)), (0, 0, 0, 0))
+        y = -(start % tile_h)
+        while y < end - start:
+            res.paste(tile, (0, y))
+            y += tile_h
+        return res
 
-    def enwiden_to_image(self, height):
-        res = self.__stretch_height(height, self.__enwiden_image)
-        return self.__stretch(round(238 * self.zoom), round(height * self.zoom), res)
+    def enwiden_to_image(self, height, window=None):
+        """
+        height: the full height before zooming
+        window: rows (start, end) of the zoomed image to generate, None for all rows
+        """
+        zoomed_height = max(round(height * self.zoom), 1)
+        if window is None:
+            window = (0, zoomed_height)
+        start, end = window
+        image = self.enwiden_image
+        w, h = image.size
+        scale = h / zoomed_height
+        # The image is stretched to the full height, only resize the source rows of the window
+        box = (0, start * scale, w, end * scale)
+        return image.resize((max(round(238 * self.zoom), 1), max(end - start, 1)), Image.LANCZOS, box=box)
 
     def note_to_image(self):
-        return self.__stretched_note_image
+        return self.__stretched_note()
 
     def hold_to_image(self, height):
-        return self.__stretch_height(round(height * self.zoom), self.__stretched_hold_image)
+        # Holds of the same length share one sprite, stretched from the zoomed hold image
+        height = round(height * self.zoom)
+        base = self.__stretched_hold()
+        key = (self.__hold_file, (base.size[0], max(height, 1)), ('hold', base.size))
+        return sprite_cache.cached(key, lambda: self.__stretch_height(height, base))
+
+    def __arc_note_key(self, ratio):
+        precision = self.arc_note_precision
+        if precision:
+            key = round(ratio / precision)
+            return key, key * precision
+        return ratio, ratio
+
+    def __cached_arc_note(self, key, factory):
+        res = self.__arc_note_cache.get(key, None)
+        if res is None:
+            self.arc_note_misses += 1
+            res = factory()
+            self.__arc_note_cache[key] = res
+        else:
+            self.arc_note_hits += 1
+        return res
+
+    def __arc_note_sprite(self, key, ratio):
+        # The cached sprite of `key` without counting the lookup
+        res = self.__arc_note_cache.get(key, None)
+        if res is None:
+            base = self.__stretched_arc()
+            w, h = base.size
+            new_w, new_h = round(w * ratio ), round(h * ratio)
+            res = self.__arc_note_cache[key] = self.__stretch(new_w, new_h, base)
+        return res
 
     def arc_to_image(self, ratio):
-        base = self.__stretched_arc_image
-        w, h = base.size
-        new_w, new_h = round(w * ratio ), round(h * ratio)
-        return self.__stretch(new_w, new_h, base)
+        key, ratio = self.__arc_note_key(ratio)
+        return self.__cached_arc_note(key, lambda: self.__arc_note_sprite(key, ratio))
+
+    def arc_note_cache_info(self):
+        return {
+            'entries': len(self.__arc_note_cache),
+            'hits': self.arc_note_hits,
+            'misses': self.arc_note_misses,
+            'precision': self.arc_note_precision,
+        }
+
+    def preload(self):
+        """
+        Decode and stretch every sprite used by a render ahead of time.
+        """
+        self.track_image
+        self.enwiden_image
+        self.__stretched_note()
+        self.__stretched_hold()
+        self.__stretched_arc()
+        self.font
+        return self
 
     def arc_to_shadow(self, ratio):
-        res = self.arc_to_image(ratio)
-        shadow = Image.new('RGBA', res.size, self.shadow_color)
-        bg = Image.new('RGBA', res.size, (0, 0, 0, 0))
-        bg.paste(shadow, mask=res)
-        return bg
+        key, ratio = self.__arc_note_key(ratio)
+        def _factory():
+            res = self.__arc_note_sprite(key, ratio)
+            shadow = Image.new('RGBA', res.size, self.shadow_color)
+            bg = Image.new('RGBA', res.size, (0, 0, 0, 0))
+            bg.paste(shadow, mask=res)
+            return bg
+        return self.__cached_arc_note(('shadow', key, self.shadow_color), _factory)
 
 
 class Easing:
@@ -292,6 +527,10 @@ class Easing:
     SINE_IN = 1
     SINE_OUT = 2
     BOTH = 3
+    __slots__ = ('__x', '__y')
+    # Easing name to the shared instance, see Easing.get
+    _interned = {}
+
     def __init__(self, easing : str):
         self.__x = self.STRAIGHT
         self.__y = self.STRAIGHT
@@ -330,18 +569,67 @@ class Easing:
             x = (x2 - x1) * time_ratio + x1
         return x
 
-    def __hash__(self):
+    @classmethod
+    def positions(cls, easing, x1, x2, time_ratio):
+        # Easing.position for an array of time ratios
+        if easing == cls.BOTH:
+            x = (x1 - x2) / 2 * np.cos(np.pi * time_ratio) + (x1 + x2) / 2
+        elif easing == cls.SINE_IN:
+            x = (x2 - x1) * np.sin(np.pi * time_ratio / 2) + x1
+        elif easing == cls.SINE_OUT:
+            x = (x1 - x2) * np.cos(np.pi * time_ratio / 2) + x2
+        else:
+            x = (x2 - x1) * time_ratio + x1
+        return x
+
+    @property
+    def code(self):
         return (self.__y << 2) + self.__x
 
+    @classmethod
+    def get(cls, easing : str):
+        # Easings are immutable, so arcs share one instance per name
+        res = cls._interned.get(easing, None)
+        if res is None:
+            res = cls._interned.setdefault(easing, cls(easing))
+        return res
+
+    @classmethod
+    def name_from_code(cls, code):
+        return _Easing_names[code]
+
+    @classmethod
+    def positions_by_codes(cls, codes, x1, x2, time_ratio):
+        # Easing.positions with an easing code for each element
+        res = np.empty(len(time_ratio))
+        for easing in (cls.STRAIGHT, cls.SINE_IN, cls.SINE_OUT, cls.BOTH):
+            mask = codes == easing
+            if mask.any():
+                res[mask] = cls.positions(easing, x1[mask], x2[mask], time_ratio[mask])
+        return res
+
+    def __hash__(self):
+        return self.code
+
     def __eq__(self, other):
         if not isinstance(other, self.__class__):
             return False
         return self.__x == other.__x and self.__y == other.__y
 
+# Easing code to an easing name parsed into the same Easing
+_Easing_names = {}
+for _name in ('s', 'b', 'si', 'so', 'sisi', 'siso', 'sosi', 'soso', 'sssi', 'ssso'):
+    _Easing_names[Easing(_name).code] = _name
+del _name
+
 def _pos_to_x(x : float):
     # The x span is from -1 to 2
     return 36 + (x + 1) * 1428 / 3
 
+def _arc_pos_to_height_ratios(y : np.ndarray):
+    # _arc_pos_to_height_ratio for arrays
+    return (VISION_HEIGHT - GROUND_HEIGHT) / (VISION_HEIGHT - np.minimum(y, VISION_CAP))
+
 def _arc_pos_to_height_ratio(y : float):
     # The y span is from -0.2? to 1.61?
     vision_height = VISION_HEIGHT
@@ -363,6 +651,10 @@ def _tap_pos_to_height_ratio(y : float):
     g_distance = vision_height - same_size_height
     return g_distance / y_distance
 
+def _tap_pos_to_height_ratios(y : np.ndarray):
+    # _tap_pos_to_height_ratio for arrays
+    return (TAP_VISION_HEIGHT - TAP_GROUND_HEIGHT) / (TAP_VISION_HEIGHT - np.minimum(y, TAP_VISION_CAP))
+
 def _shadow_pos_to_height_ratio(y):
     light = LIGHT_HEIGHT
     ground = GROUND_HEIGHT
@@ -377,11 +669,47 @@ def _time_to_height(time, speed : float):
 def _height_to_time(height, speed : float):
     return height * 1000 / speed
 
+def _alpha_composite(image : Image.Image, sprite : Image.Image, dest):
+    # Image.alpha_composite does not accept negative destinations, so clip the sprite instead
+    x, y = dest
+    w, h = sprite.size
+    if x + w <= 0 or y + h <= 0 or x >= image.size[0] or y >= image.size[1]:
+        return image
+    if x >= 0 and y >= 0:
+        image.alpha_composite(sprite, dest=(x, y))
+    else:
+        image.alpha_composite(sprite, dest=(max(x, 0), max(y, 0)), source=(max(-x, 0), max(-y, 0)))
+    return image
+
+def _union_box(boxes):
+    # The box (left, top, right, bottom) covering all boxes, or None if there is none
+    res = None
+    for left, top, right, bottom in boxes:
+        if res is None:
+            res = (left, top, right, bottom)
+        else:
+            res = (min(res[0], left), min(res[1], top), max(res[2], right), max(res[3], bottom))
+    return res
+
+def _clip_box(box, size):
+    # The part of a box within an image of `size`, or None if it is empty
+    if box is None:
+        return None
+    left, top, right, bottom = max(box[0], 0), max(box[1], 0), min(box[2], size[0]), min(box[3], size[1])
+    if left >= right or top >= bottom:
+        return None
+    return left, top, right, bottom
+
 class _Drawable:
-    def draw(self, image : Image.Image, draw : ImageDraw.ImageDraw, track_meta : TrackMetaInfo, speed : float):
+    __slots__ = ()
+
+    # `offset` is the row of the zoomed chart that row 0 of `image` corresponds to
+    def draw(self, image : Image.Image, draw : ImageDraw.ImageDraw, track_meta : TrackMetaInfo, speed : float, offset=0):
         return image
 
 class GroundNote(_Drawable):
+    __slots__ = ('start', 'lane')
+
     def __init__(self, start, lane):
         self.start = start
         self.lane = lane
@@ -389,16 +717,18 @@ class GroundNote(_Drawable):
     def __lt__(self, other):
         return self.start < other.start
 
-    def draw(self, image : Image.Image, draw : ImageDraw.ImageDraw, track_meta : TrackMetaInfo, speed : float):
+    def draw(self, image : Image.Image, draw : ImageDraw.ImageDraw, track_meta : TrackMetaInfo, speed : float, offset=0):
         note_image = track_meta.note_to_image()
         dest_x = 36 + track_meta.track_line_width / 2 + 238 * self.lane
         # TODO: is - note_image.size[1] / 2 correct?
         dest_x = round(dest_x * track_meta.zoom + track_meta.extra_width * track_meta.zoom)
-        dest_y = round(_time_to_height(self.start, speed) * track_meta.zoom)# - note_image.size[1] / 2
-        image.alpha_composite(note_image, dest=(dest_x, dest_y))
+        dest_y = round(_time_to_height(self.start, speed) * track_meta.zoom) - offset# - note_image.size[1] / 2
+        _alpha_composite(image, note_image, (dest_x, dest_y))
         return image
 
 class Hold(_Drawable):
+    __slots__ = ('start', 'end', 'lane')
+
     def __init__(self, start, end, lane):
         self.start = start
         self.end = end
@@ -407,15 +737,17 @@ class Hold(_Drawable):
     def __lt__(self, other):
         return self.start < other.start
 
-    def draw(self, image : Image.Image, draw : ImageDraw.ImageDraw, track_meta : TrackMetaInfo, speed : float):
+    def draw(self, image : Image.Image, draw : ImageDraw.ImageDraw, track_meta : TrackMetaInfo, speed : float, offset=0):
         hold_image = track_meta.hold_to_image(round(_time_to_height(self.end - self.start, speed)))
         dest_x = 36 + track_meta.track_line_width / 2 + 238 * self.lane
         dest_x = round(dest_x * track_meta.zoom + track_meta.extra_width * track_meta.zoom)
-        dest_y = round(_time_to_height(self.start, speed) * track_meta.zoom)
-        image.alpha_composite(hold_image, dest=(dest_x, dest_y))
+        dest_y = round(_time_to_height(self.start, speed) * track_meta.zoom) - offset
+        _alpha_composite(image, hold_image, (dest_x, dest_y))
         return image
 
 class Arc(_Drawable):
+    __slots__ = ('start', 'end', 'x_start', 'x_end', 'y_start', 'y_end', 'easing', 'color', 'hitsound', 'skyline', 'taps')
+
     def __init__(self, start, end, x_start, x_end, easing, y_start, y_end, color, hitsound, skyline, taps=None):
         self.start = start
         self.end = end
@@ -423,14 +755,12 @@ class Arc(_Drawable):
         self.x_end = x_end
         self.y_start = y_start
         self.y_end = y_end
-        self.easing = Easing(easing)
+        self.easing = Easing.get(easing)
         self.color = color
         self.hitsound = hitsound
         self.skyline = not (isinstance(skyline, str) and skyline.lower() == 'false' or not skyline)
-        self.taps = []
-        if taps is not None:
-            for time in taps:
-                self.taps.append(time)
+        # A tuple is smaller than a list, and arcs without taps share the empty tuple
+        self.taps = () if taps is None else tuple(taps)
 
     def _extra_width_pos(self, x, y, base_width):
         real_x = _pos_to_x(x)
@@ -479,6 +809,29 @@ class Arc(_Drawable):
         x, y = Easing.position(self.easing.x, x1, x2, time_ratio), Easing.position(self.easing.y, y1, y2, time_ratio)
         return x, y
 
+    def positions(self, times : np.ndarray):
+        # Arc.position for an array of times
+        t1, t2 = self.start, self.end
+        x1, x2, y1, y2 = self.x_start, self.x_end, self.y_start, self.y_end
+        time_ratio = (times - t1) / (t2 - t1)
+        return Easing.positions(self.easing.x, x1, x2, time_ratio), Easing.positions(self.easing.y, y1, y2, time_ratio)
+
+    def x_slopes(self, times : np.ndarray):
+        # Arc.x_slope for an array of times of an ordinary arc
+        time_span = self.end - self.start
+        slope_base = (self.x_end - self.x_start) / time_span
+        time_position = (times - self.start) / time_span
+        easing = self.easing.x
+        if easing == Easing.BOTH:
+            slope = slope_base * np.sin(np.pi * time_position)
+        elif easing == Easing.SINE_IN:
+            slope = slope_base * np.cos(np.pi / 2 * time_position)
+        elif easing == Easing.SINE_OUT:
+            slope = slope_base * np.sin(np.pi / 2 * time_position)
+        else:
+            slope = np.full_like(time_position, slope_base)
+        return slope
+
     def __slope(self, time, x_start, x_end, easing):
         """
         d_x / d_time
@@ -514,13 +867,21 @@ class Arc(_Drawable):
         return self.__slope(time, self.y_start, self.y_end, self.easing.y)
 
     @classmethod
-    def draw_arc_note(cls, x, y, time, image : Image.Image, draw : ImageDraw.ImageDraw, track_meta: TrackMetaInfo, speed):
+    def arc_note_sprite(cls, x, y, time, track_meta: TrackMetaInfo, speed, offset=0):
+        """
+        The sprite of an arc note and its destination.
+        """
         ratio = _tap_pos_to_height_ratio(y)
         arc_note = track_meta.arc_to_image(ratio)
         real_x = round(_pos_to_x(x) * track_meta.zoom - arc_note.size[0] / 2 + track_meta.extra_width * track_meta.zoom)
         # TODO: -1/2?
-        real_y = round(_time_to_height(time, speed) * track_meta.zoom)
-        image.alpha_composite(arc_note, dest=(real_x, real_y))
+        real_y = round(_time_to_height(time, speed) * track_meta.zoom) - offset
+        return arc_note, (real_x, real_y)
+
+    @classmethod
+    def draw_arc_note(cls, x, y, time, image : Image.Image, draw : ImageDraw.ImageDraw, track_meta: TrackMetaInfo, speed, offset=0):
+        arc_note, dest = cls.arc_note_sprite(x, y, time, track_meta, speed, offset)
+        _alpha_composite(image, arc_note, dest)
         return image
 
     def __lt__(self, other):
@@ -595,6 +956,8 @@ def group_arcs(arcs, tolerance=0):
 class ArcGroups(_Drawable):
     # Pixels of small lines
     DRAW_DIFFERENTIAL_LENGTH = 20
+    # Grid points per sample used to integrate the length of arcs
+    SAMPLE_SUBDIVISION = 2
     BASE_ARC_WIDTH = 40
     BASE_LINE_WIDTH = 10
 
@@ -605,13 +968,15 @@ class ArcGroups(_Drawable):
             color = -1
         self.arcs = sorted(arcs)
         self.color = color
+        self.__outline = None
 
     @classmethod
     def pos_from_angle(cls, x_angle, width=1.0, base=(0, 0), postprocess=None):
         # angle: dx / dt
+        # Works on both numbers and arrays
         base_x, base_y = base
-        delta_x = width * math.sin(x_angle)
-        delta_y = width * math.cos(x_angle)
+        delta_x = width * np.sin(x_angle)
+        delta_y = width * np.cos(x_angle)
         x = base_x + delta_x
         y = base_y + delta_y
         if postprocess:
@@ -620,40 +985,73 @@ class ArcGroups(_Drawable):
 
     @classmethod
     def arc_sequence(cls, arc : Arc, speed):
-        assert arc.start < arc.end
-        delta_dis = cls.DRAW_DIFFERENTIAL_LENGTH
+        return cls.arc_sequences([arc], speed)[0].tolist()
 
-        points = []
-        if arc.easing.x == Easing.BOTH:
-            time_start, time_end, time_half = arc.start, arc.end, (arc.start + arc.end) / 2
-            y_start, y_end, y_half = _time_to_height(time_start, speed), _time_to_height(time_end, speed), _time_to_height(time_half, speed)
-
-            y_current = y_start
-            while y_current < y_half:
-                time_current = _height_to_time(y_current, speed)
-                points.append(time_current)
-                current_slope = arc.x_real_slope(speed, arc.x_slope(time_current))
-                assert not np.isinf(current_slope), 'The slope is inf or -inf'
-                delta_y = delta_dis / math.sqrt(1 + current_slope * current_slope)
-                y_current += delta_y
-            rev_points = [time_end - (time_current - time_start) for time_current in points]
-            points.append(time_half)
-            points.extend(reversed(rev_points))
-        else:
-            time_start, time_end = arc.start, arc.end
-            y_start, y_end = _time_to_height(time_start, speed), _time_to_height(time_end, speed)
+    @classmethod
+    def arc_sequences(cls, arcs, speed):
+        """
+        Sample times of ordinary arcs, about DRAW_DIFFERENTIAL_LENGTH pixels apart along each arc.
 
-            y_current = y_start
-            while y_current < y_end:
-                time_current = _height_to_time(y_current, speed)
-                points.append(time_current)
-                current_slope = arc.x_real_slope(speed, arc.x_slope(time_current))
-                assert not np.isinf(current_slope), 'The slope is inf or -inf'
-                delta_y = delta_dis / math.sqrt(1 + current_slope * current_slope)
-                y_current += delta_y
-            points.append(time_end)
+        The length along every arc is integrated on a grid of SAMPLE_SUBDIVISION points per sample
+        and inverted by interpolation, all arcs at once.
+        Arcs with Easing.BOTH are sampled on the first half and mirrored.
+        Returns an array of times for each arc, ending with the end of the arc.
+        """
+        if not arcs:
+            return []
+        delta_dis = cls.DRAW_DIFFERENTIAL_LENGTH
+        grid_dis = delta_dis / cls.SAMPLE_SUBDIVISION
+
+        starts = np.array([arc.start for arc in arcs], dtype=np.float64)
+        ends = np.array([arc.end for arc in arcs], dtype=np.float64)
+        assert np.all(starts < ends)
+        x_spans = np.array([arc.x_end - arc.x_start for arc in arcs], dtype=np.float64)
+        easings = np.array([arc.easing.x for arc in arcs])
+        both = easings == Easing.BOTH
+        sample_ends = np.where(both, (starts + ends) / 2, ends)
+
+        # Grid over each arc (or its first half), including both ends
+        heights = _time_to_height(sample_ends - starts, speed)
+        segments = np.maximum(np.ceil(heights / grid_dis).astype(np.int64), 1)
+        counts = segments + 1
+        offsets = np.cumsum(counts) - counts
+        arc_index = np.repeat(np.arange(len(arcs)), counts)
+        local = np.arange(counts.sum()) - offsets[arc_index]
+        times = starts[arc_index] + (sample_ends - starts)[arc_index] * local / segments[arc_index]
+
+        # d_x / d_y in pixels, see Arc.x_slope and Arc.x_real_slope
+        # Every easing factor is written as sin(a * time_position + b):
+        # BOTH: sin(pi * p), SINE_IN: cos(pi / 2 * p), SINE_OUT: sin(pi / 2 * p), STRAIGHT: 1
+        sine = (easings == Easing.SINE_IN) | (easings == Easing.SINE_OUT)
+        factor_a = np.select([both, sine], [np.pi, np.pi / 2], 0.0)
+        factor_b = np.where(both | (easings == Easing.SINE_OUT), 0.0, np.pi / 2)
+        time_span = ends - starts
+        slopes = np.sin((factor_a / time_span)[arc_index] * (times - starts[arc_index]) + factor_b[arc_index])
+        slopes *= (x_spans / time_span * 1428 / (3 * _time_to_height(1, speed)))[arc_index]
+        lengths = np.sqrt(1 + slopes * slopes)
+
+        # Cumulative length by the trapezoidal rule.
+        # A gap of one sample is left between arcs so that the cumulative length is strictly increasing.
+        steps = (lengths[1:] + lengths[:-1]) / 2 * (heights / segments)[arc_index[1:]]
+        steps[local[1:] == 0] = delta_dis
+        cumulative = np.concatenate(([0.0], np.cumsum(steps)))
+        arc_begin = cumulative[offsets]
+        arc_length = cumulative[offsets + segments] - arc_begin
+
+        # Samples at 0, delta_dis, 2 * delta_dis, ... before the end of each arc (or its first half)
+        sample_counts = np.maximum(np.ceil(arc_length / delta_dis).astype(np.int64), 1)
+        sample_index = np.repeat(np.arange(len(arcs)), sample_counts)
+        sample_local = np.arange(sample_counts.sum()) - (np.cumsum(sample_counts) - sample_counts)[sample_index]
+        samples = np.interp(arc_begin[sample_index] + sample_local * delta_dis, cumulative, times)
 
-        return points
+        res = []
+        for index, points in enumerate(np.split(samples, np.cumsum(sample_counts)[:-1])):
+            if both[index]:
+                rev_points = ends[index] - (points - starts[index])
+                res.append(np.concatenate((points, [sample_ends[index]], rev_points[::-1])))
+            else:
+                res.append(np.append(points, ends[index]))
+        return res
 
     def arc_notes(self):
         res = []
@@ -661,167 +1059,150 @@ class ArcGroups(_Drawable):
             res.extend(arc.arc_notes())
         return res
 
-    def draw(self, image : Image.Image, draw : ImageDraw.ImageDraw, track_meta : TrackMetaInfo, speed : float):
+    def outline(self, speed):
+        """
+        The polygon of the arc group before zooming, as an array of points.
+        The result is cached for the last speed.
+        """
+        if self.__outline is not None and self.__outline[0] == speed:
+            return self.__outline[1]
+        pos = self.__outline_points(speed)
+        self.__outline = (speed, pos)
+        return pos
+
+    @classmethod
+    def prepare_outlines(cls, arc_groups, speed):
+        """
+        Compute the outlines of many arc groups, sampling all of their arcs at once.
+        """
+        arc_groups = [arc_group for arc_group in arc_groups if arc_group.__outline is None or arc_group.__outline[0] != speed]
+        arcs = [arc for arc_group in arc_groups for arc in arc_group.arcs if arc.start < arc.end]
+        sequences = dict(zip(map(id, arcs), cls.arc_sequences(arcs, speed)))
+        for arc_group in arc_groups:
+            arc_group.__outline = (speed, arc_group.__outline_points(speed, sequences))
+
+    def bounds(self, track_meta : TrackMetaInfo, speed : float):
+        """
+        The rows (top, bottom) of the zoomed chart covered by the polygon.
+        """
+        ys = self.outline(speed)[:, 1]
+        return math.floor(ys.min() * track_meta.zoom), math.ceil(ys.max() * track_meta.zoom) + 1
+
+    def __outline_points(self, speed, sequences=None):
         sin_cap = 0.001
 
         # self.arcs has to be sorted
+        arcs = self.arcs
         diff_len = self.DRAW_DIFFERENTIAL_LENGTH
         if self.color >= 0:
             base_width = self.BASE_ARC_WIDTH
         else:
             base_width = self.BASE_LINE_WIDTH
 
+        if sequences is None:
+            ordinary_arcs = [arc for arc in arcs if arc.start < arc.end]
+            sequences = dict(zip(map(id, ordinary_arcs), self.arc_sequences(ordinary_arcs, speed)))
+
+        # The joint of each arc and the next one, for all arcs at once.
+        # Vertical arcs have an angle of +-pi / 2, or 0 when x does not change.
+        vertical = np.array([arc.end <= arc.start for arc in arcs])
+        x_starts = _pos_to_x(np.array([arc.x_start for arc in arcs], dtype=np.float64))
+        x_ends = _pos_to_x(np.array([arc.x_end for arc in arcs], dtype=np.float64))
+        flat = vertical & (x_starts == x_ends)
+        slopes = [arcs[i].x_slope(arcs[i].start) for i in range(1, len(arcs))]
+        slopes.append(arcs[-1].x_slope(arcs[-1].end))
+        next_angles = np.arctan(Arc.x_real_slope(speed, np.array(slopes, dtype=np.float64)))
+
+        end_positions = np.array([(arc.x_end, arc.y_end) if arc.end <= arc.start else arc.position(arc.end) for arc in arcs], dtype=np.float64)
+        end_slopes = np.array([0 if arc.end <= arc.start else arc.x_slope(arc.end) for arc in arcs], dtype=np.float64)
+        current_angles = np.where(
+            vertical,
+            np.where(x_starts < x_ends, math.pi / 2, -math.pi / 2),
+            np.arctan(Arc.x_real_slope(speed, end_slopes)),
+        )
+        current_angles[flat] = 0
+        base_x = np.where(vertical, x_ends, _pos_to_x(end_positions[:, 0]))
+        base_y = _time_to_height(np.array([arc.start if arc.end <= arc.start else arc.end for arc in arcs], dtype=np.float64), speed)
+        end_widths = base_width * _arc_pos_to_height_ratios(end_positions[:, 1])
+
+        # a_right <= current_angle <= a_left
+        a_left = (current_angles + next_angles + math.pi) / 2
+        a_right = (current_angles + next_angles - math.pi) / 2
+        a_dis_left = a_left - current_angles
+        a_dis_right = current_angles - a_right
+        # The inner side is widened to keep the width at the joint
+        left_inner = a_dis_left > a_dis_right
+        sin_left = np.maximum(np.sin(a_dis_left), sin_cap)
+        sin_right = np.maximum(np.sin(a_dis_right), sin_cap)
+        w_left = np.where(left_inner, np.round(end_widths / (2 * sin_left)), np.round(end_widths / 2))
+        w_right = np.where(left_inner, np.round(end_widths / 2), np.round(end_widths / (2 * sin_right)))
+        w_left[flat] = end_widths[flat] / 2
+        w_right[flat] = end_widths[flat] / 2
+        left_ends = np.stack(self.pos_from_angle(a_left, w_left, base=(base_x, base_y)), axis=1)
+        right_ends = np.stack(self.pos_from_angle(a_right, w_right, base=(base_x, base_y)), axis=1)
+
         left_pos = []
         right_pos = []
-        slopes = [self.arcs[i].x_slope(self.arcs[i].start) for i in range(1, len(self.arcs))]
-        slopes.append(self.arcs[-1].x_slope(self.arcs[-1].end))
         prev_left = None
         prev_right = None
-        for arc, next_slope in zip(self.arcs, slopes):
+        for index, arc in enumerate(arcs):
             arc : Arc
-            next_angle = math.atan(Arc.x_real_slope(speed, next_slope))
-            if arc.end <= arc.start:
-                # vertical arc
-                y_base = _time_to_height(arc.start, speed)
+            left_end, right_end = left_ends[index], right_ends[index]
+            if vertical[index]:
+                y_base = base_y[index]
                 sign_factor = 1 if arc.x_start < arc.x_end else -1
-                current_angle = sign_factor * math.pi / 2
-
-                x_start = _pos_to_x(arc.x_start)
-                x_end = _pos_to_x(arc.x_end)
-                if x_start < x_end:
-                    x_pos = list(np.arange(x_start, x_end, diff_len))
-                elif x_start > x_end:
-                    x_pos = list(np.arange(x_start, x_end, -diff_len))
-                else:
-                    x_pos = None
+                x_start, x_end = x_starts[index], x_ends[index]
                 if not left_pos or not right_pos:
                     # left_pos and right_pos is empty
                     # TODO: to check if the sign_factor is correct or inversed
                     w_initial = base_width * _arc_pos_to_height_ratio(arc.y_start)
-                    left_pos.append((x_start, y_base - sign_factor * w_initial / 2))
-                    right_pos.append((x_start, y_base + sign_factor * w_initial / 2))
-                if x_pos is not None:
-                    # The last position pair
-                    # left: (angle1 + angle2 + pi) / 2
-                    # right: (angle1 + angle2 - pi) / 2
-                    w_end = base_width * _arc_pos_to_height_ratio(arc.y_end)
-                    a_left = (current_angle + next_angle + math.pi) / 2
-                    a_right = (current_angle + next_angle - math.pi) / 2
-                    a_dis_left = a_left - current_angle
-                    a_dis_right = current_angle - a_right
-
-                    if a_dis_left > a_dis_right:
-                        # left is the inner
-                        sin = math.sin(a_dis_left)
-                        if sin < sin_cap:
-                            sin = sin_cap
-                        w_left = round(w_end / (2 * sin))
-                        w_right = round(w_end / 2)
+                    left_pos.append(np.array([[x_start, y_base - sign_factor * w_initial / 2]]))
+                    right_pos.append(np.array([[x_start, y_base + sign_factor * w_initial / 2]]))
+                if not flat[index]:
+                    x_pos = np.arange(x_start, x_end, sign_factor * diff_len)[1:]
+                    y_pos = arc.y_start + (arc.y_end - arc.y_start) / (x_end - x_start) * (x_pos - x_start)
+                    half_widths = base_width * _arc_pos_to_height_ratios(y_pos) / 2
+                    if sign_factor > 0:
+                        # x_start < x_end, discard right pos at the end, discard left pos at the beginning
+                        left_mask = x_pos > prev_left[0] if prev_left is not None else np.ones(len(x_pos), dtype=bool)
+                        right_mask = x_pos < right_end[0]
                     else:
-                        # right is the inner
-                        sin = math.sin(a_dis_right)
-                        if sin < sin_cap:
-                            sin = sin_cap
-                        w_left = round(w_end / 2)
-                        w_right = round(w_end / (2 * sin))
-
-                    left_end = self.pos_from_angle(a_left, w_left, base=(x_end, y_base))
-                    right_end = self.pos_from_angle(a_right, w_right, base=(x_end, y_base))
-
-                    y_for_x = (arc.y_end - arc.y_start) / (x_end - x_start)
-                    for index in range(len(x_pos) - 1):
-                        dx_end = x_pos[index + 1]
-                        dy_end = arc.y_start + y_for_x * (dx_end - x_start)
-                        w_end = base_width * _arc_pos_to_height_ratio(dy_end)
-
-                        if sign_factor > 0:
-                            # x_start < x_end, discard right pos at the end, discard left pos at the beginning
-                            if prev_left is None or dx_end > prev_left[0]:
-                                left_pos.append((dx_end, y_base - sign_factor * w_end / 2))
-                            if dx_end < right_end[0]:
-                                right_pos.append((dx_end, y_base + sign_factor * w_end / 2))
-                        else:
-                            # x_start > x_end, discard left pos at the end, discard right pos at the beginning
-                            if prev_right is None or dx_end < prev_right[0]:
-                                right_pos.append((dx_end, y_base + sign_factor * w_end / 2))
-                            if dx_end > left_end[0]:
-                                left_pos.append((dx_end, y_base - sign_factor * w_end / 2))
-
-                    left_pos.append(left_end)
-                    right_pos.append(right_end)
-                    prev_left, prev_right = left_end, right_end
-                else:
-                    # x_start == x_end
-                    current_angle = 0
-                    w_end = base_width * _arc_pos_to_height_ratio(arc.y_end)
-                    a_left = (current_angle + next_angle + math.pi) / 2
-                    a_right = (current_angle + next_angle - math.pi) / 2
-                    left_end = self.pos_from_angle(a_left, w_end / 2, base=(x_end, y_base))
-                    right_end = self.pos_from_angle(a_right, w_end / 2, base=(x_end, y_base))
-                    left_pos.append(left_end)
-                    right_pos.append(right_end)
-                    prev_left, prev_right = left_end, right_end
+                        # x_start > x_end, discard left pos at the end, discard right pos at the beginning
+                        left_mask = x_pos > left_end[0]
+                        right_mask = x_pos < prev_right[0] if prev_right is not None else np.ones(len(x_pos), dtype=bool)
+                    left_pos.append(np.stack((x_pos, y_base - sign_factor * half_widths), axis=1)[left_mask])
+                    right_pos.append(np.stack((x_pos, y_base + sign_factor * half_widths), axis=1)[right_mask])
             else:
-                # ordinary arc
-                time_points = self.arc_sequence(arc, speed)
-                if not left_pos or not right_pos:
-                    _start_index = 0
-                else:
-                    _start_index = 1
-
-                # The last point
-                current_time = time_points[-1]
-                real_slope = arc.x_real_slope(speed, arc.x_slope(current_time))
-                current_x, current_y = arc.position(current_time)
-                real_x = _pos_to_x(current_x)
-                real_w = base_width * _arc_pos_to_height_ratio(current_y)
-                real_y = _time_to_height(current_time, speed)
-                current_angle = math.atan(real_slope)
-                # a_right <= current_angle <= a_left
-                a_left = (current_angle + next_angle + math.pi) / 2
-                a_right = (current_angle + next_angle - math.pi) / 2
-                a_dis_left = a_left - current_angle
-                a_dis_right = current_angle - a_right
-
-                if a_dis_left > a_dis_right:
-                    # left is the inner
-                    sin = math.sin(a_dis_left)
-                    if sin < sin_cap:
-                        sin = sin_cap
-                    w_left = round(real_w / (2 * sin))
-                    w_right = round(real_w / 2)
-                else:
-                    # right is the inner
-                    sin = math.sin(a_dis_right)
-                    if sin < sin_cap:
-                        sin = sin_cap
-                    w_left = round(real_w / 2)
-                    w_right = round(real_w / (2 * sin))
-
-                left_pos_end = self.pos_from_angle(a_left, w_left, base=(real_x, real_y))
-                right_pos_end = self.pos_from_angle(a_right, w_right, base=(real_x, real_y))
-
-                for current_time in time_points[_start_index:-1]:
-                    real_slope = arc.x_real_slope(speed, arc.x_slope(current_time))
-                    current_x, current_y = arc.position(current_time)
-                    real_x = _pos_to_x(current_x)
-                    real_w = base_width * _arc_pos_to_height_ratio(current_y)
-                    real_y = _time_to_height(current_time, speed)
-                    current_angle = math.atan(real_slope)
-
-                    _left_pos = self.pos_from_angle(current_angle + math.pi / 2, real_w / 2, base=(real_x, real_y))
-                    _right_pos = self.pos_from_angle(current_angle - math.pi / 2, real_w / 2, base=(real_x, real_y))
-                    # ordinary arcs can simply compare time
-                    if (prev_left is None or prev_left[1] < _left_pos[1]) and  _left_pos[1] < left_pos_end[1]:
-                        left_pos.append(_left_pos)
-                    if (prev_right is None or prev_right[1] < _right_pos[1]) and  _right_pos[1] < right_pos_end[1]:
-                        right_pos.append(_right_pos)
-                left_pos.append(left_pos_end)
-                right_pos.append(right_pos_end)
-                prev_left, prev_right = left_pos_end, right_pos_end
-        pos = []
-        pos.extend(left_pos)
-        pos.extend(reversed(right_pos))
+                # ordinary arc, the last point is the joint
+                time_points = sequences[id(arc)]
+                _start_index = 0 if not left_pos or not right_pos else 1
+                times = time_points[_start_index:-1]
+                angles = np.arctan(Arc.x_real_slope(speed, arc.x_slopes(times)))
+                xs, ys = arc.positions(times)
+                real_x = _pos_to_x(xs)
+                real_y = _time_to_height(times, speed)
+                half_widths = base_width * _arc_pos_to_height_ratios(ys) / 2
+                _left_pos = np.stack(self.pos_from_angle(angles + math.pi / 2, half_widths, base=(real_x, real_y)), axis=1)
+                _right_pos = np.stack(self.pos_from_angle(angles - math.pi / 2, half_widths, base=(real_x, real_y)), axis=1)
+                # ordinary arcs can simply compare time
+                left_mask = _left_pos[:, 1] < left_end[1]
+                right_mask = _right_pos[:, 1] < right_end[1]
+                if prev_left is not None:
+                    left_mask &= prev_left[1] < _left_pos[:, 1]
+                if prev_right is not None:
+                    right_mask &= prev_right[1] < _right_pos[:, 1]
+                left_pos.append(_left_pos[left_mask])
+                right_pos.append(_right_pos[right_mask])
+            left_pos.append(left_end[np.newaxis])
+            right_pos.append(right_end[np.newaxis])
+            prev_left, prev_right = left_end, right_end
+        return np.concatenate((np.concatenate(left_pos), np.concatenate(right_pos)[::-1]))
+
+    def draw(self, image : Image.Image, draw : ImageDraw.ImageDraw, track_meta : TrackMetaInfo, speed : float, offset=0, left=0):
+        """
+        `left` is the column of the chart that column 0 of `image` corresponds to.
+        """
+        pos = self.outline(speed)
 
         if self.color == 0:
             # Blue
@@ -838,12 +1219,25 @@ class ArcGroups(_Drawable):
         else:
             # line
             fill_color = track_meta.black_color
-        real_pos = []
-        for x, y in pos:
-            real_pos.append((round(x * track_meta.zoom + track_meta.extra_width * track_meta.zoom), round(y * track_meta.zoom)))
-        draw.polygon(real_pos, fill=fill_color)
+        real_pos = self.__real_outline(pos, track_meta, offset, left)
+        draw.polygon(real_pos.ravel().tolist(), fill=fill_color)
         return image, pos
 
+    def __real_outline(self, pos, track_meta : TrackMetaInfo, offset=0, left=0):
+        real_pos = np.empty(pos.shape, dtype=np.int64)
+        real_pos[:, 0] = np.round(pos[:, 0] * track_meta.zoom + track_meta.extra_width * track_meta.zoom) - left
+        real_pos[:, 1] = np.round(pos[:, 1] * track_meta.zoom) - offset
+        return real_pos
+
+    def box(self, track_meta : TrackMetaInfo, speed : float, offset=0):
+        """
+        The box (left, top, right, bottom) of the pixels `draw` may fill with the same arguments, with a margin of 1 pixel.
+        """
+        real_pos = self.__real_outline(self.outline(speed), track_meta, offset)
+        left, top = real_pos.min(axis=0).tolist()
+        right, bottom = real_pos.max(axis=0).tolist()
+        return left - 1, top - 1, right + 2, bottom + 2
+
 class Camera:
     def __init__(self, time, transverse, bottomzoom, linezoom, steadyangle, topzoom, angle, easing, lastingtime):
         self.start = time
@@ -863,6 +1257,8 @@ class SceneControl:
         self.params = params
 
 class Timing:
+    __slots__ = ('time', 'bpm', 'beats')
+
     def __init__(self, time, bpm, beats=4.00):
         self.time = time
         self.bpm = bpm
@@ -934,114 +1330,557 @@ class TimingGroup(_Drawable):
             tolerance = 0
         self.arc_groups = group_arcs(self.arcs, tolerance)
 
-    @classmethod
-    def _bsearch_arcnotes(cls, arc_notes, time, left_bound=False):
-        left, right = 0, len(arc_notes)
-        if left_bound:
-            while left < right:
-                mid = (left + right) >> 1
-                if arc_notes[mid][1] < time:
-                    left = mid + 1
-                else:
-                    right = mid
-            return left
-        else:
-            while left < right:
-                mid = (left + right) >> 1
-                if arc_notes[mid][1] <= time:
-                    left = mid + 1
-                else:
-                    right = mid
-            return left - 1
+    def window(self, top, bottom, track_meta : TrackMetaInfo, speed : float):
+        """
+        A timing group with only the objects drawn between rows [top, bottom) of the zoomed chart.
+        The timing group has to be refined.
+        """
+        zoom = track_meta.zoom
+        def _row(time):
+            return _time_to_height(time, speed) * zoom
+        note_height = track_meta.note_to_image().size[1]
+        # Arc notes are at most as high as a note of ratio _tap_pos_to_height_ratio(TAP_VISION_CAP)
+        arc_note_height = track_meta.arc_to_image(_tap_pos_to_height_ratio(TAP_VISION_CAP)).size[1]
+
+        res = self.__class__()
+        res.total_time = self.total_time
+        res.timings = self.timings
+        res.notes = [note for note in self.notes if _row(note.start) < bottom and _row(note.start) + note_height + 1 > top]
+        res.holds = [hold for hold in self.holds if _row(hold.start) < bottom and _row(hold.end) + 1 > top]
+        res.arcs = [arc for arc in self.arcs if _row(arc.start) < bottom and _row(arc.end) + arc_note_height + 1 > top]
+        res.arc_groups = self._window_arc_groups(top, bottom, track_meta, speed)
+        return res
 
-    def draw(self, image : Image.Image, draw : ImageDraw.ImageDraw, track_meta : TrackMetaInfo, speed : float):
+    def _window_arc_groups(self, top, bottom, track_meta : TrackMetaInfo, speed : float):
+        res = []
+        for arc_group in self.arc_groups:
+            group_top, group_bottom = arc_group.bounds(track_meta, speed)
+            if group_top < bottom and group_bottom > top:
+                res.append(arc_group)
+        return res
+
+    def _draw_notes(self, image : Image.Image, draw : ImageDraw.ImageDraw, track_meta : TrackMetaInfo, speed : float, offset=0):
         for hold in self.holds:
-            hold.draw(image, draw, track_meta, speed)
+            hold.draw(image, draw, track_meta, speed, offset)
         for note in self.notes:
-            note.draw(image, draw, track_meta, speed)
+            note.draw(image, draw, track_meta, speed, offset)
+
+    def _arc_notes(self):
+        # (y, time, x) of every arc note
         arc_notes = []
         for arc in self.arcs:
             arc_notes.extend(arc.arc_notes())
-        arc_notes.sort(reverse=True)
-        arc_note_label = [False for i in range(len(arc_notes))]
+        return arc_notes
 
-        for arc in self.arcs:
-            if arc.skyline:
-                # Black lines are not taken into consideration
-                continue
-            start, end = arc.start, arc.end
-            left_index = self._bsearch_arcnotes(arc_notes, start, left_bound=True)
-            right_index = self._bsearch_arcnotes(arc_notes, end, left_bound=False)
-            if left_index >= len(arc_notes) or right_index < 0:
-                continue
-            for index in range(left_index, right_index + 1):
-                y, time, x = arc_notes[index]
-                if arc.end <= arc.start:
-                    if arc.x_end != arc.x_start:
-                        y_arc = arc.y_start + (arc.y_end - arc.y_start) * (x - arc.x_start) / (arc.x_end - arc.x_start)
-                    else:
-                        continue
-                else:
-                    x_arc, y_arc = arc.position(time)
-                if y_arc > y:
-                    arc_note_label[index] = True
+    def _colored_arc_columns(self):
+        return ArcColumns.from_objects([arc for arc in self.arcs if not arc.skyline])
 
-        #shadow_image = Image.new('RGBA', image.size, (0, 0, 0, 0))
-        #shadow_draw = ImageDraw.Draw(shadow_image)
+    def _object_spans(self):
+        # (starts, ends) of notes, holds and arcs in the order of the object lists
+        return (
+            ([note.start for note in self.notes], [note.start for note in self.notes]),
+            ([hold.start for hold in self.holds], [hold.end for hold in self.holds]),
+            ([arc.start for arc in self.arcs], [max(arc.start, arc.end) for arc in self.arcs]),
+        )
 
-        arc_note_image1 = Image.new('RGBA', image.size, (0, 0, 0, 0))
-        arc_note_draw1 = ImageDraw.Draw(arc_note_image1)
+    def _take(self, notes, holds, arcs, arc_groups):
+        # A timing group of the objects at the indices, sharing the timings
+        res = self.__class__()
+        res.total_time = self.total_time
+        res.timings = self.timings
+        res.notes = [self.notes[i] for i in notes]
+        res.holds = [self.holds[i] for i in holds]
+        res.arcs = [self.arcs[i] for i in arcs]
+        res.arc_groups = [self.arc_groups[i] for i in arc_groups]
+        return res
+
+    def draw(self, image : Image.Image, draw : ImageDraw.ImageDraw, track_meta : TrackMetaInfo, speed : float, offset=0, instrument=None):
+        """
+        `instrument` is an optional `instrument.Instrument` receiving a span for every drawing pass.
+        """
+        with _instrument.span(instrument, 'draw.notes', count=len(self.holds) + len(self.notes)):
+            self._draw_notes(image, draw, track_meta, speed, offset)
+
+        with _instrument.span(instrument, 'draw.arc_note_labels') as span:
+            arc_notes = self._arc_notes()
+            arc_notes.sort(reverse=True)
+            # Black lines are not taken into consideration
+            colored_arcs = self._colored_arc_columns()
+            y, times, x = np.array(arc_notes, dtype=np.float64).reshape(-1, 3).T
+            arc_note_label = colored_arcs.covers(y, times, x).tolist()
+            span.set(count=len(arc_notes), arcs=len(colored_arcs))
 
-        for arc_note, is_overlapped in zip(arc_notes, arc_note_label):
-            if is_overlapped:
-                y, time, x = arc_note
-                Arc.draw_arc_note(x, y, time, arc_note_image1, arc_note_draw1, track_meta, speed)
+        #shadow_image = Image.new('RGBA', image.size, (0, 0, 0, 0))
+        #shadow_draw = ImageDraw.Draw(shadow_image)
 
+        # Layers are composited in the order: covered arc notes, black lines, colored arcs and visible arc notes.
+        # Each layer only covers the box of what is drawn on it, and is composited before the next one is made.
+        with _instrument.span(instrument, 'draw.covered_arc_notes') as span:
+            sprites = [
+                Arc.arc_note_sprite(x, y, time, track_meta, speed, offset)
+                for (y, time, x), is_overlapped in zip(arc_notes, arc_note_label) if is_overlapped
+            ]
+            layer_area = self._composite_sprites(image, sprites)
+            span.set(count=len(sprites), area=layer_area, bytes=layer_area * 4)
 
-        line_image = Image.new('RGBA', image.size, (0, 0, 0, 0))
-        line_draw = ImageDraw.Draw(line_image)
-        color_images = {}
-        for arc_group in self.arc_groups:
-            arc_group : ArcGroups
-            color = arc_group.color
-            if color < 0:
-                if track_meta.draw_black_line:
-                    arc_group.draw(line_image, line_draw, track_meta, speed)
-            else:
-                color_image = color_images.get(color, None)
-                if color_image is None:
-                    color_image = Image.new('RGBA', image.size, (255, 255, 255, 0))
-                    color_draw = ImageDraw.Draw(color_image)
-                    color_images[color] = (color_image, color_draw)
-                else:
-                    color_image, color_draw = color_image
-                arc_group.draw(color_image, color_draw, track_meta, speed)
-        new_image = np.array(Image.new('RGBA', image.size, (255, 255, 255, 0)))
-        for color_image, color_draw in color_images.values():
-            np_image = np.array(color_image)
-            color_channels = np_image[:, :, :3]
-            alpha_channel = np_image[:, :, 3]
-            new_image[:, :, :3] = np.min(np.stack([new_image[:, :, :3], color_channels], axis=0), axis=0)
-            new_image[:, :, 3] = np.max(np.stack([new_image[:, :, 3], alpha_channel], axis=0), axis=0)
-        new_image = Image.fromarray(new_image, mode='RGBA')
-
-        arc_note_image2 = Image.new('RGBA', image.size, (0, 0, 0, 0))
-        arc_note_draw2 = ImageDraw.Draw(arc_note_image2)
-
-        for arc_note, is_overlapped in zip(arc_notes, arc_note_label):
-            if not is_overlapped:
-                y, time, x = arc_note
-                Arc.draw_arc_note(x, y, time, arc_note_image2, arc_note_draw2, track_meta, speed)
-
-        image.alpha_composite(arc_note_image1)
         if track_meta.draw_black_line:
-            image.alpha_composite(line_image)
-        image.alpha_composite(new_image)
-        image.alpha_composite(arc_note_image2)
+            with _instrument.span(instrument, 'draw.black_lines') as span:
+                line_groups = [arc_group for arc_group in self.arc_groups if arc_group.color < 0]
+                layer_area = self._composite_arc_groups(image, line_groups, (0, 0, 0, 0), track_meta, speed, offset)
+                span.set(count=len(line_groups), area=layer_area, bytes=layer_area * 4)
+
+        with _instrument.span(instrument, 'draw.colored_arcs') as span:
+            color_groups = {}
+            for arc_group in self.arc_groups:
+                if arc_group.color >= 0:
+                    color_groups.setdefault(arc_group.color, []).append(arc_group)
+            layer_area, merged_area = self._composite_color_groups(image, list(color_groups.values()), track_meta, speed, offset)
+            span.set(count=sum(map(len, color_groups.values())), layers=len(color_groups), area=merged_area, bytes=(layer_area + merged_area) * 4)
+
+        with _instrument.span(instrument, 'draw.visible_arc_notes') as span:
+            sprites = [
+                Arc.arc_note_sprite(x, y, time, track_meta, speed, offset)
+                for (y, time, x), is_overlapped in zip(arc_notes, arc_note_label) if not is_overlapped
+            ]
+            layer_area = self._composite_sprites(image, sprites)
+            span.set(count=len(sprites), area=layer_area, bytes=layer_area * 4)
 
         return image
 
+    @classmethod
+    def _composite_sprites(cls, image : Image.Image, sprites):
+        """
+        Composite (sprite, dest) pairs in order onto a layer covering them, and the layer onto `image`.
+        Returns the area of the layer.
+        """
+        box = _union_box((x, y, x + sprite.size[0], y + sprite.size[1]) for sprite, (x, y) in sprites)
+        box = _clip_box(box, image.size)
+        if box is None:
+            return 0
+        left, top, right, bottom = box
+        layer = Image.new('RGBA', (right - left, bottom - top), (0, 0, 0, 0))
+        for sprite, (x, y) in sprites:
+            _alpha_composite(layer, sprite, (x - left, y - top))
+        image.alpha_composite(layer, (left, top))
+        return layer.size[0] * layer.size[1]
+
+    @classmethod
+    def _arc_groups_in(cls, size, arc_groups, track_meta : TrackMetaInfo, speed : float, offset=0):
+        """
+        Arc groups within an image of `size`, and the box covering them, which is None if there is none.
+        """
+        boxes = [_clip_box(arc_group.box(track_meta, speed, offset), size) for arc_group in arc_groups]
+        arc_groups = [arc_group for arc_group, box in zip(arc_groups, boxes) if box is not None]
+        return arc_groups, _union_box(box for box in boxes if box is not None)
+
+    @classmethod
+    def _draw_arc_groups(cls, arc_groups, box, background, track_meta : TrackMetaInfo, speed : float, offset=0):
+        """
+        Draw arc groups onto a new layer covering `box`.
+        Polygons replace each other on the layer instead of blending.
+        """
+        left, top, right, bottom = box
+        layer = Image.new('RGBA', (right - left, bottom - top), background)
+        layer_draw = ImageDraw.Draw(layer)
+        for arc_group in arc_groups:
+            arc_group.draw(layer, layer_draw, track_meta, speed, offset + top, left=left)
+        return layer
+
+    @classmethod
+    def _composite_arc_groups(cls, image : Image.Image, arc_groups, background, track_meta : TrackMetaInfo, speed : float, offset=0):
+        """
+        Draw arc groups onto one layer and composite it onto `image`.
+        Returns the area of the layer.
+        """
+        arc_groups, box = cls._arc_groups_in(image.size, arc_groups, track_meta, speed, offset)
+        if box is None:
+            return 0
+        layer = cls._draw_arc_groups(arc_groups, box, background, track_meta, speed, offset)
+        image.alpha_composite(layer, box[:2])
+        return layer.size[0] * layer.size[1]
+
+    @classmethod
+    def _composite_color_groups(cls, image : Image.Image, color_groups, track_meta : TrackMetaInfo, speed : float, offset=0):
+        """
+        Draw the arc groups of each color onto its own layer, merge the layers
+        by the minimum of colors and the maximum of alpha, and composite the result onto `image`.
+        Only one color layer exists at a time besides the merged layer.
+        Returns the largest area of a color layer and the area of the merged layer.
+        """
+        color_groups = [cls._arc_groups_in(image.size, arc_groups, track_meta, speed, offset) for arc_groups in color_groups]
+        color_groups = [(arc_groups, box) for arc_groups, box in color_groups if box is not None]
+        box = _union_box(box for _, box in color_groups)
+        if box is None:
+            return 0, 0
+        merged_left, merged_top, merged_right, merged_bottom = box
+        # With inverted alpha, the merge is a minimum over whole pixels.
+        # Pixels out of the box of a layer are (255, 255, 255, 0), which do not change the merged layer.
+        merged = np.full((merged_bottom - merged_top, merged_right - merged_left, 4), 255, dtype=np.uint8)
+        layer_area = 0
+        for arc_groups, (left, top, right, bottom) in color_groups:
+            region = np.array(cls._draw_arc_groups(arc_groups, (left, top, right, bottom), (255, 255, 255, 0), track_meta, speed, offset))
+            np.subtract(255, region[:, :, 3], out=region[:, :, 3])
+            merged_region = merged[top - merged_top:bottom - merged_top, left - merged_left:right - merged_left]
+            np.minimum(merged_region, region, out=merged_region)
+            layer_area = max(layer_area, region.shape[0] * region.shape[1])
+        np.subtract(255, merged[:, :, 3], out=merged[:, :, 3])
+        image.alpha_composite(Image.fromarray(merged, mode='RGBA'), (merged_left, merged_top))
+        return layer_area, merged.shape[0] * merged.shape[1]
+
+class _Columns:
+    """
+    Struct-of-arrays of one kind of chart objects, in the order of the object list.
+    FIELDS are (name, dtype) in the order of the arguments of OBJECT.
+    """
+    FIELDS = ()
+    OBJECT = None
+
+    def __init__(self, **columns):
+        for name, dtype in self.FIELDS:
+            setattr(self, name, np.asarray(columns.get(name, ()), dtype=dtype))
+
+    def __len__(self):
+        return len(getattr(self, self.FIELDS[0][0]))
+
+    def take(self, indices):
+        return self.__class__(**{name: getattr(self, name)[indices] for name, _ in self.FIELDS})
+
+    @classmethod
+    def concatenate(cls, columns_list):
+        return cls(**{name: np.concatenate([getattr(columns, name) for columns in columns_list]) for name, _ in cls.FIELDS})
+
+    @classmethod
+    def from_objects(cls, objects):
+        return cls(**{name: [getattr(obj, name) for obj in objects] for name, _ in cls.FIELDS})
+
+    def to_objects(self):
+        return [self.OBJECT(*values) for values in zip(*(getattr(self, name).tolist() for name, _ in self.FIELDS))]
+
+class NoteColumns(_Columns):
+    FIELDS = (('start', np.int64), ('lane', np.int64))
+    OBJECT = GroundNote
+
+class HoldColumns(_Columns):
+    FIELDS = (('start', np.int64), ('end', np.int64), ('lane', np.int64))
+    OBJECT = Hold
+
+class TimingColumns(_Columns):
+    FIELDS = (('time', np.int64), ('bpm', np.float64), ('beats', np.float64))
+    OBJECT = Timing
+
+class ArcColumns(_Columns):
+    """
+    `easing` is the easing code, taps of arc i are `tap_values[tap_offsets[i]:tap_offsets[i + 1]]`.
+    """
+    FIELDS = (
+        ('start', np.int64), ('end', np.int64), ('x_start', np.float64), ('x_end', np.float64), ('easing', np.uint8),
+        ('y_start', np.float64), ('y_end', np.float64), ('color', np.int64), ('hitsound', object), ('skyline', np.bool_),
+    )
+    OBJECT = Arc
+
+    def __init__(self, tap_offsets=None, tap_values=None, **columns):
+        super().__init__(**columns)
+        if tap_offsets is None:
+            tap_offsets = np.zeros(len(self) + 1, dtype=np.int64)
+        self.tap_offsets = np.asarray(tap_offsets, dtype=np.int64)
+        self.tap_values = np.asarray(() if tap_values is None else tap_values, dtype=np.int64)
+
+    @property
+    def tap_counts(self):
+        return np.diff(self.tap_offsets)
+
+    def take(self, indices):
+        indices = np.arange(len(self))[indices]
+        counts = self.tap_counts[indices]
+        tap_offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(counts, out=tap_offsets[1:])
+        positions = np.repeat(self.tap_offsets[:-1][indices] - tap_offsets[:-1], counts) + np.arange(tap_offsets[-1])
+        return self.__class__(
+            tap_offsets=tap_offsets, tap_values=self.tap_values[positions],
+            **{name: getattr(self, name)[indices] for name, _ in self.FIELDS},
+        )
+
+    @classmethod
+    def concatenate(cls, columns_list):
+        tap_offsets = [np.zeros(1, dtype=np.int64)]
+        tap_count = 0
+        for columns in columns_list:
+            tap_offsets.append(columns.tap_offsets[1:] + tap_count)
+            tap_count += len(columns.tap_values)
+        return cls(
+            tap_offsets=np.concatenate(tap_offsets), tap_values=np.concatenate([columns.tap_values for columns in columns_list]),
+            **{name: np.concatenate([getattr(columns, name) for columns in columns_list]) for name, _ in cls.FIELDS},
+        )
+
+    @classmethod
+    def from_objects(cls, objects):
+        columns = {name: [getattr(arc, name) for arc in objects] for name, _ in cls.FIELDS}
+        columns['easing'] = [arc.easing.code for arc in objects]
+        tap_offsets = np.zeros(len(objects) + 1, dtype=np.int64)
+        np.cumsum([len(arc.taps) for arc in objects], out=tap_offsets[1:])
+        return cls(tap_offsets=tap_offsets, tap_values=[tap for arc in objects for tap in arc.taps], **columns)
+
+    def to_objects(self):
+        columns = [getattr(self, name).tolist() for name, _ in self.FIELDS]
+        columns[4] = map(Easing.name_from_code, columns[4])
+        tap_values, tap_offsets = self.tap_values.tolist(), self.tap_offsets.tolist()
+        return [
+            Arc(*values, taps=tap_values[tap_start:tap_end])
+            for values, tap_start, tap_end in zip(zip(*columns), tap_offsets, tap_offsets[1:])
+        ]
+
+    def arc_notes(self):
+        """
+        Returns (y, time, x) arrays of every arc note.
+        """
+        counts = self.tap_counts
+        index = np.repeat(np.arange(len(self)), counts)
+        times = self.tap_values
+        start, end, easing = self.start[index], self.end[index], self.easing[index]
+        time_ratio = (times - start) / (end - start)
+        x = Easing.positions_by_codes(easing & 3, self.x_start[index], self.x_end[index], time_ratio)
+        y = Easing.positions_by_codes(easing >> 2, self.y_start[index], self.y_end[index], time_ratio)
+        return y, times, x
+
+    # Candidate pairs of arcs and arc notes evaluated at once in ArcColumns.covers
+    COVER_CHUNK_SIZE = 1 << 20
+
+    def covers(self, y, times, x):
+        """
+        Whether each arc note at (y, times, x) is under one of the arcs, that is
+        the height of an arc at the time of the arc note is greater than the height of the arc note.
+        An arc of no duration is interpolated by the x position of the arc note instead.
+
+        Arcs find the arc notes in their time spans by a binary search over the arc notes sorted by time,
+        and heights are compared for all the candidates in chunks, skipping arc notes already covered.
+        """
+        res = np.zeros(len(times), dtype=np.bool_)
+        if len(times) == 0 or len(self) == 0:
+            return res
+        order = np.argsort(times, kind='stable')
+        sorted_times = times[order]
+        lows = np.searchsorted(sorted_times, self.start, side='left')
+        counts = np.maximum(np.searchsorted(sorted_times, self.end, side='right') - lows, 0)
+        # Arcs of no duration with no x span are never compared
+        counts[(self.end <= self.start) & (self.x_end == self.x_start)] = 0
+        arcs = np.flatnonzero(counts)
+        # Pairs of arcs[i] are pairs [pair_ends[i] - counts[arcs[i]], pair_ends[i]) of all
+        pair_ends = np.cumsum(counts[arcs])
+        chunk_start = 0
+        while chunk_start < len(arcs):
+            pair_start = pair_ends[chunk_start] - counts[arcs[chunk_start]]
+            chunk_end = max(np.searchsorted(pair_ends, pair_start + self.COVER_CHUNK_SIZE, side='right'), chunk_start + 1)
+            chunk = arcs[chunk_start:chunk_end]
+            chunk_start = chunk_end
+
+            chunk_counts = counts[chunk]
+            pair_arcs = np.repeat(chunk, chunk_counts)
+            pair_offsets = np.arange(len(pair_arcs)) - np.repeat(np.cumsum(chunk_counts) - chunk_counts, chunk_counts)
+            pair_notes = order[lows[pair_arcs] + pair_offsets]
+            uncovered = ~res[pair_notes]
+            pair_arcs, pair_notes = pair_arcs[uncovered], pair_notes[uncovered]
+
+            start, end = self.start[pair_arcs], self.end[pair_arcs]
+            y_start, y_end = self.y_start[pair_arcs], self.y_end[pair_arcs]
+            instant = end <= start
+            y_arc = np.empty(len(pair_arcs))
+            if instant.any():
+                x_start, x_end = self.x_start[pair_arcs[instant]], self.x_end[pair_arcs[instant]]
+                y_arc[instant] = y_start[instant] + (y_end[instant] - y_start[instant]) * (x[pair_notes[instant]] - x_start) / (x_end - x_start)
+            timed = ~instant
+            if timed.any():
+                time_ratio = (times[pair_notes[timed]] - start[timed]) / (end[timed] - start[timed])
+                y_arc[timed] = Easing.positions_by_codes(self.easing[pair_arcs[timed]] >> 2, y_start[timed], y_end[timed], time_ratio)
+            res[pair_notes[y_arc > y[pair_notes]]] = True
+        return res
+
+def _column_view(name):
+    # An object list built from the columns on first access
+    columns_name = f'{name[:-1]}_columns'
+
+    def getter(self):
+        res = self._views.get(name, None)
+        if res is None:
+            res = self._views[name] = getattr(self, columns_name).to_objects()
+        return res
+
+    def setter(self, objects):
+        setattr(self, columns_name, type(getattr(self, columns_name)).from_objects(objects))
+        self._views[name] = objects
+
+    return property(getter, setter)
+
+class ColumnarTimingGroup(TimingGroup):
+    """
+    A timing group storing notes, holds, arcs and timings as columns of NumPy arrays.
+    Refining, merging, windowing, `max_extra_width` and drawing notes run over the columns.
+
+    `notes`, `holds`, `arcs` and `timings` are object lists built on first access for compatibility.
+    Assigning a list replaces the columns, but changes to an object list are not reflected in the columns.
+    `arc_groups` of a refined timing group are grouped on first access as well.
+    """
+    notes = _column_view('notes')
+    holds = _column_view('holds')
+    arcs = _column_view('arcs')
+    timings = _column_view('timings')
+
+    def __init__(self, note_columns=None, hold_columns=None, arc_columns=None, timing_columns=None):
+        self._views = {}
+        self.note_columns = NoteColumns() if note_columns is None else note_columns
+        self.hold_columns = HoldColumns() if hold_columns is None else hold_columns
+        self.arc_columns = ArcColumns() if arc_columns is None else arc_columns
+        self.timing_columns = TimingColumns() if timing_columns is None else timing_columns
+        self._arc_groups = []
+        self._arc_tolerance = 0
+        self.total_time = 0
+
+    @property
+    def arc_groups(self):
+        if self._arc_groups is None:
+            self._arc_groups = group_arcs(self.arcs, self._arc_tolerance)
+        return self._arc_groups
+
+    @arc_groups.setter
+    def arc_groups(self, value):
+        self._arc_groups = value
+
+    @classmethod
+    def from_timing_group(cls, timing_group : TimingGroup):
+        if isinstance(timing_group, cls):
+            return timing_group.clone()
+        res = cls(
+            NoteColumns.from_objects(timing_group.notes),
+            HoldColumns.from_objects(timing_group.holds),
+            ArcColumns.from_objects(timing_group.arcs),
+            TimingColumns.from_objects(timing_group.timings),
+        )
+        res.arc_groups = timing_group.arc_groups
+        res.total_time = timing_group.total_time
+        return res
+
+    def clone(self):
+        res = self.__class__(self.note_columns, self.hold_columns, self.arc_columns, self.timing_columns)
+        res._views = dict(self._views)
+        res._arc_groups = self._arc_groups
+        res._arc_tolerance = self._arc_tolerance
+        res.total_time = self.total_time
+        return res
+
+    def max_extra_width(self, ignore_black=False):
+        arcs = self.arc_columns
+        if not len(arcs):
+            return 0
+        base_width = np.where(arcs.skyline, ArcGroups.BASE_LINE_WIDTH, ArcGroups.BASE_ARC_WIDTH)
+
+        def extra_width(x, y, width):
+            real_x = _pos_to_x(x)
+            return np.maximum(0 - np.round(real_x - width / 2), np.round(real_x + width / 2) - 1500)
+
+        res = np.maximum(
+            extra_width(arcs.x_start, arcs.y_start, _arc_pos_to_height_ratios(arcs.y_start) * base_width),
+            extra_width(arcs.x_end, arcs.y_end, _arc_pos_to_height_ratios(arcs.y_end) * base_width),
+        )
+        if ignore_black:
+            res[arcs.skyline] = 0
+        res = max(0, res.max())
+        if len(arcs.tap_values):
+            y, _, x = arcs.arc_notes()
+            res = max(res, extra_width(x, y, 238 * _tap_pos_to_height_ratios(y)).max())
+        return int(res)
+
+    def merge(self, other : TimingGroup):
+        if not isinstance(other, ColumnarTimingGroup):
+            other = ColumnarTimingGroup.from_timing_group(other)
+        self.note_columns = NoteColumns.concatenate((self.note_columns, other.note_columns))
+        self.hold_columns = HoldColumns.concatenate((self.hold_columns, other.hold_columns))
+        self.arc_columns = ArcColumns.concatenate((self.arc_columns, other.arc_columns))
+        self.timing_columns = TimingColumns.concatenate((self.timing_columns, other.timing_columns))
+        self._views = {}
+        if self._arc_groups is None or other._arc_groups is None:
+            self._arc_groups = None
+        else:
+            self._arc_groups = self._arc_groups + other._arc_groups
+        self.total_time = max(self.total_time, other.total_time)
+        return self
+
+    def refine(self, track_meta : TrackMetaInfo=None):
+        # Stable sorts give the same order as sorting the object lists
+        notes, holds, arcs, timings = self.note_columns, self.hold_columns, self.arc_columns, self.timing_columns
+        self.note_columns = notes.take(np.argsort(notes.start, kind='stable'))
+        self.hold_columns = holds.take(np.argsort(holds.start, kind='stable'))
+        self.arc_columns = arcs.take(np.lexsort((arcs.end, arcs.start)))
+        self.timing_columns = timings.take(np.argsort(timings.time, kind='stable'))
+        self._views = {}
+
+        self.total_time = 0
+        for column in (notes.start, holds.end, arcs.end, timings.time):
+            if len(column):
+                self.total_time = max(self.total_time, int(column.max()))
+
+        if track_meta is not None:
+            self._arc_tolerance = track_meta.group_tolerance
+        else:
+            self._arc_tolerance = 0
+        self._arc_groups = None
+
+    def window(self, top, bottom, track_meta : TrackMetaInfo, speed : float):
+        zoom = track_meta.zoom
+        def _row(time):
+            return _time_to_height(time, speed) * zoom
+        note_height = track_meta.note_to_image().size[1]
+        arc_note_height = track_meta.arc_to_image(_tap_pos_to_height_ratio(TAP_VISION_CAP)).size[1]
+        notes, holds, arcs = self.note_columns, self.hold_columns, self.arc_columns
+
+        res = self.__class__(
+            notes.take((_row(notes.start) < bottom) & (_row(notes.start) + note_height + 1 > top)),
+            holds.take((_row(holds.start) < bottom) & (_row(holds.end) + 1 > top)),
+            arcs.take((_row(arcs.start) < bottom) & (_row(arcs.end) + arc_note_height + 1 > top)),
+            self.timing_columns,
+        )
+        res.total_time = self.total_time
+        res.arc_groups = self._window_arc_groups(top, bottom, track_meta, speed)
+        return res
+
+    def _draw_notes(self, image : Image.Image, draw : ImageDraw.ImageDraw, track_meta : TrackMetaInfo, speed : float, offset=0):
+        zoom = track_meta.zoom
+        def _dest_x(lanes):
+            dest_x = 36 + track_meta.track_line_width / 2 + 238 * lanes
+            return np.round(dest_x * zoom + track_meta.extra_width * zoom).astype(np.int64).tolist()
+        def _dest_y(times):
+            return (np.round(_time_to_height(times, speed) * zoom).astype(np.int64) - offset).tolist()
+
+        holds = self.hold_columns
+        hold_heights = np.round(_time_to_height(holds.end - holds.start, speed)).astype(np.int64).tolist()
+        for height, dest_x, dest_y in zip(hold_heights, _dest_x(holds.lane), _dest_y(holds.start)):
+            _alpha_composite(image, track_meta.hold_to_image(height), (dest_x, dest_y))
+
+        notes = self.note_columns
+        note_image = track_meta.note_to_image()
+        for dest_x, dest_y in zip(_dest_x(notes.lane), _dest_y(notes.start)):
+            _alpha_composite(image, note_image, (dest_x, dest_y))
+
+    def _arc_notes(self):
+        y, times, x = self.arc_columns.arc_notes()
+        return list(zip(y.tolist(), times.tolist(), x.tolist()))
+
+    def _colored_arc_columns(self):
+        return self.arc_columns.take(~self.arc_columns.skyline)
+
+    def _object_spans(self):
+        notes, holds, arcs = self.note_columns, self.hold_columns, self.arc_columns
+        return (notes.start, notes.start), (holds.start, holds.end), (arcs.start, np.maximum(arcs.start, arcs.end))
+
+    def _take(self, notes, holds, arcs, arc_groups):
+        res = self.__class__(
+            self.note_columns.take(notes), self.hold_columns.take(holds), self.arc_columns.take(arcs), self.timing_columns,
+        )
+        res.total_time = self.total_time
+        res.arc_groups = [self.arc_groups[i] for i in arc_groups]
+        return res
+
 class EnwidenLanes:
+    __slots__ = ('time', 'duration', 'on')
+
     def __init__(self, time, duration, on=True):
         self.time = time
         self.duration = duration
@@ -1089,6 +1928,105 @@ def _float_s(value : float, decimal : int = 0):
         tolerance *= 10
     return (f'{"-" if negative else ""}%.0{real_dec}f') % value
 
+class _IntervalIndex:
+    """
+    Intervals [start, end] sorted by start with the running maximum of their ends,
+    so that the intervals intersecting a range are found by two binary searches
+    and a scan of the intervals between them.
+    """
+    def __init__(self, starts, ends):
+        starts = np.asarray(starts, dtype=np.float64)
+        ends = np.asarray(ends, dtype=np.float64)
+        self.order = np.argsort(starts, kind='stable')
+        self.starts = starts[self.order]
+        self.ends = ends[self.order]
+        self.max_ends = np.maximum.accumulate(self.ends) if len(self.ends) else self.ends
+
+    def __len__(self):
+        return len(self.order)
+
+    def query(self, start, end):
+        """
+        Indices of the intervals intersecting [start, end], in ascending order.
+        """
+        low = np.searchsorted(self.max_ends, start, side='left')
+        high = np.searchsorted(self.starts, end, side='right')
+        if low >= high:
+            return np.empty(0, dtype=np.int64)
+        # Intervals before a long one may end before `start`
+        found = self.ends[low:high] >= start
+        return np.sort(self.order[low:high][found])
+
+class TimeIndex:
+    """
+    A sorted time index over the merged timing group of a chart, its enwiden spans and its bar lines,
+    built once by `Chart.time_index` so that a window of the chart only visits the objects intersecting it.
+
+    Notes, holds, arcs (with their arc notes) and arc groups are indexed by their time spans.
+    Windows look them up with a margin of the largest sprite and filter them exactly by `TimingGroup.window`,
+    so the objects of a window are the same as those of `TimingGroup.window` over the whole timing group.
+    """
+    def __init__(self, chart, track_meta : TrackMetaInfo):
+        speed = track_meta.speed
+        self.speed = speed
+        self.timing_group = chart._merged_timing_group(track_meta)
+        ArcGroups.prepare_outlines(self.timing_group.arc_groups, speed)
+
+        notes, holds, arcs = self.timing_group._object_spans()
+        self.notes = _IntervalIndex(*notes)
+        self.holds = _IntervalIndex(*holds)
+        self.arcs = _IntervalIndex(*arcs)
+        group_heights = [arc_group.outline(speed)[:, 1] for arc_group in self.timing_group.arc_groups]
+        self.arc_groups = _IntervalIndex(
+            [_height_to_time(heights.min(), speed) for heights in group_heights],
+            [_height_to_time(heights.max(), speed) for heights in group_heights],
+        )
+
+        self.enwiden_spans, enwiden_times = chart._enwiden_spans()
+        self.enwiden_index = _IntervalIndex([span[0] for span in self.enwiden_spans], [span[1] for span in self.enwiden_spans])
+        # Bar lines and their texts are sorted by height
+        self.bar_lines, self.bar_texts = chart._bar_lines(speed, track_meta, enwiden_times)
+        self.bar_line_heights = np.array([y for _, _, y in self.bar_lines], dtype=np.float64)
+        self.bar_text_heights = np.array([text_y for _, _, _, text_y in self.bar_texts], dtype=np.float64)
+
+    def _time(self, row, zoom):
+        return _height_to_time(row / zoom, self.speed)
+
+    def window(self, top, bottom, track_meta : TrackMetaInfo):
+        """
+        `TimingGroup.window` of the merged timing group, visiting only the objects around rows [top, bottom).
+        """
+        zoom = track_meta.zoom
+        note_height = track_meta.note_to_image().size[1]
+        arc_note_height = track_meta.arc_to_image(_tap_pos_to_height_ratio(TAP_VISION_CAP)).size[1]
+        start = self._time(top - max(note_height, arc_note_height) - 2, zoom)
+        end = self._time(bottom + 1, zoom)
+        candidates = self.timing_group._take(
+            self.notes.query(start, end).tolist(),
+            self.holds.query(start, end).tolist(),
+            self.arcs.query(start, end).tolist(),
+            self.arc_groups.query(self._time(top - 2, zoom), end).tolist(),
+        )
+        return candidates.window(top, bottom, track_meta, self.speed)
+
+    def texts(self, start, height):
+        """
+        Bar texts from `start` within `height`, both before zooming.
+        """
+        low, high = np.searchsorted(self.bar_text_heights, (start, start + height))
+        return self.bar_texts[low:high]
+
+    def background_layout(self, top, bottom, track_meta : TrackMetaInfo):
+        """
+        Enwiden spans, bar lines and bar texts around rows [top, bottom), as used by `Chart.background`.
+        """
+        zoom = track_meta.zoom
+        enwiden_spans = [self.enwiden_spans[i] for i in self.enwiden_index.query(self._time(top - 1, zoom), self._time(bottom + 1, zoom))]
+        margin = track_meta.bar_line_width + 1
+        low, high = np.searchsorted(self.bar_line_heights, (top / zoom - margin, bottom / zoom + margin))
+        text_low, text_high = np.searchsorted(self.bar_text_heights, (top / zoom - 1, bottom / zoom + 1))
+        return enwiden_spans, self.bar_lines[low:high], self.bar_texts[text_low:text_high]
+
 class Chart:
     def __init__(self, meta=None):
         self.enwidenlaneses = []
@@ -1098,6 +2036,8 @@ class Chart:
         if meta is None:
             meta = {}
         self.meta = meta
+        # (key, TimeIndex) built by Chart.time_index
+        self._time_index = None
 
     def max_extra_width(self, ignore_black=False):
         res = 0
@@ -1113,18 +2053,22 @@ class Chart:
             self.total_time = max(self.total_time, timing_group.total_time)
         self.total_draw_time = self.total_time
 
-    def background(self, speed, track_meta : TrackMetaInfo):
+    def total_height(self, speed, track_meta : TrackMetaInfo):
         """
-        speed: pixel height per second
-
-        The slope of track line is 1.25.
-        The size of track image is 1024 x 256.
-        The size of inner tracks is 952. (238 per track)
-        The width of border is 36.
-        The size of extra lane image is 1 x 1000.
-        Thus, the total width has to be 238 * 6 + 36 * 2 = 1500.
+        The height of the chart before zooming, which is a multiple of `height_limit`.
         """
+        height_limit = track_meta.height_limit
+        # +64 to prevent ignoring notes at the end of the chart
+        total_height = _time_to_height(self.total_draw_time, speed) + 64
+        return math.ceil(total_height / height_limit) * height_limit
 
+    def page_count(self, track_meta : TrackMetaInfo):
+        total_height = round(self.total_height(track_meta.speed, track_meta) * track_meta.zoom)
+        height_limit = round(track_meta.height_limit * track_meta.zoom)
+        # Apply `round` instead of `ceil` to prevent float precision problem
+        return round(total_height / height_limit)
+
+    def _enwiden_spans(self):
         enwiden_spans = []
         enwiden_times = [0]
         prev_enwiden = None
@@ -1147,42 +2091,12 @@ class Chart:
             enwiden_spans.append((prev_enwiden, self.total_draw_time))
             enwiden_times.append(prev_enwiden)
         enwiden_times.append(self.total_draw_time)
+        return enwiden_spans, enwiden_times
 
-        height_limit = track_meta.height_limit
-        # +64 to prevent ignoring notes at the end of the chart
-        total_height = _time_to_height(self.total_draw_time, speed) + 64
-        total_height = math.ceil(total_height / height_limit) * height_limit
-
-        track_base_image = track_meta.track_to_image(height=total_height)
-        track_enwiden_image = track_meta.enwiden_to_image(height=total_height)
-
-        bg_image = Image.new('RGBA', _zoomed((1500 + track_meta.extra_width * 2, total_height), track_meta.zoom), track_meta.extra_color)
-        bg_image.alpha_composite(track_base_image, _zoomed((238 + track_meta.extra_width, 0), track_meta.zoom))
-        bg_image.alpha_composite(track_enwiden_image, _zoomed((0 + track_meta.extra_width, 0), track_meta.zoom))
-        bg_image.alpha_composite(track_enwiden_image, _zoomed((1262 + track_meta.extra_width, 0), track_meta.zoom))
-
-        bg_draw = ImageDraw.Draw(bg_image)
-        bg_draw.line((_zoomed((512 + track_meta.extra_width, 0), track_meta.zoom), _zoomed((512 + track_meta.extra_width, total_height), track_meta.zoom)), track_meta.track_line_color, round(track_meta.track_line_width * track_meta.zoom))
-        bg_draw.line((_zoomed((750 + track_meta.extra_width, 0), track_meta.zoom), _zoomed((750 + track_meta.extra_width, total_height), track_meta.zoom)), track_meta.track_line_color, round(track_meta.track_line_width * track_meta.zoom))
-        bg_draw.line((_zoomed((988 + track_meta.extra_width, 0), track_meta.zoom), _zoomed((988 + track_meta.extra_width, total_height), track_meta.zoom)), track_meta.track_line_color, round(track_meta.track_line_width * track_meta.zoom))
-
-        for enwiden_span in enwiden_spans:
-            start, end = _time_to_height(enwiden_span[0], speed), _time_to_height(enwiden_span[1], speed)
-            paste_extra = Image.new('RGBA', _zoomed((274, end - start), track_meta.zoom), track_meta.extra_color)
-            lane = track_enwiden_image.crop(_zoomed((0, start, 238, end), track_meta.zoom))
-            # draw left lane
-            left_border = track_base_image.crop(_zoomed((0, start, 36, end), track_meta.zoom))
-            bg_image.paste(paste_extra, _zoomed((0 + track_meta.extra_width, start), track_meta.zoom))
-            bg_image.alpha_composite(left_border, _zoomed((0 + track_meta.extra_width, start), track_meta.zoom))
-            bg_image.alpha_composite(lane, _zoomed((36 + track_meta.extra_width, start), track_meta.zoom))
-            # draw right lane
-            right_border = track_base_image.crop(_zoomed((988, start, 1024, end), track_meta.zoom))
-            bg_image.paste(paste_extra, _zoomed((1226 + track_meta.extra_width, start), track_meta.zoom))
-            bg_image.alpha_composite(right_border, _zoomed((1464 + track_meta.extra_width, start), track_meta.zoom))
-            bg_image.alpha_composite(lane, _zoomed((1226 + track_meta.extra_width, start), track_meta.zoom))
-            bg_draw.line((_zoomed((274 + track_meta.extra_width, start), track_meta.zoom), _zoomed((274 + track_meta.extra_width, end), track_meta.zoom)), track_meta.track_line_color, round(track_meta.track_line_width * track_meta.zoom))
-            bg_draw.line((_zoomed((1226 + track_meta.extra_width, start), track_meta.zoom), _zoomed((1226 + track_meta.extra_width, end), track_meta.zoom)), track_meta.track_line_color, round(track_meta.track_line_width * track_meta.zoom))
-
+    def _bar_lines(self, speed, track_meta : TrackMetaInfo, enwiden_times):
+        """
+        Returns bar lines as (x_start, x_end, y) and their texts as (bar_index, text, text_x, text_y).
+        """
         bars = []
         main_timing_group : TimingGroup = self.timing_groups[0]
         for index, timing in enumerate(main_timing_group.timings):
@@ -1200,6 +2114,7 @@ class Chart:
 
         bar_index = 0
         bar_total = len(bars)
+        lines = []
         text_info = []
         for index in range(len(enwiden_times) - 1):
             start_time, end_time, is_enwiden = enwiden_times[index], enwiden_times[index + 1], index & 1
@@ -1213,7 +2128,7 @@ class Chart:
                     else:
                         x_start, x_end = 274, 1226
                     y = round(_time_to_height(bar_time, speed))
-                    bg_draw.line((_zoomed((x_start + track_meta.extra_width, y), track_meta.zoom), _zoomed((x_end + track_meta.extra_width, y), track_meta.zoom)), track_meta.bar_line_color, round(track_meta.bar_line_width * track_meta.zoom))
+                    lines.append((x_start, x_end, y))
 
                     if is_enwiden:
                         text_x = x_start + track_meta.extra_width + track_meta.font_size / 2
@@ -1228,53 +2143,224 @@ class Chart:
                     bar_index += 1
                 else:
                     break
+        return lines, text_info
+
+    def background(self, speed, track_meta : TrackMetaInfo, window=None, index=None):
+        """
+        speed: pixel height per second
+        window: rows (start, end) of the zoomed background to draw, None for all rows
+        index: a `TimeIndex` of the chart to look up enwiden spans and bar lines in the window, None to visit all of them
+
+        The slope of track line is 1.25.
+        The size of track image is 1024 x 256.
+        The size of inner tracks is 952. (238 per track)
+        The width of border is 36.
+        The size of extra lane image is 1 x 1000.
+        Thus, the total width has to be 238 * 6 + 36 * 2 = 1500.
+        """
+        zoom = track_meta.zoom
+        extra_width = track_meta.extra_width
+        total_height = self.total_height(speed, track_meta)
+
+        if window is None:
+            offset = 0
+            image_height = round(total_height * zoom)
+        else:
+            offset = window[0]
+            image_height = window[1] - window[0]
+
+        if index is None:
+            enwiden_spans, enwiden_times = self._enwiden_spans()
+            lines, text_info = self._bar_lines(speed, track_meta, enwiden_times)
+        else:
+            enwiden_spans, lines, text_info = index.background_layout(offset, offset + image_height, track_meta)
+
+        def _pos(x, y):
+            x, y = _zoomed((x, y), zoom)
+            return x, y - offset
+
+        def _box(x0, y0, x1, y1):
+            return (*_pos(x0, y0), *_pos(x1, y1))
+
+        track_base_image = track_meta.track_to_image(height=total_height, window=window)
+        track_enwiden_image = track_meta.enwiden_to_image(height=total_height, window=window)
+
+        bg_image = Image.new('RGBA', (round((1500 + extra_width * 2) * zoom), image_height), track_meta.extra_color)
+        bg_image.alpha_composite(track_base_image, _zoomed((238 + extra_width, 0), zoom))
+        bg_image.alpha_composite(track_enwiden_image, _zoomed((0 + extra_width, 0), zoom))
+        bg_image.alpha_composite(track_enwiden_image, _zoomed((1262 + extra_width, 0), zoom))
+
+        track_line_width = round(track_meta.track_line_width * zoom)
+        bg_draw = ImageDraw.Draw(bg_image)
+        bg_draw.line((_pos(512 + extra_width, 0), _pos(512 + extra_width, total_height)), track_meta.track_line_color, track_line_width)
+        bg_draw.line((_pos(750 + extra_width, 0), _pos(750 + extra_width, total_height)), track_meta.track_line_color, track_line_width)
+        bg_draw.line((_pos(988 + extra_width, 0), _pos(988 + extra_width, total_height)), track_meta.track_line_color, track_line_width)
+
+        for enwiden_span in enwiden_spans:
+            start, end = _time_to_height(enwiden_span[0], speed), _time_to_height(enwiden_span[1], speed)
+            if round(end * zoom) < offset or round(start * zoom) >= offset + image_height:
+                continue
+            paste_extra = Image.new('RGBA', _zoomed((274, end - start), zoom), track_meta.extra_color)
+            lane = track_enwiden_image.crop(_box(0, start, 238, end))
+            # draw left lane
+            left_border = track_base_image.crop(_box(0, start, 36, end))
+            bg_image.paste(paste_extra, _pos(0 + extra_width, start))
+            _alpha_composite(bg_image, left_border, _pos(0 + extra_width, start))
+            _alpha_composite(bg_image, lane, _pos(36 + extra_width, start))
+            # draw right lane
+            right_border = track_base_image.crop(_box(988, start, 1024, end))
+            bg_image.paste(paste_extra, _pos(1226 + extra_width, start))
+            _alpha_composite(bg_image, right_border, _pos(1464 + extra_width, start))
+            _alpha_composite(bg_image, lane, _pos(1226 + extra_width, start))
+            bg_draw.line((_pos(274 + extra_width, start), _pos(274 + extra_width, end)), track_meta.track_line_color, track_line_width)
+            bg_draw.line((_pos(1226 + extra_width, start), _pos(1226 + extra_width, end)), track_meta.track_line_color, track_line_width)
+
+        bar_line_width = round(track_meta.bar_line_width * zoom)
+        for x_start, x_end, y in lines:
+            bg_draw.line((_pos(x_start + extra_width, y), _pos(x_end + extra_width, y)), track_meta.bar_line_color, bar_line_width)
 
         return bg_image, text_info
 
-    def image(self, track_meta : TrackMetaInfo):
-        self.refine()
-        speed = track_meta.speed
-        image, text_info = self.background(speed, track_meta)
+    def _draw_texts(self, image : Image.Image, text_info, track_meta : TrackMetaInfo, start, height):
+        """
+        Draw bar texts on a flipped window of `height` from `start`, both before zooming.
+        A page is the window of `height_limit` from `page * height_limit`.
+        """
         draw = ImageDraw.Draw(image)
-        merged_timing_group = TimingGroup()
-        for tg in self.timing_groups:
-            merged_timing_group.merge(tg)
-        merged_timing_group.refine(track_meta)
-        merged_timing_group.draw(image, draw, track_meta, speed)
-
-        height_limit = round(track_meta.height_limit * track_meta.zoom)
-        w, h = image.size
-        # Apply `round` instead of `ceil` to prevent float precision problem
-        crops = round(h / height_limit)
-        new_w = w * crops
-        new_image = Image.new('RGBA', (new_w, height_limit), (0, 0, 0, 0))
-        for index in range(crops):
-            y_start = index * height_limit
-            y_end = min(h, (index + 1) * height_limit)
-            new_x_start = index * w
-            new_image.paste(image.crop((0, y_start, w, y_end)), (new_x_start, 0))
-        new_image = new_image.transpose(Image.FLIP_TOP_BOTTOM)
-
-        draw = ImageDraw.Draw(new_image)
         font = track_meta.font
         prev_text_y = None
-        prev_page = -1
-        height_limit = track_meta.height_limit
-        w = 1500 + track_meta.extra_width * 2
         for text_index, text, text_x, text_y in text_info:
-            page = text_y // height_limit
-            if prev_page < page:
-                prev_text_y = None
-                prev_page = page
-            rest_y = text_y % height_limit + track_meta.font_size
-            if height_limit - rest_y < track_meta.font_size:
+            if not start <= text_y < start + height:
+                continue
+            rest_y = text_y - start + track_meta.font_size
+            if height - rest_y < track_meta.font_size:
                 rest_y = rest_y - track_meta.font_size
             if prev_text_y is not None and rest_y - prev_text_y < track_meta.font_size:
                 continue
             prev_text_y = rest_y
-            real_y = height_limit - rest_y + track_meta.font_size / 2
-            real_x = w * page + text_x
-            real_pos = _zoomed((real_x, real_y), track_meta.zoom)
+            real_y = height - rest_y + track_meta.font_size / 2
+            real_pos = _zoomed((text_x, real_y), track_meta.zoom)
             draw.text(real_pos, text, fill=track_meta.font_color, font=font, anchor='lm')
+        return image
 
+    def time_index(self, track_meta : TrackMetaInfo):
+        """
+        The `TimeIndex` of the chart for the speed, the arc group tolerance and the bar texts of `track_meta`.
+        It is built on first use and kept with the chart, so changes to the chart after that are not reflected.
+        """
+        key = (track_meta.speed, track_meta.group_tolerance, track_meta.extra_width, track_meta.font_size)
+        cached = self._time_index
+        if cached is None or cached[0] != key:
+            cached = self._time_index = (key, TimeIndex(self, track_meta))
+        return cached[1]
+
+    def render_window(self, start_ms, end_ms, track_meta : TrackMetaInfo, instrument=None):
+        """
+        Render the chart between `start_ms` and `end_ms` as one flipped image, clipped to the chart.
+        Only the objects, enwiden spans and bar lines intersecting the window are visited, through `Chart.time_index`,
+        so the cost depends on the size of the window instead of the chart once the index is built.
+        `instrument` is an optional `instrument.Instrument` receiving a span for every stage.
+        """
+        if end_ms <= start_ms:
+            raise ValueError(f'Empty window from {start_ms} to {end_ms}')
+        with _instrument.span(instrument, 'time_index'):
+            index = self.time_index(track_meta)
+        speed = track_meta.speed
+        zoom = track_meta.zoom
+        total_height = round(self.total_height(speed, track_meta) * zoom)
+        top = min(max(math.floor(_time_to_height(start_ms, speed) * zoom), 0), total_height - 1)
+        bottom = min(max(math.ceil(_time_to_height(end_ms, speed) * zoom), top + 1), total_height)
+        return self._render_rows(index, top, bottom, track_meta, instrument=instrument)
+
+    def render_page(self, page, track_meta : TrackMetaInfo, instrument=None):
+        """
+        The page `page` of `Chart.pages` alone, visiting only its objects through `Chart.time_index`.
+        """
+        with _instrument.span(instrument, 'time_index'):
+            index = self.time_index(track_meta)
+        zoom = track_meta.zoom
+        total_height = round(self.total_height(track_meta.speed, track_meta) * zoom)
+        height_limit = round(track_meta.height_limit * zoom)
+        top = page * height_limit
+        bottom = min(total_height, top + height_limit)
+        text_window = (page * track_meta.height_limit, track_meta.height_limit)
+        return self._render_rows(index, top, bottom, track_meta, height=height_limit, text_window=text_window, instrument=instrument)
+
+    def _render_rows(self, index : TimeIndex, top, bottom, track_meta : TrackMetaInfo, height=None, text_window=None, instrument=None):
+        # Rows [top, bottom) of the zoomed chart, flipped and padded to `height` rows like a page,
+        # with bar texts laid out over `text_window` (start, height) before zooming
+        speed = track_meta.speed
+        if height is None:
+            height = bottom - top
+        if text_window is None:
+            text_window = (top / track_meta.zoom, height / track_meta.zoom)
+        with _instrument.span(instrument, 'background') as span:
+            image, _ = self.background(speed, track_meta, window=(top, bottom), index=index)
+            span.set(area=image.size[0] * image.size[1], bytes=image.size[0] * image.size[1] * 4)
+        with _instrument.span(instrument, 'window') as span:
+            timing_group = index.window(top, bottom, track_meta)
+            span.set(count=len(timing_group.notes) + len(timing_group.holds) + len(timing_group.arcs))
+        with _instrument.span(instrument, 'draw') as span:
+            hits, misses = track_meta.arc_note_hits, track_meta.arc_note_misses
+            timing_group.draw(image, ImageDraw.Draw(image), track_meta, speed, offset=top, instrument=instrument)
+            span.set(arc_note_hits=track_meta.arc_note_hits - hits, arc_note_misses=track_meta.arc_note_misses - misses)
+        return self._layout_rows(image, index, track_meta, height, text_window, instrument)
+
+    def _layout_rows(self, image : Image.Image, index : TimeIndex, track_meta : TrackMetaInfo, height, text_window, instrument=None):
+        # Pad drawn rows to `height`, flip them and draw the bar texts of `text_window`
+        with _instrument.span(instrument, 'page_layout', area=image.size[0] * height):
+            if image.size[1] < height:
+                page_image = Image.new('RGBA', (image.size[0], height), (0, 0, 0, 0))
+                page_image.paste(image, (0, 0))
+                image = page_image
+            image = image.transpose(Image.FLIP_TOP_BOTTOM)
+        text_info = index.texts(*text_window)
+        with _instrument.span(instrument, 'texts', count=len(text_info)):
+            self._draw_texts(image, text_info, track_meta, *text_window)
+        return image
+
+    def _merged_timing_group(self, track_meta : TrackMetaInfo):
+        self.refine()
+        if self.timing_groups and all(isinstance(tg, ColumnarTimingGroup) for tg in self.timing_groups):
+            merged_timing_group = ColumnarTimingGroup()
+        else:
+            merged_timing_group = TimingGroup()
+        for tg in self.timing_groups:
+            merged_timing_group.merge(tg)
+        merged_timing_group.refine(track_meta)
+        return merged_timing_group
+
+    def pages(self, track_meta : TrackMetaInfo, instrument=None):
+        """
+        Render the chart one page (a window of `height_limit`) at a time, by `Chart.render_page`.
+        Only the objects intersecting a page are visited and drawn on it, through `Chart.time_index`,
+        so the memory usage is bounded by a few pages instead of the whole chart.
+        `instrument` is an optional `instrument.Instrument` receiving a span for every stage.
+
+        Yields flipped pages of the same size, from the start of the chart.
+        """
+        with _instrument.span(instrument, 'refine') as span:
+            index = self.time_index(track_meta)
+            span.set(
+                count=len(index.notes) + len(index.holds) + len(index.arcs),
+                arc_groups=len(index.arc_groups),
+            )
+        for page in range(self.page_count(track_meta)):
+            yield self.render_page(page, track_meta, instrument)
+
+    def image(self, track_meta : TrackMetaInfo, instrument=None):
+        """
+        `instrument` is an optional `instrument.Instrument` receiving a span for every stage.
+        """
+        new_image = None
+        with _instrument.span(instrument, 'image') as image_span:
+            for index, page in enumerate(self.pages(track_meta, instrument)):
+                with _instrument.span(instrument, 'layout') as span:
+                    w, h = page.size
+                    if new_image is None:
+                        # The chart is refined once the first page is rendered
+                        new_image = Image.new('RGBA', (w * self.page_count(track_meta), h), (0, 0, 0, 0))
+                        image_span.set(area=new_image.size[0] * h, bytes=new_image.size[0] * h * 4)
+                    new_image.paste(page, (index * w, 0))
+                    span.set(area=w * h)
         return new_image
@@ -0,0 +1,147 @@
+"""
+Incremental rendering of a chart being edited.
+
+`IncrementalRenderer` keeps the last parsed chart and its rendered pages.
+Every update diffs the drawn objects of the new chart against the last one
+and re-renders only the pages whose rows are touched by an added, removed or changed object.
+"""
+import math
+from collections import defaultdict
+from PIL import Image
+from . import chart as _chart
+from . import render
+from . import instrument as _instrument
+
+def _note_key(note):
+    return 'note', note.start, note.lane
+
+def _hold_key(hold):
+    return 'hold', hold.start, hold.end, hold.lane
+
+def _arc_key(arc):
+    # Hitsounds are not drawn
+    return (
+        arc.start, arc.end, arc.x_start, arc.x_end, arc.easing.code, arc.y_start, arc.y_end,
+        arc.color, arc.skyline, tuple(arc.taps),
+    )
+
+class Snapshot:
+    """
+    Keys of everything drawn on a chart with the rows of the zoomed chart each of them may cover.
+
+    `items` maps a key to a list of rows (top, bottom), one for every object with the key.
+    `layout` holds everything drawn on every page: when it changes, all pages are re-rendered.
+    """
+    def __init__(self, chart : _chart.Chart, track_meta : _chart.TrackMetaInfo):
+        speed, zoom = track_meta.speed, track_meta.zoom
+        index = chart.time_index(track_meta)
+        timing_group = index.timing_group
+        note_height = track_meta.note_to_image().size[1]
+        arc_note_height = track_meta.arc_to_image(_chart._tap_pos_to_height_ratio(_chart.TAP_VISION_CAP)).size[1]
+
+        def _row(time):
+            return _chart._time_to_height(time, speed) * zoom
+
+        items = defaultdict(list)
+        # The same margins as TimingGroup.window
+        for note in timing_group.notes:
+            items[_note_key(note)].append((_row(note.start), _row(note.start) + note_height + 1))
+        for hold in timing_group.holds:
+            items[_hold_key(hold)].append((_row(hold.start), _row(hold.end) + 1))
+        for arc_group in timing_group.arc_groups:
+            # An arc group covers its polygon and the arc notes of its arcs
+            top, bottom = arc_group.bounds(track_meta, speed)
+            start = min(arc.start for arc in arc_group.arcs)
+            end = max(max(arc.start, arc.end) for arc in arc_group.arcs)
+            key = ('arc_group', arc_group.color, tuple(map(_arc_key, arc_group.arcs)))
+            items[key].append((min(top, _row(start)), max(bottom, _row(end) + arc_note_height + 1)))
+        for start, end in index.enwiden_spans:
+            items[('enwiden', start, end)].append((_row(start) - 1, _row(end) + 1))
+        for x_start, x_end, y in index.bar_lines:
+            items[('bar_line', x_start, x_end, y)].append((y * zoom - track_meta.bar_line_width * zoom - 1, y * zoom + track_meta.bar_line_width * zoom + 1))
+        height_limit = round(track_meta.height_limit * zoom)
+        for _, text, text_x, text_y in index.bar_texts:
+            # Bar texts are laid out over the page of their height
+            page = int(text_y // track_meta.height_limit)
+            items[('bar_text', text, text_x, text_y)].append((page * height_limit, page * height_limit))
+        self.items = dict(items)
+
+        total_height = round(chart.total_height(speed, track_meta) * zoom)
+        self.height_limit = height_limit
+        self.page_count = chart.page_count(track_meta)
+        self.layout = (
+            total_height, height_limit, speed, zoom, track_meta.extra_width, track_meta.group_tolerance, track_meta.draw_black_line,
+        )
+
+    def dirty_pages(self, other):
+        """
+        Pages of `self` touched by objects added, removed or changed since `other`, in ascending order.
+        """
+        if other is None or other.layout != self.layout:
+            return list(range(self.page_count))
+        res = set()
+        for snapshot, changed in ((self, self.items.keys() - other.items.keys()), (other, other.items.keys() - self.items.keys())):
+            for key in changed:
+                res.update(snapshot._pages(key))
+        for key in self.items.keys() & other.items.keys():
+            if len(self.items[key]) != len(other.items[key]):
+                res.update(self._pages(key))
+        return sorted(page for page in res if page < self.page_count)
+
+    def _pages(self, key):
+        for top, bottom in self.items[key]:
+            first = max(math.floor(top) // self.height_limit, 0)
+            last = max(math.ceil(bottom) // self.height_limit, 0)
+            yield from range(first, last + 1)
+
+class IncrementalRenderer:
+    """
+    Renders successive versions of a chart, reusing the pages no object changed on.
+
+        renderer = IncrementalRenderer(preset)
+        image = renderer.update(chart)
+        image = renderer.update(edited_chart)  # re-renders only the touched pages
+        renderer.dirty  # pages re-rendered by the last update
+
+    `extra_width` is passed to `render.apply_extra_width` on every update.
+    A change of the extra width, the page count or the options of `track_meta` re-renders every page.
+    """
+    def __init__(self, track_meta : _chart.TrackMetaInfo, extra_width=None):
+        self.track_meta = track_meta
+        self.extra_width = extra_width
+        self.chart = None
+        self.snapshot = None
+        self.pages = []
+        self.dirty = []
+
+    def update(self, chart : _chart.Chart, instrument=None):
+        """
+        Render `chart` and return the whole image, re-rendering only the dirty pages.
+        """
+        track_meta = self.track_meta
+        render.apply_extra_width(chart, track_meta, self.extra_width)
+        with _instrument.span(instrument, 'snapshot'):
+            snapshot = Snapshot(chart, track_meta)
+        with _instrument.span(instrument, 'diff') as span:
+            dirty = snapshot.dirty_pages(self.snapshot)
+            span.set(count=len(dirty))
+
+        pages = self.pages[:snapshot.page_count]
+        pages.extend([None] * (snapshot.page_count - len(pages)))
+        for page in dirty:
+            with _instrument.span(instrument, 'page'):
+                pages[page] = chart.render_page(page, track_meta, instrument=instrument)
+        self.chart, self.snapshot, self.pages, self.dirty = chart, snapshot, pages, dirty
+        return self.image()
+
+    def image(self):
+        """
+        The pages of the last update side by side, like `Chart.image`.
+        """
+        if not self.pages:
+            return None
+        w, h = self.pages[0].size
+        res = Image.new('RGBA', (w * len(self.pages), h), (0, 0, 0, 0))
+        for index, page in enumerate(self.pages):
+            res.paste(page, (index * w, 0))
+        return res
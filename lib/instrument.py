@@ -0,0 +1,135 @@
+import os
+import json
+import time
+import cProfile
+import pstats
+import contextlib
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def set(self, **info):
+        pass
+
+_null_span = _NullSpan()
+
+class Span:
+    """
+    A named span of an `Instrument`, with its duration and extra information
+    such as object counts (`count`), pixel areas (`area`) and allocation sizes (`bytes`).
+    """
+    __slots__ = ('instrument', 'name', 'info', 'depth', 'start', 'duration')
+
+    def __init__(self, instrument, name, info):
+        self.instrument = instrument
+        self.name = name
+        self.info = info
+        self.depth = 0
+        self.start = 0.0
+        self.duration = 0.0
+
+    def set(self, **info):
+        self.info.update(info)
+
+    def __enter__(self):
+        self.depth = self.instrument._enter()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.duration = time.perf_counter() - self.start
+        self.instrument._exit(self)
+        return False
+
+class Instrument:
+    """
+    A sink of named spans, passed to `Chart.image` and `TimingGroup.draw`.
+    """
+    def __init__(self):
+        self.spans = []
+        self.origin = time.perf_counter()
+        self.__depth = 0
+
+    def span(self, name, **info):
+        return Span(self, name, info)
+
+    def _enter(self):
+        self.__depth += 1
+        return self.__depth - 1
+
+    def _exit(self, span):
+        self.__depth -= 1
+        self.spans.append(span)
+
+    def summary(self):
+        """
+        {name: {'calls', 'time', 'max_time', and sums of numeric information}} in the order of first finish.
+        """
+        res = {}
+        for span in self.spans:
+            item = res.setdefault(span.name, {'calls': 0, 'time': 0.0, 'max_time': 0.0})
+            item['calls'] += 1
+            item['time'] += span.duration
+            item['max_time'] = max(item['max_time'], span.duration)
+            for key, value in span.info.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    item[key] = item.get(key, 0) + value
+        return res
+
+    def format_summary(self):
+        lines = []
+        for name, item in self.summary().items():
+            extra = ''.join(f', {key} {value}' for key, value in item.items() if key not in ('calls', 'time', 'max_time'))
+            lines.append(f'{name}: {item["time"] * 1000:.1f} ms in {item["calls"]} calls (max {item["max_time"] * 1000:.1f} ms){extra}')
+        return '\n'.join(lines)
+
+    def trace_events(self):
+        # Complete events of the Chrome trace event format, in microseconds
+        pid = os.getpid()
+        return [{
+            'name': span.name,
+            'ph': 'X',
+            'ts': (span.start - self.origin) * 1e6,
+            'dur': span.duration * 1e6,
+            'pid': pid,
+            'tid': 0,
+            'args': span.info,
+        } for span in sorted(self.spans, key=lambda span: (span.start, span.depth))]
+
+    def write(self, file):
+        """
+        Write the spans as a JSON trace, which can be opened in chrome://tracing or Perfetto,
+        with the summary under "summary".
+        """
+        with open(file, 'w', encoding='utf8') as f:
+            json.dump({'traceEvents': self.trace_events(), 'summary': self.summary()}, f, indent=1)
+
+def span(instrument, name, **info):
+    """
+    `instrument.span(name, **info)`, or a span doing nothing if `instrument` is None.
+    """
+    if instrument is None:
+        return _null_span
+    return instrument.span(name, **info)
+
+@contextlib.contextmanager
+def profile(file, sort='cumulative'):
+    """
+    Profile the block with cProfile.
+    The stats are written as text if `file` ends with .txt, otherwise in the binary format of pstats.
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if file.endswith('.txt'):
+            with open(file, 'w', encoding='utf8') as f:
+                pstats.Stats(profiler, stream=f).sort_stats(sort).print_stats()
+        else:
+            profiler.dump_stats(file)
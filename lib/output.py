@@ -0,0 +1,126 @@
+"""
+Output of rendered charts as one file per page (or per group of pages), encoded in parallel.
+
+    write_pages(chart, preset, 'out/chart', format_='png', workers=4, compress_level=6)
+
+writes out/chart_000.png, out/chart_001.png, ... and out/chart_pages.json listing the files with their time ranges.
+Pages are encoded on a thread pool as `Chart.pages` yields them: Pillow releases the GIL while encoding,
+and at most two files per worker wait to be encoded, so rendering and encoding overlap within a bounded memory.
+"""
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from . import chart as _chart
+from . import instrument as _instrument
+from .render import time_mapping
+
+# Format names of Pillow for the extensions it does not know as formats
+_PIL_FORMATS = {'jpg': 'jpeg'}
+
+def save_options(format_, compress_level=None, optimize=False, quality=None):
+    """
+    Keyword arguments of `Image.save` for the format.
+    compress_level: zlib level from 0 to 9 of PNG, None for the default of Pillow
+    optimize: to make PNG and JPEG files smaller at a higher cost, and to use the slowest method of WebP
+    quality: quality from 0 to 100 of lossy formats, None for the default of Pillow
+    """
+    format_ = format_.lower()
+    res = {}
+    if format_ == 'png':
+        if compress_level is not None:
+            res['compress_level'] = compress_level
+        if optimize:
+            res['optimize'] = True
+    elif format_ == 'webp':
+        if quality is not None:
+            res['quality'] = quality
+        if optimize:
+            res['method'] = 6
+    elif format_ in ('jpeg', 'jpg'):
+        if quality is not None:
+            res['quality'] = quality
+        if optimize:
+            res['optimize'] = True
+    return res
+
+def save(image : Image.Image, file, format_='png', **options):
+    """
+    `image.save` with `save_options`. Images are flattened for formats without alpha.
+    `format_` may also be an extension such as jpg.
+    """
+    if format_.lower() in ('jpeg', 'jpg') and image.mode != 'RGB':
+        image = image.convert('RGB')
+    image.save(file, format=_PIL_FORMATS.get(format_.lower(), format_), **save_options(format_, **options))
+
+def _join(pages):
+    if len(pages) == 1:
+        return pages[0]
+    w, h = pages[0].size
+    res = Image.new('RGBA', (w * len(pages), h), (0, 0, 0, 0))
+    for index, page in enumerate(pages):
+        res.paste(page, (index * w, 0))
+    return res
+
+def write_pages(chart : _chart.Chart, track_meta : _chart.TrackMetaInfo, output, format_='png', pages_per_file=1,
+                workers=None, instrument=None, **options):
+    """
+    Render the chart into files of `pages_per_file` pages side by side, named `<output>_<index>.<format_>`,
+    and a manifest `<output>_pages.json`. `options` are passed to `save_options`.
+    `workers` is the number of encoding threads, the number of CPUs by default.
+    Returns the manifest.
+    """
+    if pages_per_file < 1:
+        raise ValueError(f'Pages per file {pages_per_file} is less than 1')
+    directory = os.path.dirname(output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    mapping = time_mapping(chart, track_meta)
+    file_count = -(-mapping['page_count'] // pages_per_file)
+    digits = max(len(str(file_count - 1)), 3)
+
+    files = []
+    pending = []
+    group = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        def _submit():
+            index = len(files)
+            file = f'{output}_{index:0{digits}d}.{format_}'
+            first = index * pages_per_file
+            pages = mapping['pages'][first:first + len(group)]
+            files.append({
+                'file': os.path.basename(file),
+                'pages': [first, first + len(group)],
+                'start': pages[0]['start'],
+                'end': pages[-1]['end'],
+                'size': [mapping['page_width'] * len(group), mapping['page_height']],
+            })
+            pending.append(executor.submit(save, _join(group), file, format_, **options))
+            group.clear()
+            # Bound the images waiting to be encoded
+            while len(pending) > workers * 2:
+                pending.pop(0).result()
+
+        with _instrument.span(instrument, 'pages.write') as span:
+            for page in chart.pages(track_meta, instrument):
+                group.append(page)
+                if len(group) == pages_per_file:
+                    _submit()
+            if group:
+                _submit()
+            with _instrument.span(instrument, 'pages.wait'):
+                for future in pending:
+                    future.result()
+            span.set(count=len(files))
+
+    manifest = {
+        'format': format_,
+        'options': save_options(format_, **options),
+        'files': files,
+        'chart': {key: value for key, value in mapping.items() if key != 'pages'},
+    }
+    with open(f'{output}_pages.json', 'w', encoding='utf8') as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
@@ -201,6 +201,21 @@ if _os.path.isfile(_songlist_file):
                 else:
                     _songdict_inverse[_id] = 'dark'
 
+def names():
+    return list(_presets.keys())
+
+def name_from_id(id, inverse=False):
+    if inverse:
+        preset = _songdict_inverse.get(id, 'default')
+    else:
+        preset = _songdict.get(id, 'default')
+    if preset in _presets:
+        return preset
+    side = _sides.get(id, 0)
+    if (side == 1) != inverse:
+        return 'default_dark'
+    return 'default'
+
 def from_id(id):
     preset = _songdict.get(id, 'default')
     side = _sides.get(id, 0)
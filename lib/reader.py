@@ -1,10 +1,11 @@
-import re
+import os
+import json
+import struct
+import zlib
+import hashlib
+import numpy as np
 from . import chart as _chart
 
-_Re_timing_group = re.compile(r'^\s*timinggroup\(([^)]*)\){')
-_Re_timing_group_end = re.compile(r'^\s*}')
-_Re_action = re.compile(r'^\s*([A-Za-z0-9#]*)\(([^)]*)\)((?:\[[^\]]*\])?);\s*$')
-
 _Arg_note = (int, int)
 _Arg_hold = (int, int, int)
 _Arg_arc = (int, int, float, float, str, float, float, int, str, str)
@@ -20,19 +21,6 @@ def _analyze_args(args, pattern):
         res.append(func(arg))
     return res
 
-def _read_meta(seq):
-    meta = {}
-    while seq:
-        line = seq.pop()
-        if line.startswith('-'):
-            return meta
-        pos = line.find(':')
-        if pos >= 0:
-            meta_name = line[:pos]
-            meta_info = line[pos + 1:]
-            meta[meta_name] = meta_info
-    return meta
-
 def _read_extra_args(extra_args : str):
     if len(extra_args) < 2:
         return []
@@ -54,40 +42,6 @@ def _read_scene_control(args, chart : _chart.Chart, timing_group : _chart.Timing
         # others
         pass
 
-def _read_action(line, chart : _chart.Chart, timing_group : _chart.TimingGroup, filtered=False):
-    m = re.search(_Re_action, line)
-    if m is None:
-        #print(f'Warning: unidentified line "{line}"')
-        return
-    action_name, args, extra_args = m.groups()
-    try:
-        if action_name == '':
-            # note
-            if not filtered:
-                action = _chart.GroundNote(*_analyze_args(args, _Arg_note))
-                timing_group.notes.append(action)
-        elif action_name == 'hold':
-            if not filtered:
-                action = _chart.Hold(*_analyze_args(args, _Arg_hold))
-                timing_group.holds.append(action)
-        elif action_name == 'arc':
-            if not filtered:
-                taps = _read_extra_args(extra_args)
-                arc = _chart.Arc(*_analyze_args(args, _Arg_arc), taps=taps)
-                timing_group.arcs.append(arc)
-        elif action_name == 'timing':
-            if not filtered:
-                action = _chart.Timing(*_analyze_args(args, _Arg_timing))
-                timing_group.timings.append(action)
-        elif action_name == 'scenecontrol':
-            _read_scene_control(args, chart, timing_group)
-        else:
-            # others
-            pass
-    except Exception as e:
-        print(f'Warning: unidentified line "{line}" with exception: {e}')
-        raise
-
 def _read_timing_group_args(timing_group, args):
     if args is None:
         return {}
@@ -107,25 +61,320 @@ def _read_timing_group_args(timing_group, args):
             res[arg] = res.setdefault(arg, 0) + 1
     return res
 
-def _read_timing_group(chart, lines, args=None, depth=0, read_noinput=True):
+def _note(args, extra_args):
+    fields = args.split(',')
+    if len(fields) != 2:
+        return _chart.GroundNote(*_analyze_args(args, _Arg_note))
+    return _chart.GroundNote(int(fields[0]), int(fields[1]))
+
+def _hold(args, extra_args):
+    fields = args.split(',')
+    if len(fields) != 3:
+        return _chart.Hold(*_analyze_args(args, _Arg_hold))
+    return _chart.Hold(int(fields[0]), int(fields[1]), int(fields[2]))
+
+def _arc(args, extra_args):
+    taps = _read_extra_args(extra_args)
+    fields = args.split(',')
+    if len(fields) != 10:
+        return _chart.Arc(*_analyze_args(args, _Arg_arc), taps=taps)
+    return _chart.Arc(
+        int(fields[0]), int(fields[1]), float(fields[2]), float(fields[3]), fields[4],
+        float(fields[5]), float(fields[6]), int(fields[7]), fields[8], fields[9], taps=taps,
+    )
+
+def _timing(args, extra_args):
+    fields = args.split(',')
+    if len(fields) != 3:
+        return _chart.Timing(*_analyze_args(args, _Arg_timing))
+    return _chart.Timing(int(fields[0]), float(fields[1]), float(fields[2]))
+
+# Action name: (constructor, attribute of timing group)
+_actions = {
+    '': (_note, 'notes'),
+    'hold': (_hold, 'holds'),
+    'arc': (_arc, 'arcs'),
+    'timing': (_timing, 'timings'),
+}
+
+def _split_action(line):
+    """
+    Split a stripped line like `name(args)[extra_args];`.
+    Returns (action_name, args, extra_args), or None if the line is not an action.
+    """
+    left = line.find('(')
+    if left < 0:
+        return None
+    right = line.find(')', left)
+    if right < 0:
+        return None
+    rest = line[right + 1:].rstrip()
+    if not rest.endswith(';'):
+        return None
+    extra_args = rest[:-1]
+    if extra_args and (extra_args[0] != '[' or extra_args.find(']') != len(extra_args) - 1):
+        return None
+    return line[:left], line[left + 1:right], extra_args
+
+def read(chart : str, read_noinput=True, columnar=False):
+    """
+    Parse a chart in a single pass over its lines.
+    Each line is dispatched by its leading token, nested timing groups are kept on a stack.
+    With `columnar`, the timing groups are converted to `ColumnarTimingGroup`s.
+    """
+    lines = chart.splitlines(False)
+    meta = {}
+    index = 0
+    for index, line in enumerate(lines, 1):
+        if line.startswith('-'):
+            break
+        pos = line.find(':')
+        if pos >= 0:
+            meta[line[:pos]] = line[pos + 1:]
+    else:
+        index = len(lines)
+    chart = _chart.Chart(meta=meta)
+
     timing_group = _chart.TimingGroup()
-    res = _read_timing_group_args(timing_group, args)
-    filtered = not read_noinput and res.get('noinput', False)
     chart.timing_groups.append(timing_group)
-    while lines:
-        line = lines.pop()
-        if (m := re.search(_Re_timing_group, line)):
-            tg_args = m.group(1)
-            tg = _read_timing_group(chart, lines, tg_args, depth + 1, read_noinput=read_noinput)
-        elif re.search(_Re_timing_group_end, line):
-            break
-        else:
-            _read_action(line, chart, timing_group, filtered=filtered)
-    return timing_group
+    filtered = False
+    # (timing_group, filtered) of enclosing timing groups
+    stack = []
+    for line in lines[index:]:
+        stripped = line.lstrip()
+        if stripped.startswith('}'):
+            if not stack:
+                break
+            timing_group, filtered = stack.pop()
+            continue
+        if stripped.startswith('timinggroup('):
+            right = stripped.find(')')
+            if right >= 0 and stripped[right + 1:right + 2] == '{':
+                stack.append((timing_group, filtered))
+                timing_group = _chart.TimingGroup()
+                res = _read_timing_group_args(timing_group, stripped[12:right])
+                filtered = not read_noinput and res.get('noinput', False)
+                chart.timing_groups.append(timing_group)
+                continue
+        parts = _split_action(stripped)
+        if parts is None:
+            #print(f'Warning: unidentified line "{line}"')
+            continue
+        action_name, args, extra_args = parts
+        try:
+            action = _actions.get(action_name, None)
+            if action is not None:
+                if not filtered:
+                    constructor, attribute = action
+                    getattr(timing_group, attribute).append(constructor(args, extra_args))
+            elif action_name == 'scenecontrol':
+                _read_scene_control(args, chart, timing_group)
+            else:
+                # others
+                pass
+        except Exception as e:
+            print(f'Warning: unidentified line "{line}" with exception: {e}')
+            raise
+    if columnar:
+        chart = to_columnar(chart)
+    return chart
 
-def read(chart : str, read_noinput=True):
-    lines = list(reversed(chart.splitlines(False)))
-    meta = _read_meta(lines)
-    chart = _chart.Chart(meta=meta)
-    _read_timing_group(chart, lines, read_noinput=read_noinput)
+CACHE_DIR = os.path.join('.cache', 'charts')
+
+_CACHE_MAGIC = b'ARCACHRT'
+_CACHE_VERSION = 1
+# magic, version, header length
+_Cache_header = struct.Struct('<8sII')
+_CACHE_ALIGN = 16
+# Lookups of read_file in the compiled chart cache of this process
+cache_stats = {'hits': 0, 'misses': 0}
+
+# Record types of the compiled chart
+_Dtype_note = np.dtype([('start', '<i8'), ('lane', '<i8')])
+_Dtype_hold = np.dtype([('start', '<i8'), ('end', '<i8'), ('lane', '<i8')])
+_Dtype_arc = np.dtype([
+    ('start', '<i8'), ('end', '<i8'), ('x_start', '<f8'), ('x_end', '<f8'), ('y_start', '<f8'), ('y_end', '<f8'),
+    ('color', '<i8'), ('easing', '<u1'), ('skyline', '?'), ('hitsound', '<u4'), ('taps', '<u4'),
+])
+_Dtype_arctap = np.dtype('<i8')
+_Dtype_timing = np.dtype([('time', '<i8'), ('bpm', '<f8'), ('beats', '<f8')])
+_Dtype_enwiden = np.dtype([('time', '<i8'), ('duration', '<f8'), ('on', '?')])
+# notes, holds, arcs, timings of each timing group
+_Dtype_group = np.dtype([('notes', '<u4'), ('holds', '<u4'), ('arcs', '<u4'), ('timings', '<u4')])
+
+def _cache_file(file, read_noinput, cache_dir):
+    key = f'{os.path.abspath(file)}\0{bool(read_noinput)}'
+    return os.path.join(cache_dir, hashlib.sha1(key.encode('utf8')).hexdigest() + '.bin')
+
+def compile_chart(chart : _chart.Chart, source=None):
+    """
+    Compile a parsed chart into bytes of typed arrays.
+    `source` is stored in the header for validation of cache entries.
+    """
+    hitsounds = {}
+    notes, holds, arcs, arctaps, timings, groups = [], [], [], [], [], []
+    for timing_group in chart.timing_groups:
+        groups.append((len(timing_group.notes), len(timing_group.holds), len(timing_group.arcs), len(timing_group.timings)))
+        notes.extend((note.start, note.lane) for note in timing_group.notes)
+        holds.extend((hold.start, hold.end, hold.lane) for hold in timing_group.holds)
+        for arc in timing_group.arcs:
+            arcs.append((
+                arc.start, arc.end, arc.x_start, arc.x_end, arc.y_start, arc.y_end, arc.color,
+                arc.easing.code, arc.skyline, hitsounds.setdefault(arc.hitsound, len(hitsounds)), len(arc.taps),
+            ))
+            arctaps.extend(arc.taps)
+        timings.extend((timing.time, timing.bpm, timing.beats) for timing in timing_group.timings)
+    enwidens = [(enwiden.time, enwiden.duration, enwiden.on) for enwiden in chart.enwidenlaneses]
+
+    arrays = (
+        ('groups', np.array(groups, dtype=_Dtype_group)),
+        ('notes', np.array(notes, dtype=_Dtype_note)),
+        ('holds', np.array(holds, dtype=_Dtype_hold)),
+        ('arcs', np.array(arcs, dtype=_Dtype_arc)),
+        ('arctaps', np.array(arctaps, dtype=_Dtype_arctap)),
+        ('timings', np.array(timings, dtype=_Dtype_timing)),
+        ('enwidens', np.array(enwidens, dtype=_Dtype_enwiden)),
+    )
+    payload = bytearray()
+    layout = {}
+    for name, array in arrays:
+        layout[name] = (len(payload), len(array))
+        payload += array.tobytes()
+        payload += bytes(-array.nbytes % _CACHE_ALIGN)
+    header = json.dumps({
+        'source': source,
+        'meta': chart.meta,
+        'hitsounds': list(hitsounds),
+        'arrays': layout,
+        'crc32': zlib.crc32(payload),
+    }).encode('utf8')
+    header += b' ' * (-(_Cache_header.size + len(header)) % _CACHE_ALIGN)
+    return _Cache_header.pack(_CACHE_MAGIC, _CACHE_VERSION, len(header)) + header + payload
+
+def _read_compiled_header(f):
+    magic, version, header_size = _Cache_header.unpack(f.read(_Cache_header.size))
+    if magic != _CACHE_MAGIC or version != _CACHE_VERSION:
+        raise ValueError('not a compiled chart of this version')
+    return json.loads(f.read(header_size).decode('utf8')), _Cache_header.size + header_size
+
+def _load_compiled(buffer, header, data_offset, columnar=False):
+    if zlib.crc32(buffer[data_offset:]) != header['crc32']:
+        raise ValueError('corrupt compiled chart')
+
+    def array(name, dtype):
+        offset, count = header['arrays'][name]
+        return np.frombuffer(buffer, dtype=dtype, count=count, offset=data_offset + offset)
+
+    groups = array('groups', _Dtype_group)
+    notes = array('notes', _Dtype_note)
+    holds = array('holds', _Dtype_hold)
+    arcs = array('arcs', _Dtype_arc)
+    arctaps = array('arctaps', _Dtype_arctap)
+    timings = array('timings', _Dtype_timing)
+    enwidens = array('enwidens', _Dtype_enwiden)
+    hitsounds = np.array(header['hitsounds'] or [''], dtype=object)
+    counts = [int(groups[name].sum()) for name in _Dtype_group.names]
+    if counts != [len(notes), len(holds), len(arcs), len(timings)] or int(arcs['taps'].sum()) != len(arctaps) \
+            or (len(arcs) and int(arcs['hitsound'].max()) >= len(hitsounds)):
+        raise ValueError('corrupt compiled chart')
+
+    chart = _chart.Chart(meta=header['meta'])
+    tap_offsets = np.zeros(len(arcs) + 1, dtype=np.int64)
+    np.cumsum(arcs['taps'], out=tap_offsets[1:])
+    offsets = np.zeros((len(groups) + 1, 4), dtype=np.int64)
+    if len(groups):
+        np.cumsum(groups.view(('<u4', 4)), axis=0, out=offsets[1:])
+    for (note_start, hold_start, arc_start, timing_start), (note_end, hold_end, arc_end, timing_end) in zip(offsets.tolist(), offsets[1:].tolist()):
+        group_arcs = arcs[arc_start:arc_end]
+        arc_columns = _chart.ArcColumns(
+            tap_offsets=tap_offsets[arc_start:arc_end + 1] - tap_offsets[arc_start],
+            tap_values=arctaps[tap_offsets[arc_start]:tap_offsets[arc_end]],
+            hitsound=hitsounds[group_arcs['hitsound']],
+            **{name: group_arcs[name] for name in _Dtype_arc.names if name not in ('hitsound', 'taps')},
+        )
+        timing_group = _chart.ColumnarTimingGroup(
+            _chart.NoteColumns(**{name: notes[name][note_start:note_end] for name in _Dtype_note.names}),
+            _chart.HoldColumns(**{name: holds[name][hold_start:hold_end] for name in _Dtype_hold.names}),
+            arc_columns,
+            _chart.TimingColumns(**{name: timings[name][timing_start:timing_end] for name in _Dtype_timing.names}),
+        )
+        if not columnar:
+            timing_group = _timing_group_objects(timing_group)
+        chart.timing_groups.append(timing_group)
+    chart.enwidenlaneses = [_chart.EnwidenLanes(*enwiden) for enwiden in enwidens.tolist()]
+    return chart
+
+def _timing_group_objects(timing_group):
+    res = _chart.TimingGroup()
+    res.notes = timing_group.notes
+    res.holds = timing_group.holds
+    res.arcs = timing_group.arcs
+    res.timings = timing_group.timings
+    return res
+
+def to_columnar(chart : _chart.Chart):
+    """
+    Convert the timing groups of a chart to `ColumnarTimingGroup`s.
+    """
+    chart.timing_groups = [_chart.ColumnarTimingGroup.from_timing_group(tg) for tg in chart.timing_groups]
+    return chart
+
+def load_compiled(file, columnar=False):
+    """
+    Load a compiled chart through a memory map of the file.
+    """
+    with open(file, 'rb') as f:
+        header, data_offset = _read_compiled_header(f)
+    buffer = np.memmap(file, dtype=np.uint8, mode='r')
+    return _load_compiled(buffer, header, data_offset, columnar)
+
+def _write_compiled(cache_file, data):
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    temp_file = f'{cache_file}.{os.getpid()}.tmp'
+    with open(temp_file, 'wb') as f:
+        f.write(data)
+    os.replace(temp_file, cache_file)
+
+def read_file(file, read_noinput=True, cache_dir=CACHE_DIR, columnar=False):
+    """
+    Read a chart file, through the compiled chart cache in `cache_dir` if it is not None.
+    With `columnar`, the timing groups are `ColumnarTimingGroup`s.
+
+    A cache entry is used if the source file has the same content hash as when it was compiled.
+    The file is hashed on every read, which costs far less than parsing it,
+    so that an edit keeping the mtime and size is never missed.
+    Stale or corrupt entries are replaced by parsing the text again.
+    """
+    if cache_dir is None:
+        with open(file, 'r', encoding='utf8') as f:
+            return read(f.read(), read_noinput=read_noinput, columnar=columnar)
+
+    with open(file, 'rb') as f:
+        data = f.read()
+    source = {
+        'path': os.path.abspath(file),
+        'read_noinput': bool(read_noinput),
+        'sha1': hashlib.sha1(data).hexdigest(),
+    }
+    cache_file = _cache_file(file, read_noinput, cache_dir)
+    chart = None
+    try:
+        with open(cache_file, 'rb') as f:
+            header, data_offset = _read_compiled_header(f)
+        if all(header['source'].get(name) == value for name, value in source.items()):
+            chart = _load_compiled(np.memmap(cache_file, dtype=np.uint8, mode='r'), header, data_offset, columnar)
+    except Exception:
+        chart = None
+    if chart is not None:
+        cache_stats['hits'] += 1
+        return chart
+    cache_stats['misses'] += 1
+    # Same as reading in text mode with universal newlines
+    chart = read(data.decode('utf8'), read_noinput=read_noinput)
+    try:
+        _write_compiled(cache_file, compile_chart(chart, source))
+    except (OSError, ValueError, OverflowError):
+        pass
+    if columnar:
+        chart = to_columnar(chart)
     return chart
@@ -0,0 +1,136 @@
+import os
+from . import chart as _chart
+from . import reader
+from . import presets
+
+_SONGS_DIR = 'assets/songs'
+_DL_DIR = 'dl'
+
+def is_official(file):
+    """
+    Whether `file` is inside the official directories, after resolving links and `..`.
+    """
+    path = os.path.realpath(file)
+    for directory in (_SONGS_DIR, _DL_DIR):
+        directory = os.path.realpath(directory)
+        if os.path.commonpath((path, directory)) == directory:
+            return True
+    return False
+
+def locate(file_id, difficulty=None):
+    """
+    Find the chart file of an official ID or a path.
+
+    Returns (file, difficulty, official).
+    `file` is None if no chart is found.
+    `difficulty` is None if `file_id` is a plain path.
+    `official` tells whether the chart is found in the official directories, see `is_official`.
+    """
+    if difficulty is None:
+        diffs = (3, 2, 1, 0)
+    else:
+        diffs = (difficulty, )
+
+    if not os.path.isabs(file_id):
+        songs_dir = f'{_SONGS_DIR}/{file_id}'
+        if os.path.isdir(songs_dir):
+            for diff in diffs:
+                _file = f'{songs_dir}/{diff}.aff'
+                if os.path.isfile(_file):
+                    return _file, diff, is_official(_file)
+        for diff in diffs:
+            _file = f'{_DL_DIR}/{file_id}_{diff}'
+            if os.path.isfile(_file):
+                return _file, diff, is_official(_file)
+    for diff in diffs:
+        _file = f'{file_id}_{diff}'
+        if os.path.isfile(_file):
+            return _file, diff, False
+    if os.path.isfile(file_id):
+        return file_id, None, False
+    return None, None, False
+
+def output_name(file_id, difficulty, format_, suffix=''):
+    if difficulty is not None:
+        return f'{file_id}_{difficulty}{suffix}.{format_}'
+    return f'{file_id}{suffix}.{format_}'
+
+def get_preset(file_id, preset_name=None, official=False):
+    preset = None
+    if official:
+        if preset_name is None:
+            preset = presets.from_id(file_id)
+        elif preset_name == 'inverse':
+            preset = presets.from_id_inverse(file_id)
+    if preset is None:
+        preset = presets.get(preset_name)
+    if preset is None:
+        preset = presets.get('default')
+    return preset
+
+def configure(preset, speed=2000, height=24000, zoom=0.2, group_tolerance=20, draw_black_line=True):
+    preset.speed = speed
+    preset.group_tolerance = group_tolerance
+    preset.zoom = zoom
+    preset.draw_black_line = draw_black_line
+    preset.height_limit = height
+    return preset
+
+def load(file, read_noinput=False, cache_dir=reader.CACHE_DIR, columnar=False):
+    """
+    `cache_dir` is the directory of compiled charts, None to always parse the text.
+    `columnar` is to store the timing groups as NumPy columns.
+    """
+    return reader.read_file(file, read_noinput=read_noinput, cache_dir=cache_dir, columnar=columnar)
+
+def apply_extra_width(chart, preset, extra_width=None):
+    """
+    None: calculate automatically, ignoring black lines.
+    Less than zero: calculate automatically, considering black lines.
+    """
+    if extra_width is None:
+        extra_width = chart.max_extra_width(ignore_black=True)
+    elif extra_width < 0:
+        extra_width = chart.max_extra_width(ignore_black=False)
+    preset.extra_width = extra_width
+    return extra_width
+
+def render(chart, preset, extra_width=None, instrument=None):
+    apply_extra_width(chart, preset, extra_width)
+    return chart.image(preset, instrument=instrument)
+
+def render_window(chart, preset, start_ms, end_ms, extra_width=None, instrument=None):
+    """
+    The chart between `start_ms` and `end_ms`, see `Chart.render_window`.
+    """
+    apply_extra_width(chart, preset, extra_width)
+    return chart.render_window(start_ms, end_ms, preset, instrument=instrument)
+
+def time_mapping(chart : _chart.Chart, track_meta : _chart.TrackMetaInfo):
+    """
+    The layout of `Chart.image` for viewers mapping times to pixels.
+
+    A time `t` in ms is on page `floor(row / page_height)` with `row = t * pixels_per_ms`,
+    at x from `page * page_width` and y = `page_height - 1 - (row - page * page_height)`, as pages are flipped.
+    `lanes_x` are the x of the left borders of lanes 0 to 5 (lanes 0 and 5 are the extra lanes) within a page.
+    """
+    chart.refine()
+    zoom = track_meta.zoom
+    _, bar_texts = chart._bar_lines(track_meta.speed, track_meta, chart._enwiden_spans()[1])
+    page_width = round((1500 + track_meta.extra_width * 2) * zoom)
+    page_height = round(track_meta.height_limit * zoom)
+    page_count = chart.page_count(track_meta)
+    pixels_per_ms = _chart._time_to_height(1, track_meta.speed) * zoom
+    return {
+        'pixels_per_ms': pixels_per_ms,
+        'page_width': page_width,
+        'page_height': page_height,
+        'page_count': page_count,
+        'pages': [
+            {'start': page * page_height / pixels_per_ms, 'end': (page + 1) * page_height / pixels_per_ms}
+            for page in range(page_count)
+        ],
+        'lanes_x': [round((36 + 238 * lane + track_meta.extra_width) * zoom) for lane in range(6)],
+        'total_time': chart.total_draw_time,
+        'bars': [_chart._height_to_time(text_y, track_meta.speed) for _, _, _, text_y in bar_texts],
+    }
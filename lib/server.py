@@ -0,0 +1,458 @@
+"""
+A local HTTP render service.
+
+    python main.py --serve --port 8000 --workers 4
+
+    GET /render?id=<id>&difficulty=3&preset=inverse&speed=2000&zoom=0.2&height=24000&format=png
+        the image of the chart, with the render time in the X-Render-Time header
+    GET /metrics
+        Prometheus text: queue depth, running jobs, latency histograms, request counts and cache hit rates
+    GET /health
+
+Jobs are dispatched to a pool of worker processes which preload the presets when they start,
+so a request only pays for reading and rendering its chart, or nothing if it is in the render cache (see `cache.RenderCache`).
+At most `queue_size` requests wait for a worker: more get 429 Too Many Requests.
+A job taking longer than `timeout` seconds, waiting included, gets 504 Gateway Timeout,
+and its worker is killed and replaced if it was rendering.
+"""
+import io
+import math
+import time
+import queue
+import bisect
+import signal
+import threading
+import traceback
+import multiprocessing
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from . import chart as _chart
+from . import presets
+from . import render
+from . import reader
+from . import cache
+from .output import save
+
+# Workers are started from handler threads, where forking could copy locks held by other threads
+_CONTEXT = multiprocessing.get_context('spawn')
+
+FORMATS = {'png': 'image/png', 'webp': 'image/webp', 'jpeg': 'image/jpeg', 'jpg': 'image/jpeg'}
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Bounds of the render options of a request
+_LIMITS = {'speed': (1, 20000), 'zoom': (0.01, 1), 'height': (1000, 100000)}
+
+class Overloaded(Exception):
+    pass
+
+class JobTimeout(Exception):
+    pass
+
+class WorkerError(Exception):
+    pass
+
+_render_cache = None
+# Arc note sprite cache lookups of the presets of every job, see `TrackMetaInfo.arc_note_cache_info`
+_arc_note_stats = [0, 0]
+
+def _worker_main(conn, options):
+    global _render_cache
+    # Ctrl+C stops the server, which then closes the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if options['render_cache'] is not None:
+        _render_cache = cache.RenderCache(options['render_cache'], options['render_cache_size'])
+    for name in options['warm']:
+        preset = presets.get(name)
+        if preset is not None:
+            render.configure(preset, **options['render']).preload()
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        conn.send(_render_job(job, options))
+
+def _render_job(job, options):
+    result = {'timings': {}}
+    timings = result['timings']
+    time_start = time.perf_counter()
+    try:
+        preset = render.get_preset(job['id'], job['preset'], job['official'])
+        render.configure(preset, **job['render'])
+        cache_key = None
+        if _render_cache is not None:
+            cache_key = cache.render_key(job['file'], preset, options['extra_width'], options['read_noinput'], job['format'])
+            if not options['refresh_render_cache']:
+                result['body'] = _render_cache.read(cache_key, job['format'])
+        time_cache = time.perf_counter()
+        timings['cache'] = time_cache - time_start
+
+        if result.get('body') is None:
+            chart = render.load(job['file'], read_noinput=options['read_noinput'], cache_dir=options['chart_cache'], columnar=options['columnar'])
+            time_read = time.perf_counter()
+            timings['read'] = time_read - time_cache
+
+            image = render.render(chart, preset, options['extra_width'])
+            _arc_note_stats[0] += preset.arc_note_hits
+            _arc_note_stats[1] += preset.arc_note_misses
+            time_render = time.perf_counter()
+            timings['render'] = time_render - time_read
+
+            buffer = io.BytesIO()
+            save(image, buffer, job['format'])
+            result['body'] = buffer.getvalue()
+            if cache_key is not None:
+                _render_cache.put(cache_key, job['format'], result['body'])
+            timings['encode'] = time.perf_counter() - time_render
+        result['status'] = 'ok'
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = f'{e.__class__.__name__}: {e}'
+        result['traceback'] = traceback.format_exc()
+    timings['total'] = time.perf_counter() - time_start
+    # Cumulative counts of this process
+    result['cache'] = {
+        'sprite': (_chart.sprite_cache.hits, _chart.sprite_cache.misses),
+        'chart': (reader.cache_stats['hits'], reader.cache_stats['misses']),
+        'arc_note': tuple(_arc_note_stats),
+    }
+    if _render_cache is not None:
+        result['cache']['render'] = (_render_cache.hits, _render_cache.misses)
+    return result
+
+class _Worker:
+    def __init__(self, options):
+        self.conn, child_conn = _CONTEXT.Pipe()
+        self.process = _CONTEXT.Process(target=_worker_main, args=(child_conn, options), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    def run(self, job, timeout):
+        self.conn.send(job)
+        if not self.conn.poll(timeout):
+            raise JobTimeout(f'The job did not finish in {timeout:.1f}s')
+        return self.conn.recv()
+
+    def close(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(1)
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+class WorkerPool:
+    """
+    Worker processes taking one job at a time, with at most `queue_size` jobs waiting for them.
+    `options` are passed to the workers, see `Service`.
+    """
+    def __init__(self, workers, options, queue_size=16, timeout=60.0):
+        self.size = workers
+        self.options = options
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.waiting = 0
+        self.running = 0
+        self.restarts = 0
+        self.__lock = threading.Lock()
+        self.__slots = threading.BoundedSemaphore(workers + queue_size)
+        self.__idle = queue.Queue()
+        for _ in range(workers):
+            self.__idle.put(_Worker(options))
+
+    def submit(self, job):
+        """
+        Run the job on a worker and return its result with the time waited for the worker in `queued`.
+        Raises Overloaded if the queue is full, JobTimeout on timeout and WorkerError if the worker died.
+        """
+        if not self.__slots.acquire(blocking=False):
+            raise Overloaded(f'{self.size} jobs running and {self.queue_size} waiting')
+        try:
+            time_start = time.monotonic()
+            with self.__lock:
+                self.waiting += 1
+            try:
+                worker = self.__idle.get(timeout=self.timeout)
+            except queue.Empty:
+                raise JobTimeout(f'No worker was free in {self.timeout:.1f}s') from None
+            finally:
+                with self.__lock:
+                    self.waiting -= 1
+            queued = time.monotonic() - time_start
+            with self.__lock:
+                self.running += 1
+            try:
+                result = worker.run(job, max(self.timeout - queued, 0.001))
+            except JobTimeout:
+                worker = self.__replace(worker)
+                raise
+            except (EOFError, OSError) as e:
+                worker = self.__replace(worker)
+                raise WorkerError(f'The worker died: {e.__class__.__name__}') from None
+            finally:
+                with self.__lock:
+                    self.running -= 1
+                self.__idle.put(worker)
+        finally:
+            self.__slots.release()
+        result['pid'] = worker.pid
+        result['queued'] = queued
+        return result
+
+    def __replace(self, worker):
+        worker.kill()
+        with self.__lock:
+            self.restarts += 1
+        return _Worker(self.options)
+
+    def close(self):
+        for _ in range(self.size):
+            self.__idle.get().close()
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name):
+        res = []
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf', ), self.counts):
+            total += count
+            res.append(f'{name}_bucket{{le="{bound}"}} {total}')
+        res.append(f'{name}_sum {self.sum}')
+        res.append(f'{name}_count {self.count}')
+        return res
+
+class Metrics:
+    def __init__(self):
+        self.requests = {}
+        self.latency = {'request': Histogram(), 'queue': Histogram(), 'render': Histogram()}
+        # Cumulative (hits, misses) of each cache reported by every worker process
+        self.caches = {}
+        self.__lock = threading.Lock()
+
+    def record(self, status, elapsed, result=None):
+        with self.__lock:
+            self.requests[status] = self.requests.get(status, 0) + 1
+            self.latency['request'].observe(elapsed)
+            if result is not None:
+                self.latency['queue'].observe(result['queued'])
+                self.latency['render'].observe(result['timings']['total'])
+                self.caches[result['pid']] = result['cache']
+
+    def format(self, pool : WorkerPool):
+        with self.__lock:
+            lines = [
+                '# HELP arcachart_queue_depth Jobs waiting for a worker.',
+                '# TYPE arcachart_queue_depth gauge',
+                f'arcachart_queue_depth {pool.waiting}',
+                '# HELP arcachart_jobs_running Jobs being rendered.',
+                '# TYPE arcachart_jobs_running gauge',
+                f'arcachart_jobs_running {pool.running}',
+                '# HELP arcachart_workers Worker processes.',
+                '# TYPE arcachart_workers gauge',
+                f'arcachart_workers {pool.size}',
+                '# HELP arcachart_worker_restarts_total Workers killed on timeout or death.',
+                '# TYPE arcachart_worker_restarts_total counter',
+                f'arcachart_worker_restarts_total {pool.restarts}',
+                '# HELP arcachart_requests_total Render requests by HTTP status.',
+                '# TYPE arcachart_requests_total counter',
+            ]
+            for status, count in sorted(self.requests.items()):
+                lines.append(f'arcachart_requests_total{{status="{status}"}} {count}')
+            for name, help_ in (
+                ('request', 'Time of render requests, waiting included.'),
+                ('queue', 'Time render jobs waited for a worker.'),
+                ('render', 'Time workers spent on render jobs, reading and encoding included.'),
+            ):
+                lines.append(f'# HELP arcachart_{name}_seconds {help_}')
+                lines.append(f'# TYPE arcachart_{name}_seconds histogram')
+                lines.extend(self.latency[name].lines(f'arcachart_{name}_seconds'))
+
+            caches = {}
+            for worker_caches in self.caches.values():
+                for name, (hits, misses) in worker_caches.items():
+                    total = caches.setdefault(name, [0, 0])
+                    total[0] += hits
+                    total[1] += misses
+            lines.append('# HELP arcachart_cache_hits_total Cache hits of the workers.')
+            lines.append('# TYPE arcachart_cache_hits_total counter')
+            lines.extend(f'arcachart_cache_hits_total{{cache="{name}"}} {hits}' for name, (hits, _) in sorted(caches.items()))
+            lines.append('# HELP arcachart_cache_misses_total Cache misses of the workers.')
+            lines.append('# TYPE arcachart_cache_misses_total counter')
+            lines.extend(f'arcachart_cache_misses_total{{cache="{name}"}} {misses}' for name, (_, misses) in sorted(caches.items()))
+            lines.append('# HELP arcachart_cache_hit_ratio Hits over lookups of the caches of the workers.')
+            lines.append('# TYPE arcachart_cache_hit_ratio gauge')
+            for name, (hits, misses) in sorted(caches.items()):
+                lines.append(f'arcachart_cache_hit_ratio{{cache="{name}"}} {hits / (hits + misses) if hits + misses else 0.0}')
+        return '\n'.join(lines) + '\n'
+
+class BadRequest(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def _option(params, name, type_, default):
+    values = params.get(name)
+    if not values or values[-1] == '':
+        return default
+    try:
+        value = type_(values[-1])
+    except ValueError:
+        raise BadRequest(400, f'Invalid {name}: {values[-1]}') from None
+    if name in _LIMITS:
+        low, high = _LIMITS[name]
+        if not (math.isfinite(value) and low <= value <= high):
+            raise BadRequest(400, f'{name} must be between {low} and {high}')
+    return value
+
+class Service:
+    """
+    The render service behind the HTTP handler.
+
+    `render_options` are the defaults of `render.configure`, overridden by the speed, zoom and height of requests.
+    `render_cache` is the directory of `cache.RenderCache` shared by the workers, None to disable it.
+    Unless `allow_paths`, the id of a request has to be an official chart, so that clients cannot read other files.
+    `warm` lists the presets the workers preload, every preset by default.
+    """
+    def __init__(self, workers=None, queue_size=16, timeout=60.0, read_noinput=False, extra_width=None,
+                 chart_cache=reader.CACHE_DIR, columnar=False, render_cache=cache.CACHE_DIR, render_cache_size=1024 * 1024 * 1024,
+                 refresh_render_cache=False, allow_paths=False, warm=None, log=None, **render_options):
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        self.render_options = render_options
+        self.allow_paths = allow_paths
+        self.log = log if log is not None else lambda message: print(message, flush=True)
+        options = {
+            'read_noinput': read_noinput,
+            'chart_cache': chart_cache,
+            'columnar': columnar,
+            'render_cache': render_cache,
+            'render_cache_size': render_cache_size,
+            'refresh_render_cache': refresh_render_cache,
+            'extra_width': extra_width,
+            'render': render_options,
+            'warm': sorted(presets.names()) if warm is None else list(warm),
+        }
+        self.pool = WorkerPool(max(1, workers), options, queue_size, timeout)
+        self.metrics = Metrics()
+
+    def job(self, params):
+        """
+        The job of the query parameters of a render request. Raises BadRequest.
+        """
+        file_id = params.get('id', [''])[-1]
+        if not file_id:
+            raise BadRequest(400, 'Missing id')
+        difficulty = _option(params, 'difficulty', int, None)
+        preset = _option(params, 'preset', str, None)
+        if preset is not None and preset != 'inverse' and preset not in presets.names():
+            raise BadRequest(400, f'Unknown preset: {preset}')
+        format_ = _option(params, 'format', str, 'png').lower()
+        if format_ not in FORMATS:
+            raise BadRequest(400, f'Unsupported format: {format_}')
+        render_options = dict(self.render_options)
+        for name in ('speed', 'zoom', 'height'):
+            value = _option(params, name, float, None)
+            if value is not None:
+                render_options[name] = value
+
+        if not self.allow_paths and ('/' in file_id or '\\' in file_id or '..' in file_id):
+            raise BadRequest(404, f'Chart {file_id} is not found')
+        file, _, official = render.locate(file_id, difficulty)
+        if file is None or not (official or self.allow_paths):
+            raise BadRequest(404, f'Chart {file_id} is not found')
+        return {'id': file_id, 'file': file, 'official': official, 'preset': preset, 'format': format_, 'render': render_options}
+
+    def render(self, params):
+        """
+        Returns (status, headers, body) of a render request.
+        """
+        time_start = time.perf_counter()
+        result = None
+        try:
+            job = self.job(params)
+            result = self.pool.submit(job)
+            if result['status'] == 'ok':
+                status = 200
+                headers = {
+                    'Content-Type': FORMATS[job['format']],
+                    'X-Render-Time': f'{result["timings"]["total"]:.3f}',
+                    'X-Queue-Time': f'{result["queued"]:.3f}',
+                    'X-Render-Cache': 'miss' if 'render' in result['timings'] else 'hit',
+                }
+                body = result['body']
+            else:
+                self.log(f'Failed to render {job["file"]}:\n{result["traceback"]}')
+                status, headers, body = 500, {}, result['error'].encode('utf8')
+        except BadRequest as e:
+            status, headers, body = e.status, {}, str(e).encode('utf8')
+        except Overloaded as e:
+            status, headers, body = 429, {'Retry-After': '1'}, str(e).encode('utf8')
+        except JobTimeout as e:
+            status, headers, body = 504, {}, str(e).encode('utf8')
+        except WorkerError as e:
+            status, headers, body = 500, {}, str(e).encode('utf8')
+        headers.setdefault('Content-Type', 'text/plain; charset=utf-8')
+        self.metrics.record(status, time.perf_counter() - time_start, result)
+        return status, headers, body
+
+    def close(self):
+        self.pool.close()
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        service = self.server.service
+        url = urlparse(self.path)
+        if url.path == '/render':
+            status, headers, body = service.render(parse_qs(url.query))
+        elif url.path == '/metrics':
+            status, headers, body = 200, {'Content-Type': 'text/plain; version=0.0.4'}, service.metrics.format(service.pool).encode('utf8')
+        elif url.path == '/health':
+            status, headers, body = 200, {'Content-Type': 'text/plain; charset=utf-8'}, b'ok\n'
+        else:
+            status, headers, body = 404, {'Content-Type': 'text/plain; charset=utf-8'}, b'Not found\n'
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        self.server.service.log(f'{self.address_string()} - {format % args}')
+
+def serve(host='127.0.0.1', port=8000, **options):
+    """
+    Serve `Service(**options)` on `host`:`port` until interrupted.
+    """
+    service = Service(**options)
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.service = service
+    service.log(f'Serving on http://{host}:{server.server_address[1]} with {service.pool.size} workers, press Ctrl+C to stop.')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        service.log('Stopped serving.')
+    finally:
+        server.server_close()
+        service.close()
@@ -0,0 +1,149 @@
+"""
+Deep Zoom (DZI) tile pyramids of rendered charts, for web viewers loading only the visible tiles.
+
+    write_tiles(chart, preset, 'out/chart')
+
+writes
+    out/chart.dzi: the Deep Zoom manifest
+    out/chart_files/<level>/<column>_<row>.<format>: tiles of `tile_size`, without overlap
+    out/chart.json: the manifest as JSON, with the mapping between times and pixels
+
+Level `max_level` is the image of `Chart.image`, and every lower level halves it by averaging 2x2 pixels.
+Pages are written to tiles as `Chart.pages` yields them, and each level only keeps the columns of pixels
+not written to tiles yet, so the pyramid is never held in memory.
+"""
+import os
+import json
+import math
+from PIL import Image
+from . import chart as _chart
+from . import instrument as _instrument
+from .output import save
+from .render import time_mapping
+
+DZI_NAMESPACE = 'http://schemas.microsoft.com/deepzoom/2008'
+
+class _TileLevel:
+    """
+    A level of the pyramid receiving its image as strips of columns from left to right.
+    Complete tile columns are written, and halved into strips of the lower level.
+    """
+    def __init__(self, writer, level, height):
+        self.writer = writer
+        self.level = level
+        self.height = height
+        self.column = 0
+        self.buffer = None
+        self.lower = _TileLevel(writer, level - 1, (height + 1) // 2) if level > 0 else None
+
+    def push(self, strip : Image.Image):
+        if self.buffer is None:
+            self.buffer = strip
+        else:
+            buffer = Image.new(strip.mode, (self.buffer.size[0] + strip.size[0], self.height))
+            buffer.paste(self.buffer, (0, 0))
+            buffer.paste(strip, (self.buffer.size[0], 0))
+            self.buffer = buffer
+        tile_size = self.writer.tile_size
+        while self.buffer is not None and self.buffer.size[0] >= tile_size:
+            column, width = self.buffer.crop((0, 0, tile_size, self.height)), self.buffer.size[0]
+            self.buffer = self.buffer.crop((tile_size, 0, width, self.height)) if width > tile_size else None
+            self.__write_column(column)
+
+    def finish(self):
+        if self.buffer is not None:
+            self.__write_column(self.buffer)
+            self.buffer = None
+        if self.lower is not None:
+            self.lower.finish()
+
+    def __write_column(self, column : Image.Image):
+        tile_size = self.writer.tile_size
+        for row in range(math.ceil(self.height / tile_size)):
+            tile = column.crop((0, row * tile_size, column.size[0], min(self.height, (row + 1) * tile_size)))
+            self.writer.write_tile(self.level, self.column, row, tile)
+        self.column += 1
+        if self.lower is not None:
+            # Tile columns have an even width except the last one, so halving them one by one
+            # gives the same pixels as halving the whole level
+            self.lower.push(column.reduce(2))
+
+class TileWriter:
+    """
+    Writes the tiles of an image of `size` given as strips of columns from left to right.
+    """
+    def __init__(self, output, size, tile_size=256, format_='png', **options):
+        if tile_size % 2:
+            raise ValueError(f'Tile size {tile_size} is not even')
+        self.output = output
+        self.tiles_dir = f'{output}_files'
+        self.size = size
+        self.tile_size = tile_size
+        self.format = format_
+        # Options of `output.save`
+        self.options = options
+        self.max_level = math.ceil(math.log2(max(size[0], size[1], 1)))
+        self.tile_count = 0
+        self.top = _TileLevel(self, self.max_level, size[1])
+        self.__dirs = set()
+
+    def write_tile(self, level, column, row, tile : Image.Image):
+        level_dir = os.path.join(self.tiles_dir, str(level))
+        if level_dir not in self.__dirs:
+            os.makedirs(level_dir, exist_ok=True)
+            self.__dirs.add(level_dir)
+        save(tile, os.path.join(level_dir, f'{column}_{row}.{self.format}'), self.format, **self.options)
+        self.tile_count += 1
+
+    def push(self, strip : Image.Image):
+        self.top.push(strip)
+
+    def finish(self):
+        self.top.finish()
+
+    def dzi(self):
+        width, height = self.size
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<Image xmlns="{DZI_NAMESPACE}" Format="{self.format}" Overlap="0" TileSize="{self.tile_size}">\n'
+            f'  <Size Width="{width}" Height="{height}"/>\n'
+            '</Image>\n'
+        )
+
+def write_tiles(chart : _chart.Chart, track_meta : _chart.TrackMetaInfo, output, tile_size=256, format_='png', instrument=None, **options):
+    """
+    Render the chart into a Deep Zoom tile pyramid at `output` (a path without extension).
+    `options` are passed to `output.save` for every tile.
+    Returns the JSON manifest.
+    """
+    directory = os.path.dirname(output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    mapping = time_mapping(chart, track_meta)
+    size = (mapping['page_width'] * mapping['page_count'], mapping['page_height'])
+    writer = TileWriter(output, size, tile_size, format_, **options)
+    with _instrument.span(instrument, 'tiles') as span:
+        for page in chart.pages(track_meta, instrument):
+            with _instrument.span(instrument, 'tiles.write'):
+                writer.push(page)
+        with _instrument.span(instrument, 'tiles.write'):
+            writer.finish()
+        span.set(count=writer.tile_count)
+
+    manifest = {
+        'Image': {
+            'xmlns': DZI_NAMESPACE,
+            'Url': f'{os.path.basename(output)}_files/',
+            'Format': format_,
+            'Overlap': 0,
+            'TileSize': tile_size,
+            'Size': {'Width': size[0], 'Height': size[1]},
+        },
+        'levels': writer.max_level + 1,
+        'chart': mapping,
+    }
+    with open(f'{output}.dzi', 'w', encoding='utf8') as f:
+        f.write(writer.dzi())
+    with open(f'{output}.json', 'w', encoding='utf8') as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
@@ -0,0 +1,111 @@
+"""
+Watch mode: keep one process alive and re-render a chart whenever its file changes.
+
+The file is polled for its modification time and size. A change is rendered once the file
+has stayed the same for the debounce time, so that editors saving in several writes trigger one render.
+Presets, sprites and the pages of the last render are kept between renders, see `incremental.IncrementalRenderer`.
+"""
+import os
+import time
+import traceback
+from . import chart as _chart
+from . import reader
+from .output import save
+from .incremental import IncrementalRenderer
+
+def _file_state(file):
+    try:
+        stat = os.stat(file)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+class Watcher:
+    """
+        watcher = Watcher('chart.aff', preset, 'chart.png')
+        watcher.run()
+    """
+    def __init__(self, file, track_meta : _chart.TrackMetaInfo, output_file, format_='png', read_noinput=False,
+                 extra_width=None, columnar=False, interval=0.2, debounce=0.3, encode_options=None, log=None):
+        self.file = file
+        self.output_file = output_file
+        self.format = format_
+        self.read_noinput = read_noinput
+        self.columnar = columnar
+        self.interval = interval
+        self.debounce = debounce
+        self.log = log if log is not None else lambda message: print(message, flush=True)
+        self.renderer = IncrementalRenderer(track_meta, extra_width)
+        # Options of `output.save`. Encoding dominates the turnaround, so previews are compressed less by default
+        self.encode_options = dict(encode_options or {})
+        if format_.lower() == 'png' and self.encode_options.get('compress_level') is None:
+            self.encode_options['compress_level'] = 1
+        self.renders = 0
+        self.__text = None
+
+    def render(self):
+        """
+        Parse and render the file if its text changed since the last render, and save the image.
+        Errors are reported and the last image is kept, so that a chart saved in the middle of an edit does not stop watching.
+        Returns the wall time of the render, or None if nothing was rendered.
+        """
+        time_start = time.perf_counter()
+        try:
+            with open(self.file, 'r', encoding='utf8') as f:
+                text = f.read()
+            if text == self.__text:
+                return None
+            chart = reader.read(text, read_noinput=self.read_noinput, columnar=self.columnar)
+            time_parsed = time.perf_counter()
+            image = self.renderer.update(chart)
+            time_rendered = time.perf_counter()
+            if self.renderer.dirty or not os.path.exists(self.output_file):
+                # Viewers reloading the output never see a partial image
+                temp_file = f'{self.output_file}.tmp'
+                save(image, temp_file, self.format, **self.encode_options)
+                os.replace(temp_file, self.output_file)
+        except Exception:
+            self.log(f'{time.strftime("%H:%M:%S")} failed to render {self.file}:\n{traceback.format_exc(limit=3)}')
+            return None
+        self.__text = text
+        self.renders += 1
+        time_end = time.perf_counter()
+        self.log(
+            f'{time.strftime("%H:%M:%S")} rendered {self.output_file} in {time_end - time_start:.3f}s '
+            f'(parse {time_parsed - time_start:.3f}s, render {time_rendered - time_parsed:.3f}s, save {time_end - time_rendered:.3f}s, '
+            f'{len(self.renderer.dirty)} of {len(self.renderer.pages)} pages)'
+        )
+        return time_end - time_start
+
+    def run(self, max_renders=None):
+        """
+        Render the file, then poll it every `interval` seconds until interrupted,
+        or until `max_renders` renders if it is not None.
+        """
+        self.renderer.track_meta.preload()
+        self.log(f'Watching {self.file}, press Ctrl+C to stop.')
+        rendered_state = _file_state(self.file)
+        self.render()
+        pending_state, pending_since = None, 0.0
+        try:
+            while max_renders is None or self.renders < max_renders:
+                time.sleep(self.interval)
+                state = _file_state(self.file)
+                if state == rendered_state or state is None:
+                    pending_state = None
+                    continue
+                now = time.monotonic()
+                if state != pending_state:
+                    pending_state, pending_since = state, now
+                elif now - pending_since >= self.debounce:
+                    rendered_state, pending_state = state, None
+                    self.render()
+        except KeyboardInterrupt:
+            self.log('Stopped watching.')
+        return self.renders
+
+def watch(file, track_meta : _chart.TrackMetaInfo, output_file, **options):
+    """
+    `Watcher(file, track_meta, output_file, **options).run()`.
+    """
+    return Watcher(file, track_meta, output_file, **options).run()
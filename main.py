@@ -1,12 +1,15 @@
 import os
+import sys
 import argparse
-from lib.reader import read
-from lib import presets
+import contextlib
+from lib import render, reader, cache
+from lib.instrument import Instrument, span, profile
+from lib.output import save
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
 
-    parser.add_argument('id', type=str, help='Official file ID. If official file with this ID is not found, Arcachart will consider the value as a path instead.')
+    parser.add_argument('id', type=str, default=None, nargs='?', help='Official file ID. If official file with this ID is not found, Arcachart will consider the value as a path instead.')
     parser.add_argument('difficulty', type=int, default=None, nargs='?', help='Difficulty from 0 to 3. The default is the highest difficulty.')
     parser.add_argument('--preset', '-p', type=str, default=None, help='The preset of track style. The default value depends on song ID. Input "inverse" to get inversed preset depends on ID.')
     parser.add_argument('--speed', '-s', type=float, default=2000, help='Pixel per second (before zooming). The default value is 2000.')
@@ -23,84 +26,179 @@ if __name__ == '__main__':
     parser.add_argument('--ignore-black-line', '-B', action='store_true', help='To ignore draw black lines.')
     parser.add_argument('--read-noinput', '-n', action='store_true', help='To draw noinputs.')
     parser.add_argument('--format', type=str, default='png', help='The format of output image file.')
+    parser.add_argument('--chart-cache', type=str, default=reader.CACHE_DIR, help=f'The directory of compiled chart cache, reused while the content hash of the chart is the same. The default value is {reader.CACHE_DIR}.')
+    parser.add_argument('--columnar', action='store_true', help='To store notes, holds, arcs and timings as NumPy columns, which is faster for large charts.')
+    parser.add_argument('--no-chart-cache', action='store_true', help='To always parse the chart text without the compiled chart cache.')
+    parser.add_argument('--window', type=int, nargs=2, default=None, metavar=('START', 'END'),
+                        help='Only render the chart between START and END in ms, as one image named with the window.')
+
+    profile_group = parser.add_argument_group('profiling')
+    profile_group.add_argument('--profile', type=str, default=None,
+                               help='Profile the rendering with cProfile and write the stats to this file (as text if it ends with .txt).')
+    profile_group.add_argument('--trace', type=str, default=None,
+                               help='Write the spans of every rendering stage to this JSON file, which can be opened in chrome://tracing, and print a summary.')
+
+    output_group = parser.add_argument_group('output')
+    output_group.add_argument('--split-pages', type=int, default=None, metavar='N',
+                              help='To write every N pages as their own file, encoded in parallel, with a JSON manifest of their time ranges.')
+    output_group.add_argument('--encode-workers', type=int, default=None, help='Number of encoding threads of --split-pages. The default is the number of CPUs.')
+    output_group.add_argument('--compress-level', type=int, default=None, help='zlib compression level of PNG from 0 to 9. The default is the default of Pillow.')
+    output_group.add_argument('--optimize', action='store_true', help='To make smaller PNG, JPEG and WebP files at a higher encoding cost.')
+    output_group.add_argument('--quality', type=int, default=None, help='Quality of JPEG and WebP from 0 to 100. The default is the default of Pillow.')
+
+    tiles_group = parser.add_argument_group('tile pyramid')
+    tiles_group.add_argument('--tiles', action='store_true',
+                             help='To write a Deep Zoom tile pyramid (a .dzi manifest, a .json manifest with time to pixel mapping and a _files directory of tiles) instead of one image.')
+    tiles_group.add_argument('--tile-size', type=int, default=256, help='The size of tiles. The default value is 256.')
+
+    watch_group = parser.add_argument_group('watch mode')
+    watch_group.add_argument('--watch', '-w', action='store_true',
+                             help='To keep running and re-render the chart whenever its file changes, reusing unchanged pages.')
+    watch_group.add_argument('--watch-interval', type=float, default=0.2, help='Seconds between checks of the chart file. The default value is 0.2.')
+    watch_group.add_argument('--debounce', type=float, default=0.3,
+                             help='Seconds the chart file has to stay unchanged before it is rendered. The default value is 0.3.')
+
+    cache_group = parser.add_argument_group('render cache')
+    cache_group.add_argument('--render-cache', type=str, default=cache.CACHE_DIR,
+                             help=f'The directory of rendered images, reused when the chart, preset and options are the same. '
+                                  f'Windows, tiles and split pages are not cached. The default value is {cache.CACHE_DIR}.')
+    cache_group.add_argument('--render-cache-size', type=int, default=1024, help='The size of the render cache in MiB. The default value is 1024.')
+    cache_group.add_argument('--no-render-cache', action='store_true', help='To always render without reading or writing the render cache.')
+    cache_group.add_argument('--refresh-render-cache', action='store_true', help='To render again and replace the cached image. Implied by --profile and --trace.')
+
+    serve_group = parser.add_argument_group('server mode')
+    serve_group.add_argument('--serve', action='store_true',
+                             help='To serve rendering over HTTP (GET /render?id=...&difficulty=...&preset=...&speed=...&zoom=..., /metrics) on worker processes. '
+                                  'The rendering options are the defaults of requests.')
+    serve_group.add_argument('--host', type=str, default='127.0.0.1', help='The address to listen on. The default value is 127.0.0.1.')
+    serve_group.add_argument('--port', type=int, default=8000, help='The port to listen on. The default value is 8000.')
+    serve_group.add_argument('--queue-size', type=int, default=16, help='Requests waiting for a worker beyond which 429 is returned. The default value is 16.')
+    serve_group.add_argument('--job-timeout', type=float, default=60, help='Seconds a request may wait and render before 504 is returned. The default value is 60.')
+    serve_group.add_argument('--allow-paths', action='store_true', help='To also render chart files by path, not only official IDs.')
+
+    batch_group = parser.add_argument_group('batch mode')
+    batch_group.add_argument('--batch', action='store_true',
+                             help='To render every chart in the songlist (or matched by --glob) instead of a single ID.')
+    batch_group.add_argument('--songlist', type=str, default='assets/songs/songlist', help='The songlist file of batch mode. The default value is assets/songs/songlist.')
+    batch_group.add_argument('--glob', type=str, default=None, help='Render files matched by this pattern (e.g. "dl/*") instead of the songlist.')
+    batch_group.add_argument('--difficulties', type=int, nargs='+', default=[0, 1, 2, 3], help='Difficulties to render in batch mode. The default is all difficulties.')
+    batch_group.add_argument('--variants', type=str, nargs='+', default=['normal'],
+                             help='Preset variants to render in batch mode: "normal", "inverse" or a preset name. The default value is normal.')
+    batch_group.add_argument('--workers', '-j', type=int, default=None, help='Number of worker processes in batch and server mode. The default is the number of CPUs.')
+    batch_group.add_argument('--output-dir', '-o', type=str, default='.', help='Output directory of batch mode.')
+    batch_group.add_argument('--summary', type=str, default=None, help='Write a JSON summary of batch jobs with timings and failures to this file.')
 
     args = parser.parse_args()
 
     read_noinput = args.read_noinput
-
     format_ = args.format
+    chart_cache = None if args.no_chart_cache else args.chart_cache
+    render_cache_dir = None if args.no_render_cache else args.render_cache
+    render_cache_options = dict(
+        render_cache=render_cache_dir, render_cache_size=args.render_cache_size * 1024 * 1024, refresh_render_cache=args.refresh_render_cache,
+    )
+    render_options = dict(
+        speed=args.speed,
+        height=args.height,
+        zoom=args.zoom,
+        group_tolerance=args.arc_group_tolerance,
+        draw_black_line=not args.ignore_black_line,
+    )
+
+    if args.batch:
+        from lib import batch
+        if args.glob is not None:
+            jobs = batch.glob_jobs(args.glob, args.difficulties, args.variants)
+        else:
+            jobs = batch.songlist_jobs(batch.songlist_ids(args.songlist), args.difficulties, args.variants)
+        summary = batch.run(
+            jobs, output_dir=args.output_dir, workers=args.workers, format_=format_, summary_file=args.summary,
+            read_noinput=read_noinput, extra_width=args.extra_width, chart_cache=chart_cache, columnar=args.columnar,
+            **render_cache_options, **render_options,
+        )
+        print(f'{summary["succeeded"]} succeeded, {summary["failed"]} failed in {summary["wall_time"]:.2f}s with {summary["workers"]} workers.')
+        sys.exit(1 if summary['failed'] else 0)
+
+    if args.serve:
+        from lib import server
+        server.serve(
+            args.host, args.port, workers=args.workers, queue_size=args.queue_size, timeout=args.job_timeout,
+            read_noinput=read_noinput, extra_width=args.extra_width, chart_cache=chart_cache, columnar=args.columnar,
+            allow_paths=args.allow_paths, **render_cache_options, **render_options,
+        )
+        sys.exit(0)
+
+    if args.id is None:
+        parser.error('the following arguments are required: id')
+    if args.split_pages is not None and args.split_pages < 1:
+        parser.error('--split-pages must be at least 1')
+    if args.window is not None and (args.tiles or args.split_pages is not None):
+        parser.error('--window is not supported with --tiles or --split-pages')
+    if args.tiles and args.split_pages is not None:
+        parser.error('--tiles and --split-pages cannot be used together')
 
     file_id = args.id
     file_diff = args.difficulty
-    if file_diff is None:
-        diffs = (3, 2, 1, 0)
-    else:
-        diffs = (file_diff, )
-
-    file = None
-    final_diff = None
-    preset_name = args.preset
-    preset = None
-
-    if not os.path.isabs(file_id):
-        songs_dir = f'assets/songs/{file_id}'
-        if os.path.isdir(songs_dir):
-            for diff in diffs:
-                _file = f'{songs_dir}/{diff}.aff'
-                if os.path.isfile(_file):
-                    file = _file
-                    final_diff = diff
-                    break
-        if file is None:
-            for diff in diffs:
-                _file = f'dl/{file_id}_{diff}'
-                if os.path.isfile(_file):
-                    file = _file
-                    final_diff = diff
-                    break
-        if file is not None:
-            if preset_name is None:
-                preset = presets.from_id(file_id)
-            elif preset_name == 'inverse':
-                preset = presets.from_id_inverse(file_id)
-    if file is None:
-        for diff in diffs:
-            _file = f'{file_id}_{diff}'
-            if os.path.isfile(_file):
-                file = _file
-                final_diff = diff
-                break
-    if file is None:
-        if os.path.isfile(file_id):
-            file = file_id
-            final_diff = None
+    file, final_diff, official = render.locate(file_id, file_diff)
     assert file is not None, f'ID {file_id} with {"unspecified difficulty" if file_diff is None else "difficulty %d" % file_diff} is not found.'
-    if final_diff is not None:
-        output_file = f'{file_id}_{final_diff}.{format_}'
-    else:
-        output_file = f'{file_id}.{format_}'
-
-    if preset is None:
-        preset = presets.get(preset_name)
-    if preset is None:
-        preset = presets.get('default')
-
-    preset.speed = args.speed
-    preset.group_tolerance = args.arc_group_tolerance
-    preset.zoom = args.zoom
-    preset.draw_black_line = not args.ignore_black_line
-    preset.height_limit = args.height
-
-    with open(file, 'r', encoding='utf8') as f:
-        chart_data = f.read()
-    chart = read(chart_data, read_noinput=read_noinput)
-
-    extra_width = args.extra_width
-    if extra_width is None:
-        extra_width = chart.max_extra_width(ignore_black=True)
-    elif extra_width < 0:
-        extra_width = chart.max_extra_width(ignore_black=False)
-    preset.extra_width = extra_width
-
-    image = chart.image(preset)
-    image.save(output_file, format=format_)
+    output_file = render.output_name(file_id, final_diff, format_, '' if args.window is None else '_%d-%d' % tuple(args.window))
+
+    preset = render.get_preset(file_id, args.preset, official)
+    render.configure(preset, **render_options)
+
+    encode_options = dict(compress_level=args.compress_level, optimize=args.optimize, quality=args.quality)
+    if args.watch:
+        if args.window is not None or args.tiles or args.split_pages is not None:
+            parser.error('--window, --tiles and --split-pages are not supported in watch mode')
+        from lib import watch
+        watch.watch(
+            file, preset, output_file, format_=format_, read_noinput=read_noinput, extra_width=args.extra_width,
+            columnar=args.columnar, interval=args.watch_interval, debounce=args.debounce, encode_options=encode_options,
+        )
+        sys.exit(0)
+
+    cache_key = None
+    if render_cache_dir is not None and args.window is None and not args.tiles and args.split_pages is None:
+        render_cache = cache.RenderCache(render_cache_dir, args.render_cache_size * 1024 * 1024)
+        cache_key = cache.render_key(file, preset, args.extra_width, read_noinput, format_, **encode_options)
+        # Profiling and tracing measure a render, so they never copy from the cache
+        lookup = not args.refresh_render_cache and args.profile is None and args.trace is None
+        if lookup and render_cache.copy(cache_key, format_, output_file):
+            print(f'Copied {output_file} from the render cache.')
+            sys.exit(0)
+
+    instrument = None
+    if args.trace is not None:
+        instrument = Instrument()
+    with contextlib.ExitStack() as stack:
+        if args.profile is not None:
+            stack.enter_context(profile(args.profile))
+        with span(instrument, 'read'):
+            chart = render.load(file, read_noinput=read_noinput, cache_dir=chart_cache, columnar=args.columnar)
+        if args.split_pages is not None:
+            from lib import output
+            render.apply_extra_width(chart, preset, args.extra_width)
+            output_file = os.path.splitext(output_file)[0]
+            manifest = output.write_pages(
+                chart, preset, output_file, format_, pages_per_file=args.split_pages, workers=args.encode_workers,
+                instrument=instrument, **encode_options,
+            )
+            print(f'Wrote {len(manifest["files"])} files and {output_file}_pages.json.')
+        elif args.tiles:
+            from lib import tiles
+            render.apply_extra_width(chart, preset, args.extra_width)
+            output_file = os.path.splitext(output_file)[0]
+            manifest = tiles.write_tiles(chart, preset, output_file, args.tile_size, format_, instrument=instrument, **encode_options)
+            print(f'Wrote {output_file}.dzi with {manifest["levels"]} levels.')
+        else:
+            if args.window is None:
+                image = render.render(chart, preset, args.extra_width, instrument=instrument)
+            else:
+                image = render.render_window(chart, preset, *args.window, extra_width=args.extra_width, instrument=instrument)
+            with span(instrument, 'save'):
+                save(image, output_file, format_, **encode_options)
+            if cache_key is not None:
+                render_cache.put_file(cache_key, format_, output_file)
+    if instrument is not None:
+        instrument.write(args.trace)
+        print(instrument.format_summary())